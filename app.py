@@ -1,46 +1,101 @@
 # app.py
 # app.py
-import json
+import asyncio
+import functools
 import logging
 import os
+import numpy as np
 import streamlit as st
-from anytree import PreOrderIter, Node
 import inspect
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
+try:
+    import ijson  # Optional: streams large uploads instead of loading the whole JSON document
+except ImportError:
+    ijson = None
 
+
+from config import LOG_LEVEL
 from downstream_processor import DownstreamProcessor
 from hierarchy_builder import HierarchyBuilder
-from llm_interface import LLMInterface
+from llm_interface import BatchCollector, LLMInterface, closing_async_client, gather_requests
 from prompt_builder import PromptBuilder
-from visualizer import Visualizer
-from utils import save_hierarchy_to_file, save_hierarchy_to_markdown
+from visualizer import Visualizer, mark_hierarchy_changed
+from utils import JobNode, get_path_str, loads_json, save_hierarchy_to_file, save_hierarchy_to_markdown
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
+# httpx logs every LLM request at INFO; keep that out of the hot path unless debugging
+if LOG_LEVEL != "DEBUG":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # Set the page layout to wide
 st.set_page_config(layout="wide")
 
+# Downstream steps run for each selected job (see process_job_async); child steps run under the
+# last node their parent step adds
+JOB_STEPS = [
+    {
+        'step': 'Job Contexts',
+        'n': 10,
+        'children_steps': [
+            {
+                'step': 'Job Map',
+                'n': 0,
+                'children_steps': [
+                    # One call returns both the desired outcomes and their themed grouping
+                    {'step': 'Desired Outcomes with Themes', 'n': 20, 'kwargs': {'n_themed': 10}},
+                ]
+            },
+            {'step': 'Situational and Complexity Factors', 'n': 10},
+            {'step': 'Related Jobs', 'n': 10},
+            {'step': 'Emotional Jobs', 'n': 10},
+            {'step': 'Social Jobs', 'n': 10},
+            {'step': 'Financial Metrics of Purchasing Decision Makers', 'n': 10},
+            {
+                'step': 'Ideal Job State',
+                'n': 15,
+                'children_steps': [
+                    {'step': 'Potential Root Causes Preventing the Ideal State', 'n': 15},
+                ]
+            },
+        ]
+    }
+]
+
+
+def ui_error(message):
+    """
+    Error sink for DownstreamProcessor: shows the message with st.error inside a Streamlit
+    session, and only logs it when the processor runs without one (background tasks, scripts).
+    """
+    if get_script_run_ctx(suppress_warning=True) is None:
+        logging.error(message)
+        return
+    st.error(message)
+
+
 def main():
     st.title("Industry Hierarchy Builder")
 
     # Sidebar for options
     st.sidebar.header("Options")
     option = st.sidebar.selectbox("Choose an action", ["Generate New Hierarchy", "Load Existing Hierarchy"])
+    batch_mode = st.sidebar.checkbox("Batch mode (50% cost, results within 24h)", value=False)
 
     # Initialize components
     llm = LLMInterface()
     prompt_builder = PromptBuilder()
     hierarchy_builder = HierarchyBuilder(llm, prompt_builder)
     visualizer = Visualizer()
-    downstream_processor = DownstreamProcessor(prompt_builder, llm)
+    downstream_processor = DownstreamProcessor(prompt_builder, llm, error_sink=ui_error)
 
     if option == "Generate New Hierarchy":
-        generate_new_hierarchy(hierarchy_builder, downstream_processor, visualizer)
+        generate_new_hierarchy(hierarchy_builder, downstream_processor, visualizer, batch_mode)
     elif option == "Load Existing Hierarchy":
-        load_existing_hierarchy(hierarchy_builder, downstream_processor, visualizer)
+        load_existing_hierarchy(hierarchy_builder, downstream_processor, visualizer, batch_mode)
 
 
-def generate_new_hierarchy(hierarchy_builder, downstream_processor, visualizer):
+def generate_new_hierarchy(hierarchy_builder, downstream_processor, visualizer, batch_mode=False):
     st.header("Generate a New Hierarchy")
 
     industry = st.text_input("Enter the Industry", value="Finance")
@@ -50,24 +105,27 @@ def generate_new_hierarchy(hierarchy_builder, downstream_processor, visualizer):
 
     if st.button("Build Hierarchy"):
         with st.spinner("Building hierarchy..."):
-            hierarchy_root = hierarchy_builder.build_hierarchy(industry, fidelity, n_end_users, n_jobs)
+            progress_callback = None
+            if batch_mode:
+                progress_bar = st.progress(0.0, text="Submitting batch...")
+                progress_callback = functools.partial(report_batch_progress, progress_bar)
+            hierarchy_root = hierarchy_builder.build_hierarchy(industry, fidelity, n_end_users, n_jobs,
+                                                               batch=batch_mode, progress_callback=progress_callback)
+            mark_hierarchy_changed(hierarchy_root)
             visualizer.display_hierarchy(hierarchy_root)
             # Save hierarchy
             json_filename = f"{industry}_hierarchy.json"
-            save_hierarchy_to_file(hierarchy_root, json_filename)
-            save_hierarchy_to_markdown(json_filename, f"{industry}_hierarchy_output.md")
-            st.success(f"Hierarchy built and saved to {json_filename} and {industry}_hierarchy_output.txt")
-            # Provide download links
-            with open(json_filename, 'r') as f:
-                json_data = f.read()
-            st.download_button("Download JSON", json_data, file_name=json_filename, mime="application/json")
-            with open(f"{industry}_hierarchy_output.txt", 'r') as f:
-                text_data = f.read()
-            st.download_button("Download Hierarchical Text", text_data, file_name=f"{industry}_hierarchy_output.txt", mime="text/plain")
+            markdown_filename = f"{industry}_hierarchy_output.md"
+            json_bytes = save_hierarchy_to_file(hierarchy_root, json_filename)
+            markdown_text = save_hierarchy_to_markdown(hierarchy_root, markdown_filename)
+            st.success(f"Hierarchy built and saved to {json_filename} and {markdown_filename}")
+            # Provide download links straight from the serialized data
+            st.download_button("Download JSON", json_bytes, file_name=json_filename, mime="application/json")
+            st.download_button("Download Hierarchical Text", markdown_text, file_name=markdown_filename, mime="text/markdown")
             # Proceed to job selection
-            display_job_selection(hierarchy_builder, downstream_processor, visualizer)
+            display_job_selection(hierarchy_builder, downstream_processor, visualizer, batch_mode)
 
-def load_existing_hierarchy(hierarchy_builder, downstream_processor, visualizer):
+def load_existing_hierarchy(hierarchy_builder, downstream_processor, visualizer, batch_mode=False):
     st.header("Load an Existing Hierarchy")
 
     uploaded_file = st.file_uploader("Upload Hierarchy JSON", type=["json"])
@@ -75,48 +133,100 @@ def load_existing_hierarchy(hierarchy_builder, downstream_processor, visualizer)
     if uploaded_file is not None:
         with st.spinner("Loading hierarchy..."):
             try:
-                hierarchy_data = json.load(uploaded_file)
-                # Convert JSON to anytree Node structure
-                hierarchy_root = json_to_anytree(hierarchy_data)
-                hierarchy_builder.job_nodes = get_job_nodes(hierarchy_root)
+                # Build the JobNode tree while parsing the upload
+                hierarchy_root = load_hierarchy_stream(uploaded_file)
+                hierarchy_builder.index_tree(hierarchy_root)
+                mark_hierarchy_changed(hierarchy_root)
                 visualizer.display_hierarchy(hierarchy_root)
                 st.success("Hierarchy loaded successfully.")
                 # Proceed to job selection
-                display_job_selection(hierarchy_builder, downstream_processor, visualizer)
+                display_job_selection(hierarchy_builder, downstream_processor, visualizer, batch_mode)
             except Exception as e:
                 st.error(f"Error loading hierarchy: {e}")
 
 def json_to_anytree(data, parent=None):
+    """
+    Builds a JobNode tree from hierarchy JSON. Uses an explicit stack instead of recursion
+    so deep or very large hierarchies load without Python call overhead.
+    """
     # Check if data is None or empty
     if not data:
         return None
 
-    try:
-        # Create a new node if data is valid
-        node = Node(
-            data['name'],
-            parent=parent,
-            description=data.get('description', ''),
-            processed=data.get('processed', False)
-        )
-    except KeyError as e:
-        st.error(f"Missing key in data: {e}. Data: {data}")
-        return None  # Return None if the node cannot be created
-
-    for child in data.get('children', []):
-        json_to_anytree(child, parent=node)
-
-    return node
-
-def get_job_nodes(root):
-    job_nodes = []
-    for node in PreOrderIter(root):
-        # Assuming Jobs are leaf nodes (no children)
-        if not node.children:
-            job_nodes.append(node)
-    return job_nodes
-
-def display_job_selection(hierarchy_builder, downstream_processor, visualizer):
+    root = None
+    stack = [(data, parent)]
+    while stack:
+        node_data, parent_node = stack.pop()
+        try:
+            # Create a new node if data is valid
+            node = JobNode(
+                node_data['name'],
+                parent=parent_node,
+                description=node_data.get('description', ''),
+                processed=node_data.get('processed', False)
+            )
+        except KeyError as e:
+            st.error(f"Missing key in data: {e}. Data: {node_data}")
+            continue  # Skip this subtree if the node cannot be created
+        if root is None:
+            root = node
+        # Reversed so children are popped, and therefore attached, in their original order
+        stack.extend((child, node) for child in reversed(node_data.get('children', [])))
+
+    return root
+
+def load_hierarchy_stream(file_obj):
+    """
+    Builds a JobNode tree from a hierarchy JSON file. With ijson installed, nodes are created
+    directly from parse events, so the intermediate dict tree is never materialized; otherwise
+    falls back to loads_json + json_to_anytree.
+    """
+    if ijson is None:
+        return json_to_anytree(loads_json(file_obj.read()))
+
+    root = None
+    # Frames of (node, prefix) for the node maps currently open
+    stack = []
+    for prefix, event, value in ijson.parse(file_obj):
+        if event == 'start_map' and (prefix == '' or prefix.endswith('children.item')):
+            if stack and prefix != f"{stack[-1][1]}.children.item".lstrip('.'):
+                continue  # A map nested somewhere other than a children list
+            node = JobNode(None, parent=stack[-1][0] if stack else None)
+            stack.append((node, prefix))
+            if root is None:
+                root = node
+        elif event == 'end_map' and stack and prefix == stack[-1][1]:
+            node, _ = stack.pop()
+            if node.name is None:
+                st.error(f"Missing key in data: 'name'. Node description: {node.description!r}")
+                # Skip this subtree if the node cannot be created
+                if node is root:
+                    return None
+                node.parent = None
+        elif event in ('string', 'boolean', 'number') and stack:
+            node, node_prefix = stack[-1]
+            key = prefix[len(node_prefix):].lstrip('.')
+            if key == 'name':
+                node.name = value
+            elif key == 'description':
+                node.description = value
+            elif key == 'processed':
+                node.processed = bool(value)
+
+    return root
+
+def filter_job_paths(job_paths, search_query):
+    """
+    Case-insensitive substring filter over job paths, run as one vectorized pass over a
+    lowercased NumPy string array instead of lowercasing each path in Python.
+    """
+    if not search_query or not job_paths:
+        return job_paths
+    paths_lower = np.char.lower(np.asarray(job_paths, dtype=str))
+    mask = np.char.find(paths_lower, search_query.lower()) >= 0
+    return [job_paths[i] for i in np.flatnonzero(mask)]
+
+def display_job_selection(hierarchy_builder, downstream_processor, visualizer, batch_mode=False):
     st.header("Select Jobs for Further Processing")
 
     if not hierarchy_builder.job_nodes:
@@ -124,22 +234,11 @@ def display_job_selection(hierarchy_builder, downstream_processor, visualizer):
         return
 
     # Create a list of job paths for display
-    job_paths = ["/".join([ancestor.name for ancestor in job_node.path]) for job_node in hierarchy_builder.job_nodes]
-
-    # Ensure job_paths is a real list for testing purposes
-    job_paths = list(job_paths)  # Convert to list in case it's a generator or mock
+    job_paths = [get_path_str(job_node) for job_node in hierarchy_builder.job_nodes]
 
     # Search box
     search_query = st.text_input("Search Jobs")
-    if search_query:
-        filtered_jobs = [path for path in job_paths if search_query.lower() in path.lower()]
-    else:
-        filtered_jobs = job_paths
-
-    # Convert filtered_jobs to a real list and total_jobs to an integer
-    filtered_jobs = list(filtered_jobs)
-    total_jobs = len(filtered_jobs)
-    assert isinstance(total_jobs, int), "total_jobs must be an integer"
+    filtered_jobs = filter_job_paths(job_paths, search_query)
 
     # # Pagination variables
     # page_size = 10
@@ -160,17 +259,25 @@ def display_job_selection(hierarchy_builder, downstream_processor, visualizer):
             return
         with st.spinner("Processing selected Jobs..."):
             # Retrieve selected Job nodes
-            selected_job_nodes = [node for node, path in zip(hierarchy_builder.job_nodes, job_paths) if path in selected_jobs]
-            for job_node in selected_job_nodes:
-                process_job(job_node, downstream_processor, hierarchy_builder, visualizer)
+            selected_paths = set(selected_jobs)
+            selected_job_nodes = [node for node, path in zip(hierarchy_builder.job_nodes, job_paths) if path in selected_paths]
+            if batch_mode:
+                process_jobs_batch(selected_job_nodes, downstream_processor, hierarchy_builder)
+            else:
+                # Show each step's output as it is generated instead of only a spinner
+                live_output = st.expander("Live LLM output", expanded=True)
+                downstream_processor.stream_callback = stream_to_placeholders(live_output)
+                # Jobs are independent of each other, so process them concurrently
+                asyncio.run(closing_async_client(
+                    process_jobs_async(selected_job_nodes, downstream_processor, hierarchy_builder)))
+                # Steps only buffer their changes; write the hierarchy once for the whole gather
+                downstream_processor.flush(hierarchy_builder.root, hierarchy_json_filename(hierarchy_builder))
             # Save updated hierarchy
-            json_filename = f"{hierarchy_builder.industry}_hierarchy.json"
-            save_hierarchy_to_file(hierarchy_builder.root, json_filename)
-            save_hierarchy_to_markdown(json_filename, 
-                                   f"{hierarchy_builder.industry}_hierarchy_output.md"
-                                  )
+            save_hierarchy_to_markdown(hierarchy_builder.root,
+                                       f"{hierarchy_builder.industry}_hierarchy_output.md")
             st.success("Selected Jobs have been processed and hierarchy updated.")
             # Refresh visualization
+            mark_hierarchy_changed(hierarchy_builder.root)
             visualizer.display_hierarchy(hierarchy_builder.root)
 
 # # def process_job(job_node, downstream_processor, hierarchy_builder, visualizer):
@@ -226,7 +333,79 @@ def display_job_selection(hierarchy_builder, downstream_processor, visualizer):
 #     # Optionally, update the hierarchy visualization
 #     visualizer.display_hierarchy(hierarchy_builder.root)
 
+def hierarchy_json_filename(hierarchy_builder):
+    """
+    JSON file the hierarchy of hierarchy_builder's industry is saved to.
+    """
+    return f"{hierarchy_builder.industry}_hierarchy.json"
+
+
+def stream_to_placeholders(container):
+    """
+    Returns a stream_callback that renders each step's partial LLM output in its own placeholder.
+    """
+    placeholders = {}
+
+    def on_chunk(node, step, text):
+        key = (id(node), step)
+        if key not in placeholders:
+            placeholders[key] = container.empty()
+        placeholders[key].markdown(f"**{node.name} — {step}**\n\n{text}")
+
+    return on_chunk
+
+
 def process_job(job_node, downstream_processor, hierarchy_builder, visualizer):
+    """
+    Processes a single job node by executing downstream steps in a hierarchical order.
+    See process_job_async for the hierarchy that is constructed.
+    """
+    asyncio.run(closing_async_client(process_job_async(job_node, downstream_processor, hierarchy_builder)))
+    downstream_processor.flush(hierarchy_builder.root, hierarchy_json_filename(hierarchy_builder))
+
+    # Optionally, update the hierarchy visualization
+    mark_hierarchy_changed(hierarchy_builder.root)
+    visualizer.display_hierarchy(hierarchy_builder.root)
+
+
+async def process_jobs_async(job_nodes, downstream_processor, hierarchy_builder):
+    """
+    Processes several job nodes concurrently. Each step runs for every job at once, so one
+    level of the step hierarchy is in flight for all jobs together.
+    """
+    await process_job_steps(job_nodes, JOB_STEPS, downstream_processor, hierarchy_builder)
+    for job_node in job_nodes:
+        hierarchy_builder.mark_processed(job_node)
+
+
+def report_batch_progress(progress_bar, batch):
+    """
+    Shows an OpenAI Batch job's completed request count on a Streamlit progress bar.
+    """
+    counts = batch.request_counts
+    total = counts.total if counts and counts.total else 0
+    done = (counts.completed + counts.failed) if counts else 0
+    progress_bar.progress(done / total if total else 0.0,
+                          text=f"Batch {batch.id}: {batch.status} ({done}/{total})")
+
+
+def process_jobs_batch(job_nodes, downstream_processor, hierarchy_builder):
+    """
+    Processes several job nodes through the OpenAI Batch API. Each level of the step
+    hierarchy across all jobs is submitted as one batch, with a progress bar while polling.
+    """
+    progress_bar = st.progress(0.0, text="Submitting batch...")
+    collector = BatchCollector(downstream_processor.llm,
+                               progress_callback=functools.partial(report_batch_progress, progress_bar))
+    batch_processor = DownstreamProcessor(downstream_processor.prompt_builder, collector,
+                                          prompt_parser=downstream_processor.prompt_parser,
+                                          error_sink=downstream_processor.error_sink)
+    asyncio.run(closing_async_client(
+        collector.run(process_jobs_async(job_nodes, batch_processor, hierarchy_builder))))
+    batch_processor.flush(hierarchy_builder.root, hierarchy_json_filename(hierarchy_builder))
+
+
+async def process_job_async(job_node, downstream_processor, hierarchy_builder):
     """
     Processes a single job node by executing downstream steps in a hierarchical order.
     Constructs the following hierarchy:
@@ -244,103 +423,71 @@ def process_job(job_node, downstream_processor, hierarchy_builder, visualizer):
     │   ├── Ideal Job State
     │   │   ├── Potential Root Causes Preventing the Ideal State
     """
+    await process_jobs_async([job_node], downstream_processor, hierarchy_builder)
+
+
+async def process_job_steps(nodes, steps_list, downstream_processor, hierarchy_builder):
+    """
+    Runs steps_list for each of nodes. Sibling steps are dispatched concurrently, and each step
+    runs for all nodes at once: batchable steps share requests through process_step_batch, the
+    rest go through aprocess_siblings. Child steps only start once their parent step has
+    produced a node to attach to.
+    """
     fidelity = hierarchy_builder.fidelity
     temp = 0.1  # or fetch dynamically
 
-    # Define the hierarchical steps with nested child steps
-    steps = [
-        {
-            'step': 'Job Contexts',
-            'n': 10,
-            'children_steps': [
-                {
-                    'step': 'Job Map',
-                    'n': 0,
-                    'children_steps': [
-                        {'step': 'Desired Outcomes (success metrics)', 'n': 20},
-                        {'step': 'Themed Desired Outcomes (Themed Success Metrics)', 'n': 10},
-                    ]
-                },
-                {'step': 'Situational Complexity Factors', 'n': 10},
-                {'step': 'Related Jobs', 'n': 10},
-                {'step': 'Emotional Jobs', 'n': 10},
-                {'step': 'Social Jobs', 'n': 10},
-                {'step': 'Financial Metrics of Purchasing Decision Makers', 'n': 10},
-                {
-                    'step': 'Ideal Job State',
-                    'n': 15,
-                    'children_steps': [
-                        {'step': 'Potential Root Causes Preventing the Ideal State', 'n': 15},
-                    ]
-                },
-            ]
-        }
-    ]
-
-    def process_steps(current_node, steps_list):
-        for step in steps_list:
-            step_name = step['step']
-            n = step['n']
-            # Dynamically construct the method name
-            method_name = f"process_{step_name.lower().replace(' ', '_').replace('(', '').replace(')', '')}"
-            
-            # Get the processing method from downstream_processor
-            processing_method = getattr(downstream_processor, method_name, None)
-            if processing_method:
-                # Get current number of children before processing
-                initial_children_count = len(current_node.children)
-                # Log the processing step
-                logging.debug(f"Processing step '{step_name}' under '{current_node.name}'")
-                # Pass only the required arguments
-                if method_name == "process_job_map":
-                    # process_job_map requires only (node, fidelity, temp)
-                    processing_method(current_node, fidelity, temp)
-                else:
-                    # Default case: Pass (node, n, fidelity, temp) if method expects those arguments
-                    processing_method(current_node, n, fidelity, temp)
-                # Get the new child added (assumes one child per step)
-                if len(current_node.children) > initial_children_count:
-                    new_child = current_node.children[-1]
-                    logging.debug(f"Added '{new_child.name}' under '{current_node.name}'")
-                else:
-                    logging.error(f"No new child added for step: {step_name}")
-                    continue
-            else:
-                logging.error(f"No processing method found for step: {step_name}")
+    def start(step):
+        step_name = step['step']
+        logging.debug("Processing step '%s' under %s nodes", step_name, len(nodes))
+        # Batched responses are not streamed, so live output keeps one request per node
+        if (len(nodes) > 1 and step_name in downstream_processor.batchable_steps
+                and not downstream_processor.stream_callback):
+            return downstream_processor.process_step_batch(nodes, step_name, step['n'])
+        return downstream_processor.aprocess_siblings(nodes, step_name, step['n'], fidelity, temp,
+                                                      **step.get('kwargs', {}))
+
+    async def finish(step, pending):
+        step_name = step['step']
+        results = await pending
+
+        # Siblings run concurrently, so use the children returned by this step rather than
+        # the last child of each node (assumes one child per step)
+        new_nodes = []
+        for node, new_children in zip(nodes, results):
+            if not new_children:
+                logging.error("No new child added for step '%s' under '%s'", step_name, node.name)
                 continue
+            hierarchy_builder.track_new_nodes(new_children)
+            new_nodes.append(new_children[-1])
+            logging.debug("Added '%s' under '%s'", new_children[-1].name, node.name)
 
-            # Recursively process child steps if any
-            if 'children_steps' in step:
-                process_steps(new_child, step['children_steps'])
-
-            # After processing, mark the node as processed to prevent reprocessing
-            new_child.processed = True
-            logging.debug(f"Marked '{new_child.name}' as processed.")
-
-    # Start processing from the root job_node
-    process_steps(job_node, steps)
+        # Recursively process child steps if any
+        if 'children_steps' in step and new_nodes:
+            await process_job_steps(new_nodes, step['children_steps'], downstream_processor, hierarchy_builder)
 
-    # After processing all steps, mark the job as processed
-    job_node.processed = True
+        # After processing, mark the nodes as processed to prevent reprocessing
+        for new_child in new_nodes:
+            hierarchy_builder.mark_processed(new_child)
 
-    # Optionally, update the hierarchy visualization
-    visualizer.display_hierarchy(hierarchy_builder.root)
+    # Every sibling step is started (nodes checked, prompts built) before any is awaited: the
+    # first to finish marks the nodes processed, which would make later-starting siblings skip
+    await gather_requests(*[finish(step, start(step)) for step in steps_list])
 
 
-def handle_user_selection(downstream_processor, root_node, visualizer):
+def handle_user_selection(downstream_processor, hierarchy_builder, visualizer):
     # Display current hierarchy
-    visualizer.display_hierarchy(root_node)
+    visualizer.display_hierarchy(hierarchy_builder.root)
 
     # Display selection options for further expansion
     st.header("Select Nodes for Expansion")
-    unprocessed_nodes = [node for node in PreOrderIter(root_node) if not node.processed]
+    unprocessed_nodes = list(hierarchy_builder.unprocessed_nodes.values())
     options = [node.name for node in unprocessed_nodes]
 
     selected_option = st.selectbox("Choose a node to expand further", options)
     if selected_option:
         # Find and process the selected node
-        selected_node = next(node for node in PreOrderIter(root_node) if node.name == selected_option)
-        process_job(selected_node, downstream_processor, root_node, visualizer)
+        selected_node = unprocessed_nodes[options.index(selected_option)]
+        process_job(selected_node, downstream_processor, hierarchy_builder, visualizer)
         
 
 def main_app():
@@ -6,3 +6,42 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # Ensure this environment variable
 MODEL_NAME = "gpt-4o-mini"
 TEMPERATURE = 0.6
 MAX_TOKENS = 500
+# Concurrency limits for async LLM calls
+MAX_CONCURRENCY = 8
+RATE_LIMIT_RPM = 500
+# Retries for rate-limited (429), timed-out and 5xx requests; the OpenAI client backs off
+# exponentially with jitter and honours Retry-After headers
+MAX_RETRIES = 6
+# One pooled HTTP client per process; HTTP/2 multiplexes requests when the h2 package is installed
+HTTP2_ENABLED = True
+HTTP_TIMEOUT = 60.0  # seconds
+# Connections kept per MongoDB client; one client is shared per URI (see mongo_manager.get_client)
+MONGO_MAX_POOL_SIZE = 50
+# Jobs per request when one step is run for many sibling jobs at once (process_step_batch)
+STEP_BATCH_SIZE = 10
+# Ask for JSON-schema structured outputs on non-streamed steps, so responses are decoded as
+# JSON instead of being parsed out of markdown lists
+STRUCTURED_OUTPUTS_ENABLED = False
+# Seconds between status polls when running steps through the OpenAI Batch API
+BATCH_POLL_INTERVAL = 30
+# Disk cache of LLM responses so identical prompts are not re-sent across reruns
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_PATH = "llm_response_cache.sqlite3"
+RESPONSE_CACHE_TTL = 86400  # seconds
+# Responses sampled above this temperature are neither served from nor stored in the cache, so
+# only near-deterministic responses are replayed (None caches every temperature)
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.1
+# Semantic lookup: serve a cached response when prompt embeddings are nearly identical
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_THRESHOLD = 0.97
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Minimum seconds between progress snapshots while a hierarchy is being built; changes made in
+# between are coalesced into the next snapshot, and the final one is always written
+HIERARCHY_SAVE_INTERVAL = 5.0
+# Write progress snapshots as parallel columns instead of nested node dicts; smaller and faster
+# for large hierarchies, but only readable by tools that go through utils.dict_to_tree
+HIERARCHY_COLUMNAR_SAVES = False
+# SQLite file the console app keeps its hierarchy in, one row per node
+HIERARCHY_STORE_PATH = "hierarchy.sqlite3"
+# Set JTBD_DEBUG=1 to enable verbose debug logging
+LOG_LEVEL = "DEBUG" if os.getenv("JTBD_DEBUG") == "1" else "INFO"
@@ -1,33 +1,35 @@
 # console_app.py
-import json
+import argparse
+import asyncio
 import logging
-from anytree import Node, RenderTree, PreOrderIter
+from anytree import Node, RenderTree
+from config import LOG_LEVEL, MAX_CONCURRENCY
 from downstream_processor import DownstreamProcessor
 from hierarchy_builder import HierarchyBuilder
-from llm_interface import LLMInterface
+from hierarchy_store import HierarchyStore
+from llm_interface import LLMInterface, closing_async_client
 from prompt_builder import PromptBuilder
-from utils import save_hierarchy_to_file, dict_to_tree
-from method_mapping import STEP_NAME_TO_METHOD  # Import the mapping
+from utils import HierarchyArray, dict_to_tree, iter_unprocessed, loads_json, save_hierarchy_to_file
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # Load an existing JSON hierarchy or create a new one
 def load_hierarchy(file_path="Finance_hierarchy_old.json"):
     try:
-        with open(file_path, 'r') as f:
-            hierarchy_dict = json.load(f)
+        with open(file_path, 'rb') as f:
+            hierarchy_dict = loads_json(f.read())
             root_node = dict_to_tree(hierarchy_dict)
-            logging.info(f"Hierarchy loaded successfully from {file_path}.")
+            logging.info("Hierarchy loaded successfully from %s.", file_path)
             # After loading the root node
             # print("Full Paths of All Nodes:")
             # print_node_paths(root_node)
             return root_node
     except FileNotFoundError:
-        logging.warning(f"{file_path} not found. Creating a new hierarchy from scratch.")
+        logging.warning("%s not found. Creating a new hierarchy from scratch.", file_path)
         return None
     except Exception as e:
-        logging.error(f"Failed to load hierarchy: {e}")
+        logging.error("Failed to load hierarchy: %s", e)
         return None
 
 
@@ -36,15 +38,15 @@ def print_node_paths(root):
     """
     Prints the full paths for all nodes in the hierarchy to identify where 'High Level Jobs' might be.
     """
-    for node in PreOrderIter(root):
-        path = " -> ".join([ancestor.name for ancestor in node.path])
+    array = get_hierarchy_array(root)
+    for node, path in zip(array.nodes, array.paths(sep=" -> ")):
         print(f"{path} (Processed: {node.processed})")
 
 
 # Save the hierarchy to a JSON file
 def save_hierarchy(root, file_path="hierarchy.json"):
     save_hierarchy_to_file(root, file_path)
-    logging.info(f"Hierarchy saved to {file_path}.")
+    logging.info("Hierarchy saved to %s.", file_path)
 
 
 # Display all leaf nodes (job nodes) in the hierarchy
@@ -52,12 +54,12 @@ def display_leaf_nodes(root):
     """
     Display all leaf nodes in the hierarchy with their full paths.
     """
-    leaf_nodes = get_job_nodes(root)
-    print(f"\nTotal Job Nodes (Leaf Nodes): {len(leaf_nodes)}\n")
-    for node in leaf_nodes:
+    array = get_hierarchy_array(root)
+    leaf_ids = array.leaf_ids()
+    print(f"\nTotal Job Nodes (Leaf Nodes): {len(leaf_ids)}\n")
+    for leaf_id, path in zip(leaf_ids.tolist(), array.paths(leaf_ids, sep=" -> ")):
         # Print the full path for each leaf node
-        path = " -> ".join([ancestor.name for ancestor in node.path])
-        print(f"{path} (Processed: {node.processed})")
+        print(f"{path} (Processed: {array.nodes[leaf_id].processed})")
 
 
 
@@ -71,12 +73,33 @@ def display_hierarchy(root):
 
 
 
+# Array form of the current hierarchy, shared by the listing functions below
+_hierarchy_array = None
+
+
+def get_hierarchy_array(root):
+    """
+    Returns the HierarchyArray for root, reusing the previous one unless root changed or the tree
+    was modified since (see invalidate_hierarchy_array).
+    """
+    global _hierarchy_array
+    if _hierarchy_array is None or _hierarchy_array.nodes[0] is not root:
+        _hierarchy_array = HierarchyArray.from_tree(root)
+    return _hierarchy_array
+
+
+def invalidate_hierarchy_array():
+    global _hierarchy_array
+    _hierarchy_array = None
+
+
 # Get a list of all job nodes (leaf nodes)
 def get_job_nodes(root):
     """
     Return a list of all leaf nodes, which represent the actual job nodes in the hierarchy.
     """
-    return [node for node in PreOrderIter(root) if node.is_leaf]
+    array = get_hierarchy_array(root)
+    return [array.nodes[leaf_id] for leaf_id in array.leaf_ids().tolist()]
 
 # Allow user to select a job node for processing
 def select_node_for_processing(root):
@@ -105,64 +128,140 @@ def select_node_for_processing(root):
         return None
 
 
-def process_steps(current_node, steps_list, downstream_processor):
+def select_nodes_for_processing(root):
+    """
+    Like select_node_for_processing, but accepts several comma-separated node numbers.
+    """
+    job_nodes = get_job_nodes(root)
+    if not job_nodes:
+        print("No job nodes available for selection.")
+        return []
+
+    print("\nAvailable Job Nodes for Expansion:")
+    for idx, job_node in enumerate(job_nodes):
+        print(f"{idx + 1}. {job_node.name} - {job_node.description}")
+
+    selection = input("Select node numbers to process, comma-separated (or type 'q' to quit): ")
+    if selection.lower() == 'q':
+        return []
+
+    selected = []
+    for part in selection.split(','):
+        part = part.strip()
+        if part.isdigit() and 1 <= int(part) <= len(job_nodes) and job_nodes[int(part) - 1] not in selected:
+            selected.append(job_nodes[int(part) - 1])
+        elif part:
+            print(f"Ignoring invalid selection: {part}")
+    return selected
+
+
+async def process_steps(current_node, steps_list, downstream_processor):
     """
     Processes the hierarchical steps defined in the `steps_list`.
     Recursively creates child nodes for each step and processes them accordingly.
+    Sibling steps are independent, so they are dispatched concurrently; the LLM interface
+    caps how many requests are in flight at once. Leaf siblings with a shared prompt shape
+    are combined into a single request.
     """
-    for step in steps_list:
+    # A processed node with children already holds the results of these steps and their subtrees
+    if current_node.processed and current_node.children:
+        logging.info("Skipping steps under '%s'; it has already been processed.", current_node.name)
+        return
+
+    def start(step):
         step_name = step['step']
         n = step['n']
-        # Check if the step_name has a direct mapping to a method name
-        if step_name in STEP_NAME_TO_METHOD:
-            method_name = STEP_NAME_TO_METHOD[step_name]
-        else:
-            # Construct the method name dynamically if no direct mapping is found
-            method_name = f"process_{step_name.lower().replace(' ', '_').replace('(', '').replace(')', '')}"
-
-
+        method_name = step['method']
 
         # Get the processing method from downstream_processor
         processing_method = getattr(downstream_processor, method_name, None)
-        if processing_method:
-            # Capture initial number of children *before* calling processing_method
-            initial_children_count = len(current_node.children)
-
-            # Log the processing step
-            logging.debug(f"Processing step '{step_name}' under '{current_node.name}'")
-            logging.debug(f"Attempting to call method: {method_name}")
-
-            # Explicitly pass arguments as named parameters
-            if method_name == "process_job_map":
-                # Explicitly specify fidelity and temp for process_job_map
-                processing_method(node=current_node, fidelity="med", temp=0.1)
-            else:
-                # Explicitly specify all arguments for other methods
-                processing_method(node=current_node, n=n, fidelity="comprehensive", temp=0.1)
-
-            # Get the new child node(s) added (assuming one child per step for simplicity)
-            new_child = None
-            if len(current_node.children) > initial_children_count:
-                new_child = current_node.children[-1]
-                logging.debug(f"Added '{new_child.name}' under '{current_node.name}'")
-            else:
-                logging.error(f"No new child added for step: {step_name}")
-                continue
-        else:
-            logging.error(f"No processing method found for step: {step_name}")
-            continue
+        if not processing_method:
+            logging.error("No processing method found for step: %s", step_name)
+            return None
+
+        # Log the processing step
+        logging.debug("Processing step '%s' under '%s'", step_name, current_node.name)
+        logging.debug("Attempting to call method: %s", method_name)
+
+        # Explicitly pass arguments as named parameters
+        if method_name == "process_job_map":
+            # Explicitly specify fidelity and temp for process_job_map
+            return processing_method(node=current_node, fidelity="med", temp=0.1)
+        # Explicitly specify all arguments for other methods
+        return processing_method(node=current_node, n=n, fidelity="comprehensive", temp=0.1)
+
+    async def finish(step, pending):
+        if pending is None:
+            return
+        new_children = await pending
+
+        # Siblings finish in any order, so use the children this step returned rather than
+        # the last child of current_node (assuming one child per step for simplicity)
+        if not new_children:
+            logging.error("No new child added for step: %s", step['step'])
+            return
+        new_child = new_children[-1]
+        logging.debug("Added '%s' under '%s'", new_child.name, current_node.name)
 
         # Recursively process child steps if any
-        if 'children_steps' in step and new_child:
-            process_steps(new_child, step['children_steps'], downstream_processor)
+        if 'children_steps' in step:
+            await process_steps(new_child, step['children_steps'], downstream_processor)
+
+    # Sibling steps without children of their own that share a prompt shape go out as one request
+    batchable = [step for step in steps_list
+                 if 'children_steps' not in step
+                 and step['method'] in getattr(downstream_processor, 'sibling_batch_steps', {})]
+    if len(batchable) < 2:
+        batchable = []
+    # Every sibling is started (checked and prepared) before any is awaited; the first to finish
+    # marks current_node processed, which would make later-starting siblings skip themselves
+    tasks = [finish(step, start(step)) for step in steps_list if step not in batchable]
+    if batchable:
+        tasks.append(downstream_processor.process_sibling_batch(node=current_node, steps=batchable))
+    await asyncio.gather(*tasks)
 
     # Mark the node as processed **only after completing all steps**
     current_node.processed = True
-    logging.debug(f"Marked '{current_node.name}' as processed.")
+    logging.debug("Marked '%s' as processed.", current_node.name)
+    if getattr(downstream_processor, 'store', None) is not None:
+        downstream_processor.store.mark_processed(current_node)
 
 
 # Process a selected node using the downstream processor
-def process_node(node, downstream_processor):
+def process_node(node, downstream_processor, force=False, file_path="hierarchy.json"):
+    """
+    Processes a single job node by executing downstream steps in a hierarchical order.
+    See aprocess_node for the hierarchy that is constructed. The updated hierarchy is
+    written to file_path once all steps are done.
+    """
+    asyncio.run(closing_async_client(aprocess_node(node, downstream_processor, force=force)))
+    downstream_processor.flush(node.root, file_path)
+    # New children were attached, so cached leaves and paths are out of date
+    invalidate_hierarchy_array()
+
+
+def process_nodes(nodes, downstream_processor, force=False, file_path="hierarchy.json"):
+    """
+    Processes several job nodes concurrently on one event loop rather than a thread pool, so
+    anytree nodes are only ever mutated from one thread. The LLM interface's semaphore (sized
+    by --workers) and rate limiter bound the requests in flight across all of them. The updated hierarchy is
+    written to file_path once, after every node is done.
+    """
+    if not force:
+        # Already processed nodes would return at once; drop them before scheduling anything
+        nodes = [node for node in nodes if not node.processed]
+    if not nodes:
+        return
+
+    async def run():
+        await asyncio.gather(*[aprocess_node(node, downstream_processor, force=force) for node in nodes])
+
+    asyncio.run(closing_async_client(run()))
+    downstream_processor.flush(nodes[0].root, file_path)
+    invalidate_hierarchy_array()
+
+
+async def aprocess_node(node, downstream_processor, force=False):
     """
     Processes a single job node by executing downstream steps in a hierarchical order.
     Constructs the following hierarchy:
@@ -179,73 +278,122 @@ def process_node(node, downstream_processor):
     │   ├── Financial Metrics of Purchasing Decision Makers
     │   ├── Ideal Job State
     │   │   ├── Potential Root Causes Preventing the Ideal State
+
+    Nodes that are already processed are skipped, so a reloaded hierarchy does not re-issue
+    its LLM calls, unless force is set; a forced re-run asks the model again instead of
+    replaying the responses cached by the first run.
     """
+    rerun = node.processed
+    if rerun:
+        if not force:
+            print(f"Node '{node.name}' has already been processed. Skipping (use --force to re-run).")
+            return
+        node.processed = False
     print(f"Processing node: {node.name}")
 
     # Define the hierarchical steps with nested child steps
     steps = [
         {
             'step': 'Job Contexts',
+            'method': 'process_job_contexts',
             'n': 10,
             'children_steps': [
                 {
                     'step': 'Job Map',
+                    'method': 'process_job_map',
                     'n': 0,
                     'children_steps': [
-                        {'step': 'Desired Outcomes (success metrics)', 'n': 20},
-                        {'step': 'Themed Desired Outcomes (Themed Success Metrics)', 'n': 10},
+                        {'step': 'Desired Outcomes (success metrics)', 'method': 'process_desired_outcomes', 'n': 20},
+                        {'step': 'Themed Desired Outcomes (Themed Success Metrics)', 'method': 'process_themed_desired_outcomes', 'n': 10},
                     ]
                 },
-                {'step': 'Situational Complexity Factors', 'n': 10},
-                {'step': 'Related Jobs', 'n': 10},
-                {'step': 'Emotional Jobs', 'n': 10},
-                {'step': 'Social Jobs', 'n': 10},
-                {'step': 'Financial Metrics of Purchasing Decision Makers', 'n': 10},
+                {'step': 'Situational Complexity Factors', 'method': 'process_situational_complexity_factors', 'n': 10},
+                {'step': 'Related Jobs', 'method': 'process_related_jobs', 'n': 10},
+                {'step': 'Emotional Jobs', 'method': 'process_emotional_jobs', 'n': 10},
+                {'step': 'Social Jobs', 'method': 'process_social_jobs', 'n': 10},
+                {'step': 'Financial Metrics of Purchasing Decision Makers', 'method': 'process_financial_metrics', 'n': 10},
                 {
                     'step': 'Ideal Job State',
+                    'method': 'process_ideal_job_state',
                     'n': 15,
                     'children_steps': [
-                        {'step': 'Potential Root Causes Preventing the Ideal State', 'n': 15},
+                        {'step': 'Potential Root Causes Preventing the Ideal State', 'method': 'process_potential_root_causes', 'n': 15},
                     ]
                 },
             ]
         }
     ]
 
+    if rerun:
+        for step in steps:
+            downstream_processor.clear_cache(node, step['step'], n=step['n'], fidelity="comprehensive", temp=0.1)
+
     # Start processing from the root job_node
-    process_steps(node, steps, downstream_processor)
+    await process_steps(node, steps, downstream_processor)
 
     # After processing all steps, mark the job as processed
     node.processed = True
     print(f"Node '{node.name}' has been processed.")
 
-def main():
-    # Initialize components
-    llm = LLMInterface()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expand a job node of a saved hierarchy.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always query the LLM instead of reusing cached responses.")
+    parser.add_argument("--multi", action="store_true",
+                        help="Select several job nodes and process them concurrently.")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-run the steps for job nodes that are already processed, without reusing their cached responses.")
+    parser.add_argument("--pending", action="store_true",
+                        help="Process every job node that has not been processed yet, without prompting.")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENCY,
+                        help="Maximum number of LLM requests in flight across the jobs being processed.")
+    args = parser.parse_args(argv)
+
+    # Initialize components; jobs share one event loop, so --workers bounds requests rather than threads
+    llm = LLMInterface(use_cache=not args.no_cache, max_concurrency=args.workers)
     prompt_builder = PromptBuilder()
-    downstream_processor = DownstreamProcessor(prompt_builder, llm)
+    # Nodes are written to the store as each step completes, so progress survives interruptions
+    store = HierarchyStore()
+    downstream_processor = DownstreamProcessor(prompt_builder, llm, store=store)
 
-    # Load or create the hierarchy
-    root = load_hierarchy()
+    # Resume from the node store, or seed it from the JSON hierarchy on first run
+    root = store.load()
     if root is None:
-        print("No existing hierarchy found. Exiting.")
-        return
+        root = load_hierarchy()
+        if root is None:
+            print("No existing hierarchy found. Exiting.")
+            return
+        store.save_tree(root)
 
     # Display the full paths of all leaf nodes
     display_leaf_nodes(root)
 
-    # Select a node to process
-    selected_node = select_node_for_processing(root)
-    if selected_node is None:
-        print("No node selected for processing. Exiting.")
-        return
+    if args.pending:
+        pending_nodes = list(iter_unprocessed(root))
+        if not pending_nodes:
+            print("All job nodes have been processed. Exiting.")
+            return
+        process_nodes(pending_nodes, downstream_processor)
+    elif args.multi:
+        selected_nodes = select_nodes_for_processing(root)
+        if not selected_nodes:
+            print("No nodes selected for processing. Exiting.")
+            return
+        process_nodes(selected_nodes, downstream_processor, force=args.force)
+    else:
+        # Select a node to process
+        selected_node = select_node_for_processing(root)
+        if selected_node is None:
+            print("No node selected for processing. Exiting.")
+            return
 
-    # Process the selected node
-    process_node(selected_node, downstream_processor)
+        # Process the selected node
+        process_node(selected_node, downstream_processor, force=args.force)
 
-    # Save the updated hierarchy back to the file
-    save_hierarchy(root)
+    # The store is already up to date; processing also exported the JSON for tools that read the file
     print("Node processing completed and hierarchy saved.")
+    if llm.cache:
+        logging.info("Response cache: %(hits)s hits, %(misses)s misses, %(similar_hits)s similar hits.", llm.cache.stats)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
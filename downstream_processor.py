@@ -1,27 +1,90 @@
 # downstream_processor.py
+import asyncio
+import functools
 import logging
 
-import streamlit as st
-from anytree import Node
+from config import MAX_TOKENS, STEP_BATCH_SIZE, STRUCTURED_OUTPUTS_ENABLED
+from prompt_builder import PromptBuilder, PromptParser
+from llm_interface import LLMInterface, closing_async_client, gather_requests
+from utils import attach_children, update_hierarchy_in_file
 
-from prompt_builder import PromptBuilder
-from llm_interface import LLMInterface
-from utils import update_hierarchy_in_file
+# Arguments each build_*_prompt method takes; prompts not listed take DEFAULT_PROMPT_SCHEMA
+DEFAULT_PROMPT_SCHEMA = {'args': ('end_user', 'job', 'context', 'n')}
+PROMPT_SCHEMA = {
+    'job_map': {'args': ('end_user', 'job', 'context', 'fidelity')},
+    'desired_outcomes': {'args': ('end_user', 'job', 'context', 'step', 'n')},
+    'themed_desired_outcomes': {'args': ('end_user', 'job', 'context', 'step', 'n')},
+    'desired_outcomes_with_themes': {'args': ('end_user', 'job', 'context', 'step', 'n', 'n_themed')},
+    'financial_metrics_of_purchasing_decision_makers': {'args': ('end_user', 'job', 'context', 'n', 'temp')},
+    'ideal_job_state': {'args': ('end_user', 'job', 'context', 'n', 'temp')},
+    'potential_root_causes_preventing_the_ideal_state': {'args': ('end_user', 'job', 'context', 'ideal', 'n', 'temp')},
+}
+# Top-level arrays of a structured-output response; prompts not listed return a single 'items' array
+DEFAULT_RESPONSE_GROUPS = ('items',)
+RESPONSE_GROUPS = {
+    'desired_outcomes_with_themes': ('outcomes', 'themes'),
+}
+ITEM_SCHEMA = {
+    'type': 'object',
+    'properties': {'name': {'type': 'string'}, 'description': {'type': 'string'}},
+    'required': ['name', 'description'],
+    'additionalProperties': False,
+}
+# Prompt arguments that can vary per row of a multi-job batch (see process_step_batch)
+BATCHABLE_ARGS = {'end_user', 'job', 'context', 'step', 'n'}
 
-logging.basicConfig(level=logging.DEBUG)
+
+async def _resolved(value):
+    return value
+
+
+async def _gather_list(awaitables):
+    return list(await gather_requests(*awaitables))
+
+
+def json_schema_format(name, groups):
+    """
+    Builds a strict json_schema response_format for an object holding one array of
+    {'name', 'description'} items per group.
+    """
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': name,
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {group: {'type': 'array', 'items': ITEM_SCHEMA} for group in groups},
+                'required': list(groups),
+                'additionalProperties': False,
+            },
+        },
+    }
 
 
 class DownstreamProcessor:
 
-    def __init__(self, prompt_builder: PromptBuilder, llm: LLMInterface):
+    def __init__(self, prompt_builder: PromptBuilder, llm: LLMInterface, stream_callback=None,
+                 prompt_parser: PromptParser = None, store=None, error_sink=None,
+                 structured_outputs=STRUCTURED_OUTPUTS_ENABLED):
         self.prompt_builder = prompt_builder
+        self.prompt_parser = prompt_parser if prompt_parser is not None else PromptParser()
         self.llm = llm
+        # Optional HierarchyStore; new children are written to it as each step completes
+        self.store = store
+        # Optional callable(node, step, text_so_far); when set, responses are streamed to it
+        self.stream_callback = stream_callback
+        # Set when steps change the tree; cleared by flush()
+        self._dirty = False
+        # Callable(message) for user-facing errors; the Streamlit front-end passes app.ui_error
+        self.error_sink = error_sink or logging.error
         # Define step to prompt name mapping
         self.step_to_prompt = {
             'Job Contexts': 'job_contexts',
             'Job Map': 'job_map',
             'Desired Outcomes (success metrics)': 'desired_outcomes',
             'Themed Desired Outcomes (Themed Success Metrics)': 'themed_desired_outcomes',
+            'Desired Outcomes with Themes': 'desired_outcomes_with_themes',
             'Situational and Complexity Factors': 'situational_and_complexity_factors',
             'Related Jobs': 'related_jobs',
             'Emotional Jobs': 'emotional_jobs',
@@ -30,261 +93,492 @@ class DownstreamProcessor:
             'Ideal Job State': 'ideal_job_state',
             'Potential Root Causes Preventing the Ideal State': 'potential_root_causes_preventing_the_ideal_state'
         }
+        # Set of known prompt names for O(1) membership checks
+        self.prompt_names = frozenset(self.step_to_prompt.values())
+        # Steps whose prompts take only per-job inputs, so process_step_batch can run them for many jobs
+        self.batchable_steps = frozenset(
+            step for step, prompt_name in self.step_to_prompt.items()
+            if set(PROMPT_SCHEMA.get(prompt_name, DEFAULT_PROMPT_SCHEMA)['args']) <= BATCHABLE_ARGS
+        )
+        # step -> (prompt method, parse method, prompt args), resolved once up front
+        self._dispatch = {
+            step: (getattr(self.prompt_builder, f'build_{prompt_name}_prompt'),
+                   getattr(self.prompt_parser, f'parse_{prompt_name}'),
+                   PROMPT_SCHEMA.get(prompt_name, DEFAULT_PROMPT_SCHEMA)['args'])
+            for step, prompt_name in self.step_to_prompt.items()
+        }
+        # step -> json_schema response_format for non-streamed calls. Single-list steps then
+        # decode their 'items' array instead of parsing markdown; grouped steps are JSON already
+        self._response_formats = {}
+        if structured_outputs:
+            for step, prompt_name in self.step_to_prompt.items():
+                groups = RESPONSE_GROUPS.get(prompt_name, DEFAULT_RESPONSE_GROUPS)
+                self._response_formats[step] = json_schema_format(prompt_name, groups)
+                if groups == DEFAULT_RESPONSE_GROUPS:
+                    prompt_method, _, args = self._dispatch[step]
+                    self._dispatch[step] = (prompt_method, self.prompt_parser.parse_structured_items, args)
+        # Job Map never takes n, so its step and count are bound once instead of on every call
+        self._job_map_fast = functools.partial(self.aprocess_step, step='Job Map', n=0)
+        # Steps whose parser returns several named groups, mapped to the node created for each group
+        self.step_groups = {
+            'Desired Outcomes with Themes': {
+                'outcomes': 'Desired Outcomes (success metrics)',
+                'themes': 'Themed Desired Outcomes (Themed Success Metrics)',
+            }
+        }
+
+        # Steps whose prompts only need (end_user, job, context, n), keyed by their process_*
+        # method; siblings among these can share one request via process_sibling_batch
+        self.sibling_batch_steps = {
+            'process_desired_outcomes': 'Desired Outcomes (success metrics)',
+            'process_themed_desired_outcomes': 'Themed Desired Outcomes (Themed Success Metrics)',
+            'process_situational_complexity_factors': 'Situational and Complexity Factors',
+            'process_related_jobs': 'Related Jobs',
+            'process_emotional_jobs': 'Emotional Jobs',
+            'process_social_jobs': 'Social Jobs',
+            'process_financial_metrics': 'Financial Metrics of Purchasing Decision Makers',
+        }
+
+    def process_step(self, node, step, n, fidelity, temp=0.1, **prompt_kwargs):
+        """
+        General method to process any downstream step, for callers without an event loop.
+        Returns the list of child nodes added for the step.
+        """
+        return asyncio.run(closing_async_client(self.aprocess_step(node, step, n, fidelity, temp, **prompt_kwargs)))
+
+    def aprocess_siblings(self, nodes, step, n, fidelity, temp=0.1, **prompt_kwargs):
+        """
+        Runs one step for each of several nodes concurrently, one request per node; the LLM
+        interface's semaphore and rate limiter bound how many are in flight. Like aprocess_step,
+        the nodes are checked when this is called. Returns an awaitable of the child nodes added
+        for each of `nodes`, in order.
+        """
+        return _gather_list([self.aprocess_step(node, step, n, fidelity, temp, **prompt_kwargs) for node in nodes])
+
+    def aprocess_step(self, node, step, n, fidelity, temp=0.1, **prompt_kwargs):
+        """
+        Async variant of process_step. The node is checked and the prompt built right away, and
+        the returned coroutine awaits the LLM and attaches the child nodes.
+
+        Call every sibling step of a node before awaiting any of them: the first step to finish
+        marks the node processed (at once, on a cache hit), and a sibling checked after that
+        would be skipped.
+        """
+        return self._arun_step(node, step, self._prepare_step(node, step, n, fidelity, temp, **prompt_kwargs))
+
+    async def _arun_step(self, node, step, prepared):
+        if prepared is None:
+            return []
+        prompt, parse_method = prepared
+
+        # Streamed responses are parsed as they arrive, so nodes appear as the model writes them:
+        # numbered-list steps line by line, grouped (JSON) steps item object by item object
+        if self.stream_callback:
+            if step in self.step_groups:
+                return await self._astream_grouped_children(node, step, prompt)
+            return await self._astream_children(node, step, prompt)
+
+        # Get response from LLM
+        response_format = self._response_formats.get(step)
+        try:
+            if response_format:
+                response = await self.llm.aget_response(prompt, response_format=response_format)
+            else:
+                response = await self.llm.aget_response(prompt)
+            logging.debug("Received response from LLM: %s", response)
+        except Exception as e:
+            logging.exception("Error getting response from LLM for step '%s': %s", step, e)
+            return []
 
-    def process_step(self, node, step, n, fidelity, temp=0.1):
+        return self._add_children(node, step, parse_method, response)
+
+    async def _astream_children(self, node, step, prompt):
+        """
+        Streams the LLM response and attaches a child node for each list line as soon as the line
+        is complete, reporting the partial text to stream_callback along the way.
+        """
+        new_children = []
+
+        def add_line(line):
+            item = self.prompt_parser.parse_list_line(line)
+            if item:
+                new_children.extend(attach_children(node, [item]))
+
+        text = ""
+        pending = ""
+        try:
+            async for chunk in self.llm.astream_response(prompt):
+                text += chunk
+                *lines, pending = (pending + chunk).split('\n')
+                for line in lines:
+                    add_line(line)
+                self.stream_callback(node, step, text)
+            add_line(pending)
+        except Exception as e:
+            logging.exception("Error streaming response for step '%s': %s", step, e)
+
+        if not new_children:
+            logging.warning("No parsed items for step '%s' on node '%s'. No children added.", step, node.name)
+        elif len(node.children) > 0:
+            node.processed = True
+            logging.debug("Marked node '%s' as processed.", node.name)
+        self._persist(node, new_children)
+        return new_children
+
+    async def _astream_grouped_children(self, node, step, prompt):
         """
-        General method to process any downstream step.
+        Streams a grouped JSON response and attaches each item beneath its group node as soon as
+        the item's object is complete, reporting the partial text to stream_callback along the way.
+        """
+        groups = self.step_groups[step]
+        group_nodes = {}
+        scanner = self.prompt_parser.json_item_scanner()
+
+        text = ""
+        try:
+            async for chunk in self.llm.astream_response(prompt):
+                text += chunk
+                for group, item in scanner.feed(chunk):
+                    if group not in groups:
+                        continue
+                    if group not in group_nodes:
+                        group_nodes[group] = type(node)(name=groups[group], parent=node,
+                                                        description='', processed=True)
+                    attach_children(group_nodes[group], [item])
+                self.stream_callback(node, step, text)
+        except Exception as e:
+            logging.exception("Error streaming response for step '%s': %s", step, e)
+
+        for group in groups:
+            if group not in group_nodes:
+                logging.warning("No parsed '%s' for step '%s' on node '%s'.", group, step, node.name)
+        new_children = list(group_nodes.values())
+        if new_children:
+            node.processed = True
+            logging.debug("Marked node '%s' as processed.", node.name)
+        self._persist(node, new_children)
+        return new_children
+
+    def _prepare_step(self, node, step, n, fidelity, temp, **prompt_kwargs):
+        """
+        Builds the prompt for a step. Returns (prompt, parse_method) or None if the step should be skipped.
         """
         # Check if node is already processed; log additional context on skipping behavior
         if node.processed:
             if len(node.children) > 0:
-                logging.info(f"Node '{node.name}' has already been processed and has children. Skipping redundant processing for step '{step}'.")
+                # The common case when re-running a populated tree, so it stays out of INFO output
+                logging.debug("Node '%s' has already been processed and has children. Skipping redundant processing for step '%s'.", node.name, step)
             else:
-                logging.warning(f"Node '{node.name}' is marked as processed but has no children. Consider re-processing step '{step}' for completeness.")
+                logging.warning("Node '%s' is marked as processed but has no children. Consider re-processing step '%s' for completeness.", node.name, step)
             return
-            
-        logging.debug(f"Processing step: {step} for node: {node.name}")
-
-        # Determine prompt name based on step
-        # Replace special characters like parentheses to ensure consistency
-        prompt_name = step.lower().replace(" ", "_").replace("(", "").replace(")", "")
-        if prompt_name not in self.step_to_prompt.values():
-            logging.error(f"No prompt mapping found for step '{step}'.")
-            st.error(f"No prompt mapping found for step '{step}'.")
-            return
-        prompt_method = f'build_{prompt_name}_prompt'
-        parse_method = f'parse_{prompt_name}'
 
-        # Existing logging statements to confirm prompt and parse method names
-        logging.debug(f"Generated prompt method: {prompt_method}")
-        logging.debug(f"Generated parse method: {parse_method}")
+        logging.debug("Processing step: %s for node: %s", step, node.name)
+        return self._build_step_prompt(node, step, n, fidelity, temp, **prompt_kwargs)
 
-        # Additional logging to verify existence before accessing attributes
-        if not hasattr(self.prompt_builder, prompt_method):
-            logging.error(f"Prompt method '{prompt_method}' not found in PromptBuilder. Available methods: {dir(self.prompt_builder)}")
-        if not hasattr(self.prompt_builder, parse_method):
-            logging.error(f"Parse method '{parse_method}' not found in PromptBuilder. Available methods: {dir(self.prompt_builder)}")
+    def _build_step_prompt(self, node, step, n, fidelity, temp, **prompt_kwargs):
+        """
+        Builds the prompt for a step regardless of the node's processed flag. Returns
+        (prompt, parse_method), or None if the step is unknown or its inputs are missing.
+        """
+        dispatch = self._dispatch.get(step)
+        if dispatch is None:
+            self.error_sink(f"No prompt mapping found for step '{step}'.")
+            return
+        prompt_method, parse_method, args = dispatch
 
+        # Every value a prompt may need is computed once; the schema picks the ones it takes
+        grandparent_name = self._end_user_name(node)
+        if grandparent_name is None:
+            logging.warning("Node '%s' has no end user two levels up. Skipping step '%s'.", node.name, step)
+            return
+        node_name = node.name
+        ctx = {'end_user': grandparent_name, 'job': node_name, 'context': node.description,
+               'step': node_name, 'n': n, 'fidelity': fidelity, 'temp': temp,
+               'n_themed': prompt_kwargs.get('n_themed', 10)}
+        if 'ideal' in args:
+            ctx['ideal'] = self._find_ideal_job_state(node)
+            if ctx['ideal'] is None:
+                logging.warning("Missing inputs under '%s'. Skipping step '%s'.", node.name, step)
+                return
+        return prompt_method(**{arg: ctx[arg] for arg in args}), parse_method
 
-        # Check if methods exist
-        if not hasattr(self.prompt_builder, prompt_method):
-            logging.error(f"Prompt method '{prompt_method}' is not defined in PromptBuilder.")
-            st.error(f"Prompt method '{prompt_method}' is not defined.")
+    def clear_cache(self, node=None, step=None, n=None, fidelity=None, temp=0.1, **prompt_kwargs):
+        """
+        Forgets the cached LLM response for one step of one node, so re-running the step asks the
+        model again; with no node and step, clears the whole response cache.
+        """
+        clear = getattr(self.llm, 'clear_cache', None)
+        if clear is None:
             return
-        if not hasattr(self.prompt_builder, parse_method):
-            logging.error(f"Parse method '{parse_method}' is not defined in PromptBuilder.")
-            st.error(f"Parse method '{parse_method}' is not defined.")
+        if node is None or step is None:
+            clear()
             return
-
-        # Build prompt with necessary parameters
-        if prompt_name == 'job_map':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            fidelity=fidelity)
-        elif prompt_name == 'financial_metrics_of_purchasing_decision_makers':
-            prompt = getattr(self.prompt_builder, prompt_method)(
-                end_user=node.parent.parent.name,
-                job=node.name,
-                context=node.description,
-                n=n,
-                temp=temp  # Pass 'temp' here
-            )
-        elif prompt_name == 'job_contexts':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'desired_outcomes_(success_metrics)':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'themed_desired_outcomes_(themed_success_metrics)':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'situational_and_complexity_factors':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'related_jobs':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'emotional_jobs':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'social_jobs':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n)
-        elif prompt_name == 'ideal_job_state':
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(end_user=node.parent.parent.name,
-                                            job=node.name,
-                                            context=node.description,
-                                            n=n,
-                                            temp=temp)
-        elif prompt_name == 'potential_root_causes_preventing_the_ideal_state':
-            # Find the 'Ideal Job State' node among the children
-            ideal_job_state_node = next(
-                (child for child in node.children if child.name.lower() == 'ideal_job_state'), None
-            )
-            if not ideal_job_state_node:
-                logging.warning(f"'Ideal Job State' node not found under '{node.name}'. Skipping step '{step}'.")
-                return
-    
-            ideal_job_state_name = ideal_job_state_node.name
-            prompt = getattr(self.prompt_builder, prompt_method)(
-                end_user=node.parent.parent.name,
-                job=node.name,
-                context=node.description,
-                ideal=ideal_job_state_name,  # Correctly reference 'Ideal Job State'
-                n=n,
-                temp=temp
-            )
+        prepared = self._build_step_prompt(node, step, n, fidelity, temp, **prompt_kwargs)
+        if prepared is None:
+            return
+        response_format = self._response_formats.get(step)
+        if response_format:
+            clear(prepared[0], response_format=response_format)
         else:
-            # Handle other prompts accordingly
-            prompt_kwargs = {
-                'end_user': node.parent.parent.name,
-                'job': node.name,
-                'context': node.description,
-                'n': n
-            }
-            # Add additional parameters if required by specific prompts
-            if prompt_name == 'ideal_job_state':
-                prompt_kwargs['temp'] = temp
-            prompt = getattr(self.prompt_builder,
-                             prompt_method)(**prompt_kwargs)
-        # # Consolidate prompt building using a dictionary for parameter flexibility
-        # prompt_kwargs = {
-        #     'end_user': node.parent.parent.name,
-        #     'job': node.name,
-        #     'context': node.description,
-        #     'n': n,  # Default n value
-        #     'temp': temp  # Default temp value
-        # }
-
-        # # Adjust prompt_kwargs for specific prompt requirements
-        # if prompt_name == 'job_map':
-        #     prompt_kwargs['fidelity'] = fidelity
-        # elif prompt_name == 'financial_metrics_of_purchasing_decision_makers':
-        #     prompt_kwargs.pop('temp')  # Remove temp if not needed for this prompt
-
-        # # Use prompt_kwargs to build the prompt
-        # prompt = getattr(self.prompt_builder, prompt_method)(**prompt_kwargs)
-
-        
+            clear(prepared[0])
 
-        # Get response from LLM
-        try:
-            response = self.llm.get_response(prompt) #, temperature=temp)
-            logging.debug(f"Received response from LLM: {response}")
-        except Exception as e:
-            logging.exception(f"Error getting response from LLM for step '{step}': {e}")
-            return
+    @staticmethod
+    def _end_user_name(node):
+        """
+        Name of the node two levels up (the end user a job belongs to), or None in shallow trees.
+        """
+        return getattr(getattr(node.parent, 'parent', None), 'name', None)
 
+    @staticmethod
+    def _find_ideal_job_state(node):
+        # Find the 'Ideal Job State' node among the children
+        ideal_job_state_node = next(
+            (child for child in node.children if child.name.lower() == 'ideal_job_state'), None
+        )
+        return ideal_job_state_node.name if ideal_job_state_node else None
+
+    def _add_children(self, node, step, parse_method, response):
+        """
+        Parses an LLM response and attaches the parsed items as children of node.
+        """
         # Parse response
         try:
-            parsed_response = getattr(self.prompt_builder, parse_method)(response)
-            logging.debug(f"Parsed response: {parsed_response}")
+            parsed_response = parse_method(response)
+            logging.debug("Parsed response: %s", parsed_response)
         except Exception as e:
-            logging.exception(f"Error parsing response for step '{step}': {e}")
-            return
+            logging.exception("Error parsing response for step '%s': %s", step, e)
+            return []
+
+        # Grouped responses get one child per group, with the group's items beneath it
+        if step in self.step_groups:
+            return self._add_grouped_children(node, step, parsed_response)
 
         # Add downstream nodes
+        new_children = []
         if not parsed_response:
-            logging.warning(f"No parsed items for step '{step}' on node '{node.name}'. No children added.")
+            logging.warning("No parsed items for step '%s' on node '%s'. No children added.", step, node.name)
         try:
-            for item in parsed_response:
-                child_node = Node(
-                    name=item['name'],
-                    parent=node,
-                    description=item.get('description', ''),  # Changed from 'explanation' to 'description'
-                    processed=False  # New nodes are unprocessed
-                )
-                logging.debug(f"Added child node: {child_node.name}")
+            # New nodes are unprocessed and attached in a single step
+            new_children = attach_children(node, parsed_response)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Added child nodes: %s", [child.name for child in new_children])
         except Exception as e:
-            logging.exception(f"Error adding child nodes for step '{step}': {e}")
-            return
+            logging.exception("Error adding child nodes for step '%s': %s", step, e)
+            return []
 
         # After successful processing, mark node as processed only if it has children
         if len(node.children) > 0:
             node.processed = True
-            logging.debug(f"Marked node '{node.name}' as processed.")
-            
-        # # After successful processing, mark as processed
-        # node.processed = True
-        # # # Update JSON file or database with the new state
-        # # update_hierarchy_in_file(root_node, "current_hierarchy.json")
+            logging.debug("Marked node '%s' as processed.", node.name)
+
+        self._persist(node, new_children)
+        return new_children
+
+    def flush(self, root, filename):
+        """
+        Writes the hierarchy to filename if any step changed it since the last flush. Callers
+        flush once after a batch of steps rather than after every step. Returns True if written.
+        """
+        if not self._dirty:
+            return False
+        update_hierarchy_in_file(root, filename)
+        self._dirty = False
+        return True
+
+    def _persist(self, node, new_children):
+        """
+        Records a step's new children, and the parent's processed flag, in the hierarchy store if one
+        is set, and marks the hierarchy dirty for the next flush.
+        """
+        if new_children or node.processed:
+            self._dirty = True
+        if self.store is None:
+            return
+        if new_children:
+            self.store.add_nodes(new_children)
+        if node.processed:
+            self.store.mark_processed(node)
+
+    def _add_grouped_children(self, node, step, parsed_response):
+        """
+        Attaches a group node per named group in parsed_response (e.g. outcomes and themes),
+        each holding that group's parsed items. Returns the group nodes.
+        """
+        new_children = []
+        try:
+            for group, group_name in self.step_groups[step].items():
+                items = (parsed_response or {}).get(group, [])
+                if not items:
+                    logging.warning("No parsed '%s' for step '%s' on node '%s'.", group, step, node.name)
+                    continue
+                group_node = type(node)(name=group_name, parent=node, description='', processed=True)
+                attach_children(group_node, items)
+                new_children.append(group_node)
+                logging.debug("Added group node '%s' with %s children", group_name, len(items))
+        except Exception as e:
+            logging.exception("Error adding child nodes for step '%s': %s", step, e)
+            return []
+
+        if new_children:
+            node.processed = True
+            logging.debug("Marked node '%s' as processed.", node.name)
+        self._persist(node, new_children)
+        return new_children
+
+    def process_sibling_batch(self, node, steps):
+        """
+        Processes several independent sibling steps with a single LLM request. `steps` are step
+        definitions ({'method': ..., 'n': ...}) whose methods appear in sibling_batch_steps; their
+        prompts take neither fidelity nor temp, so neither does the combined prompt. Like
+        aprocess_step, the node is checked when this is called. Returns an awaitable of
+        {step: [child nodes added]}.
+        """
+        if node.processed:
+            logging.info("Node '%s' has already been processed. Skipping sibling batch.", node.name)
+            return _resolved({})
+        end_user = self._end_user_name(node)
+        if end_user is None:
+            logging.warning("Node '%s' has no end user two levels up. Skipping sibling batch.", node.name)
+            return _resolved({})
+
+        step_names = [self.sibling_batch_steps[step['method']] for step in steps]
+        prompt_names = [self.step_to_prompt[step_name] for step_name in step_names]
+        logging.debug("Adding %s under '%s' in one request", step_names, node.name)
+        prompt = self.prompt_builder.build_multi_step_prompt(
+            end_user=end_user,
+            job=node.name,
+            context=node.description,
+            steps=tuple((prompt_name, step['n']) for prompt_name, step in zip(prompt_names, steps))
+        )
+        return self._arun_sibling_batch(node, step_names, prompt_names, prompt)
+
+    async def _arun_sibling_batch(self, node, step_names, prompt_names, prompt):
+        try:
+            # One response carries every step's list, so it gets every step's token budget
+            response = await self.llm.aget_response(prompt, response_format={"type": "json_object"},
+                                                    max_tokens=MAX_TOKENS * len(step_names))
+            logging.debug("Received response from LLM: %s", response)
+            parsed_response = self.prompt_parser.parse_multi_step(response, prompt_names)
+        except Exception as e:
+            logging.exception("Error processing sibling batch %s: %s", step_names, e)
+            return {}
+
+        new_children = {}
+        for step_name, prompt_name in zip(step_names, prompt_names):
+            items = parsed_response.get(prompt_name, [])
+            if not items:
+                logging.warning("No parsed items for step '%s' on node '%s'. No children added.", step_name, node.name)
+            new_children[step_name] = attach_children(node, items)
+
+        if len(node.children) > 0:
+            node.processed = True
+            logging.debug("Marked node '%s' as processed.", node.name)
+        self._persist(node, [child for children in new_children.values() for child in children])
+        return new_children
+
+    def process_step_batch(self, nodes, step, n, batch_size=STEP_BATCH_SIZE):
+        """
+        Runs one step for many jobs, sending batch_size jobs per LLM request instead of one request
+        per job. Only batchable_steps, whose prompts take (end_user, job, context[, step], n) and
+        so no fidelity or temp, can be batched. Like aprocess_step, the nodes are checked when
+        this is called. Returns an awaitable of the child nodes added for each of `nodes`, in
+        order; processed nodes get [].
+        """
+        if step not in self.batchable_steps:
+            self.error_sink(f"Step '{step}' cannot be batched across jobs.")
+            return _resolved([[] for _ in nodes])
+        prompt_name = self.step_to_prompt[step]
+
+        pending = [node for node in nodes if not node.processed and self._end_user_name(node) is not None]
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        return self._arun_step_batch(nodes, batches, step, prompt_name, n)
+
+    async def _arun_step_batch(self, nodes, batches, step, prompt_name, n):
+        results = await gather_requests(*[self._process_job_batch(batch, step, prompt_name, n) for batch in batches])
+        new_children = {id(node): children for batch_result in results for node, children in batch_result}
+        return [new_children.get(id(node), []) for node in nodes]
+
+    async def _process_job_batch(self, nodes, step, prompt_name, n):
+        rows = [{'end_user': self._end_user_name(node), 'job': node.name, 'context': node.description} for node in nodes]
+        prompt = self.prompt_builder.build_multi_job_prompt(prompt_name, rows, n)
+        logging.debug("Adding '%s' under %s jobs in one request", step, len(nodes))
+        try:
+            response = await self.llm.aget_response(prompt, response_format={"type": "json_object"},
+                                                    max_tokens=MAX_TOKENS * len(nodes))
+            logging.debug("Received response from LLM: %s", response)
+            parsed_rows = self.prompt_parser.parse_multi_job(response, len(nodes))
+        except Exception as e:
+            logging.exception("Error processing job batch for step '%s': %s", step, e)
+            return []
+
+        results = []
+        for node, items in zip(nodes, parsed_rows):
+            if not items:
+                logging.warning("No parsed items for step '%s' on node '%s'. No children added.", step, node.name)
+            children = attach_children(node, items)
+            if children:
+                node.processed = True
+            self._persist(node, children)
+            results.append((node, children))
+        return results
 
     def process_job_contexts(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Job Contexts' under '{node.name}'")
-        self.process_step(node, 'Job Contexts', n, fidelity, temp)
+        logging.debug("Adding 'Job Contexts' under '%s'", node.name)
+        return self.aprocess_step(node, 'Job Contexts', n, fidelity, temp)
 
     def process_job_map(self, node, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Job Map' under '{node.name}'")
-        self.process_step(node, 'Job Map', n=0, fidelity=fidelity, temp=temp)
+        logging.debug("Adding 'Job Map' under '%s'", node.name)
+        return self._job_map_fast(node=node, fidelity=fidelity, temp=temp)
 
     def process_desired_outcomes(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Desired Outcomes (success metrics)' under '{node.name}'")
-        self.process_step(node, 'Desired Outcomes (success metrics)', n,
-                          fidelity, temp)
+        logging.debug("Adding 'Desired Outcomes (success metrics)' under '%s'", node.name)
+        return self.aprocess_step(node, 'Desired Outcomes (success metrics)', n,
+                                  fidelity, temp)
 
     def process_themed_desired_outcomes(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Themed Desired Outcomes (Themed Success Metrics)' under '{node.name}'")
-        self.process_step(node,
-                          'Themed Desired Outcomes (Themed Success Metrics)',
-                          n, fidelity, temp)
+        logging.debug("Adding 'Themed Desired Outcomes (Themed Success Metrics)' under '%s'", node.name)
+        return self.aprocess_step(node,
+                                  'Themed Desired Outcomes (Themed Success Metrics)',
+                                  n, fidelity, temp)
+
+    def process_desired_outcomes_with_themes(self, node, n, fidelity, temp=0.1, n_themed=10):
+        logging.debug("Adding 'Desired Outcomes (success metrics)' and their themes under '%s'", node.name)
+        return self.aprocess_step(node, 'Desired Outcomes with Themes', n,
+                                  fidelity, temp, n_themed=n_themed)
 
     def process_situational_complexity_factors(self,
                                                node,
                                                n,
                                                fidelity,
                                                temp=0.1):
-        logging.debug(f"Adding 'Situational and Complexity Factors' under '{node.name}'")
-        self.process_step(node, 'Situational and Complexity Factors', n,
-                          fidelity, temp)
+        logging.debug("Adding 'Situational and Complexity Factors' under '%s'", node.name)
+        return self.aprocess_step(node, 'Situational and Complexity Factors', n,
+                                  fidelity, temp)
 
     def process_related_jobs(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Related Jobs' under '{node.name}'")
-        self.process_step(node, 'Related Jobs', n, fidelity, temp)
+        logging.debug("Adding 'Related Jobs' under '%s'", node.name)
+        return self.aprocess_step(node, 'Related Jobs', n, fidelity, temp)
 
     def process_emotional_jobs(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Emotional Jobs' under '{node.name}'")
-        self.process_step(node, 'Emotional Jobs', n, fidelity, temp)
+        logging.debug("Adding 'Emotional Jobs' under '%s'", node.name)
+        return self.aprocess_step(node, 'Emotional Jobs', n, fidelity, temp)
 
     def process_social_jobs(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Social Jobs' under '{node.name}'")
-        self.process_step(node, 'Social Jobs', n, fidelity, temp)
+        logging.debug("Adding 'Social Jobs' under '%s'", node.name)
+        return self.aprocess_step(node, 'Social Jobs', n, fidelity, temp)
 
     def process_financial_metrics(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Financial Metrics of Purchasing Decision Makers' under '{node.name}'")
-        self.process_step(node,
-                          'Financial Metrics of Purchasing Decision Makers', n,
-                          fidelity, temp)
+        logging.debug("Adding 'Financial Metrics of Purchasing Decision Makers' under '%s'", node.name)
+        return self.aprocess_step(node,
+                                  'Financial Metrics of Purchasing Decision Makers', n,
+                                  fidelity, temp)
 
     def process_ideal_job_state(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Ideal Job State' under '{node.name}'")
-        self.process_step(node, 'Ideal Job State', n, fidelity, temp)
+        logging.debug("Adding 'Ideal Job State' under '%s'", node.name)
+        return self.aprocess_step(node, 'Ideal Job State', n, fidelity, temp)
 
     def process_potential_root_causes(self, node, n, fidelity, temp=0.1):
-        logging.debug(f"Adding 'Potential Root Causes Preventing the Ideal State' under '{node.name}'")
-        self.process_step(node,
-                          'Potential Root Causes Preventing the Ideal State',
-                          n, fidelity, temp)
+        logging.debug("Adding 'Potential Root Causes Preventing the Ideal State' under '%s'", node.name)
+        return self.aprocess_step(node,
+                                  'Potential Root Causes Preventing the Ideal State',
+                                  n, fidelity, temp)
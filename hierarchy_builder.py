@@ -1,22 +1,30 @@
 # hierarchy_builder.py
-import json
+import asyncio
 import logging
 import os
 import re
-from anytree import Node, PreOrderIter
+import time
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from pymongo.write_concern import WriteConcern
 
-from llm_interface import LLMInterface  # Import your interface here
+from config import HIERARCHY_COLUMNAR_SAVES, HIERARCHY_SAVE_INTERVAL
+
+from llm_interface import BatchCollector, LLMInterface, closing_async_client, gather_requests  # Import your interface here
 from prompt_builder import PromptBuilder  # Import your builder here
-from utils import save_hierarchy_to_file, save_hierarchy_to_markdown  # Custom utility functions
+from utils import JobNode, attach_children, dict_to_tree, loads_json, save_hierarchy_columns, save_hierarchy_to_file, save_hierarchy_to_markdown  # Custom utility functions
 from mongo_manager import MongoDBManager
 
+# Numbered markdown list items, one per line: "1. **Name**: description" (colon optional),
+# "1. **Role**: description" and "1. **Job** - description". Spaces are matched with
+# [ \t] so that, in MULTILINE mode, an item never runs onto the next line
+LIST_ITEM_RE = re.compile(r'^\d+\.[ \t]*\*\*(.+?)\*\*(?::[ \t]*|)[ \t]*(.+)$', re.MULTILINE)
+ROLE_ITEM_RE = re.compile(r'^\d+\.[ \t]+\*\*(.+?)\*\*:[ \t]+(.+)$', re.MULTILINE)
+JOB_ITEM_RE = re.compile(r'^\d+\.[ \t]+\*\*(.+?)\*\*[ \t]+-[ \t]+(.+)$', re.MULTILINE)
+
+# Progress snapshots only need the primary's acknowledgement; the final save uses the default
+PROGRESS_WRITE_CONCERN = WriteConcern(w=1, j=False)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 
 class HierarchyBuilder:
     def __init__(self, llm_interface, prompt_builder, fidelity="comprehensive", save_path='saved_hierarchies', mongo_uri=None, db_name=None):
@@ -24,15 +32,26 @@ class HierarchyBuilder:
         self.prompt_builder = prompt_builder
         self.fidelity = fidelity
         self.job_nodes = []  # List to store all Job nodes
+        self.unprocessed_nodes = {}  # id(node) -> node for every node not yet processed
         self.root = None
         self.industry = None
         self.save_path = save_path
         self.mongo_manager = None
+        # Progress snapshots are coalesced: at most one per HIERARCHY_SAVE_INTERVAL seconds
+        self._last_save = None
+        self._dirty = False
+        # node_id -> processed flag of every node document written to Mongo (see _flush_to_mongo)
+        self._mongo_written = {}
 
         # Initialize MongoDBManager if URI and DB name are provided
         if mongo_uri and db_name:
             self.mongo_manager = MongoDBManager(mongo_uri, db_name)
-            self.mongo_manager.set_collection('hierarchy_entries')  # Define a default collection name
+            self.mongo_manager.set_collection('hierarchy_nodes')  # One document per node
+            try:
+                # Every load and upsert selects by industry (and node_id), so they are index lookups
+                self.mongo_manager.create_index([("industry", 1), ("node_id", 1)], unique=True)
+            except PyMongoError as e:
+                logging.error("Failed to create MongoDB index: %s", e)
 
         os.makedirs(self.save_path, exist_ok=True)  # Ensure save directory exists
 
@@ -43,65 +62,205 @@ class HierarchyBuilder:
     def _load_saved_hierarchy(self, industry):
         save_file = self._get_save_file_path(industry)
         if os.path.exists(save_file):
-            logging.info(f"Loading saved hierarchy from {save_file}")
-            with open(save_file, 'r') as f:
-                return json.load(f)
+            logging.info("Loading saved hierarchy from %s", save_file)
+            with open(save_file, 'rb') as f:
+                return loads_json(f.read())
+        if self.mongo_manager:
+            try:
+                docs = self.mongo_manager.find_entries({"industry": industry})
+            except PyMongoError as e:
+                logging.error("Failed to load hierarchy from MongoDB: %s", e)
+                return None
+            if docs:
+                logging.info("Loading saved hierarchy for %s from MongoDB", industry)
+                return self._hierarchy_from_node_docs(docs)
         return None
 
-    def _save_current_hierarchy(self):
+    def _hierarchy_from_node_docs(self, docs):
+        """
+        Links flat node documents back into the nested hierarchy dict in one pass. Node ids are
+        dotted child-index paths, so sorting them numerically puts parents before children and
+        siblings in their original order.
         """
-        Save the current hierarchy to file incrementally.
+        docs = sorted(docs, key=lambda doc: [int(part) for part in doc["node_id"].split(".")])
+        nodes = {}
+        root = None
+        self._mongo_written = {}
+        for doc in docs:
+            node = {"name": doc["name"], "description": doc.get("description", ""),
+                    "processed": doc.get("processed", False), "children": []}
+            nodes[doc["node_id"]] = node
+            self._mongo_written[doc["node_id"]] = node["processed"]
+            parent = nodes.get(doc.get("parent_id"))
+            if parent is not None:
+                parent["children"].append(node)
+            elif root is None:
+                root = node
+        return root
+
+    def _save_current_hierarchy(self, force=False):
         """
+        Save the current hierarchy to file incrementally. Rewriting the whole tree after every
+        added node is quadratic over a build, so unless force is set a save that comes within
+        HIERARCHY_SAVE_INTERVAL seconds of the previous one only marks the hierarchy dirty.
+        The Markdown export is only rendered on forced (final) saves; progress snapshots just
+        need the JSON file to resume from.
+        """
+        now = time.monotonic()
+        if not force and self._last_save is not None and now - self._last_save < HIERARCHY_SAVE_INTERVAL:
+            self._dirty = True
+            return
+        self._last_save = now
+        self._dirty = False
         if self.industry:
             save_file = self._get_save_file_path(self.industry)
-            save_hierarchy_to_file(self.root, save_file)  # Use custom utility function for saving
+            if HIERARCHY_COLUMNAR_SAVES:
+                save_hierarchy_columns(self.root, save_file)
+            else:
+                save_hierarchy_to_file(self.root, save_file)  # Use custom utility function for saving
 
             # Check if the file was created successfully before attempting further operations
             if os.path.exists(save_file):
-                save_hierarchy_to_markdown(save_file, f"{self.industry}_hierarchy_output.md")  # Save markdown output
-                logging.info(f"Hierarchy progress saved to '{save_file}'.")
+                if force:
+                    save_hierarchy_to_markdown(self.root, f"{self.industry}_hierarchy_output.md")  # Save markdown output
+                logging.info("Hierarchy progress saved to '%s'.", save_file)
+            else:
+                logging.error("Failed to save hierarchy to '%s'", save_file)
+            if self.mongo_manager:
+                self._flush_to_mongo(final=force)
+
+    def _flush_to_mongo(self, final=False):
+        """
+        Writes the nodes added since the last flush, and the processed flags that changed, as
+        one document per node in a single unordered bulk write. Only called from
+        _save_current_hierarchy, so Mongo sees the same coalesced snapshots as the file.
+        """
+        operations = []
+        written = {}
+        # Children are only ever appended, so a node's path of child indexes is a stable id
+        stack = [(self.root, "0", None)]
+        while stack:
+            node, node_id, parent_id = stack.pop()
+            processed = bool(getattr(node, 'processed', False))
+            previous = self._mongo_written.get(node_id)
+            query = {"industry": self.industry, "node_id": node_id}
+            if previous is None:
+                operations.append(UpdateOne(query, {"$set": {
+                    "parent_id": parent_id, "name": node.name,
+                    "description": getattr(node, 'description', ''), "processed": processed,
+                }}, upsert=True))
+            elif previous != processed:
+                operations.append(UpdateOne(query, {"$set": {"processed": processed}}))
+            written[node_id] = processed
+            stack.extend((child, f"{node_id}.{index}", node_id) for index, child in enumerate(node.children))
+
+        if not operations:
+            return
+        try:
+            self.mongo_manager.bulk_write(operations, write_concern=None if final else PROGRESS_WRITE_CONCERN)
+        except PyMongoError as e:
+            logging.error("Failed to save hierarchy to MongoDB: %s", e)
+            return
+        self._mongo_written = written
+
+    def index_tree(self, root):
+        """
+        Sets root and rebuilds job_nodes (the leaves offered for processing) and
+        unprocessed_nodes in a single walk. Use track_new_nodes / mark_processed afterwards
+        so the tree never needs rescanning.
+        """
+        self.root = root
+        self.job_nodes = []
+        self.unprocessed_nodes = {}
+        stack = [root] if root is not None else []
+        while stack:
+            node = stack.pop()
+            if not getattr(node, 'processed', False):
+                self.unprocessed_nodes[id(node)] = node
+            if node.children:
+                stack.extend(reversed(node.children))
             else:
-                logging.error(f"Failed to save hierarchy to '{save_file}'")
+                self.job_nodes.append(node)
 
-    def _convert_hierarchy_to_dict(self, node):
+    def track_new_nodes(self, nodes):
         """
-        Converts the hierarchy starting from a given node into a dictionary format for JSON serialization.
+        Records newly attached nodes and their subtrees: new leaves join job_nodes, parents
+        that just gained their first children leave it, and processed parents leave
+        unprocessed_nodes.
         """
-        children = [self._convert_hierarchy_to_dict(child) for child in node.children]
-        node_dict = {
-            "name": node.name,
-            "description": getattr(node, 'description', ''),
-            "processed": getattr(node, 'processed', False),
-            "children": children
-        }
-        return node_dict
+        new_ids = set()
+        new_leaves = []
+        parents = {}
+        stack = list(reversed(nodes))
+        while stack:
+            node = stack.pop()
+            new_ids.add(id(node))
+            if node.parent is not None:
+                parents[id(node.parent)] = node.parent
+            if getattr(node, 'processed', False):
+                self.unprocessed_nodes.pop(id(node), None)
+            else:
+                self.unprocessed_nodes[id(node)] = node
+            if node.children:
+                stack.extend(reversed(node.children))
+            else:
+                new_leaves.append(node)
+
+        # A parent whose children are all new was a leaf until now
+        former_leaves = set()
+        for parent_id, parent in parents.items():
+            if parent_id in new_ids:
+                continue
+            if getattr(parent, 'processed', False):
+                self.unprocessed_nodes.pop(parent_id, None)
+            if all(id(child) in new_ids for child in parent.children):
+                former_leaves.add(parent_id)
+        if former_leaves:
+            self.job_nodes = [node for node in self.job_nodes if id(node) not in former_leaves]
+        self.job_nodes.extend(new_leaves)
+
+    def mark_processed(self, node):
+        node.processed = True
+        self.unprocessed_nodes.pop(id(node), None)
 
     def _resume_from_saved_state(self, saved_hierarchy):
         """
         Rebuild the hierarchy tree from the saved state dictionary.
         """
-        def build_tree(node_data, parent=None):
-            node = Node(
-                node_data['name'],
-                parent=parent,
-                description=node_data.get('description', ''),
-                processed=node_data.get('processed', False)
-            )
-            for child_data in node_data.get('children', []):
-                build_tree(child_data, node)
-            return node
-
-        self.root = build_tree(saved_hierarchy)
         # Populate job_nodes list for downstream processing
-        self.job_nodes = [node for node in PreOrderIter(self.root) if node.name.startswith('Job')]
-        logging.info(f"Hierarchy resumed with {len(self.job_nodes)} job nodes.")
+        self.index_tree(dict_to_tree(saved_hierarchy))
+        logging.info("Hierarchy resumed with %s job nodes.", len(self.job_nodes))
+
+    def build_hierarchy(self, industry, fidelity="comprehensive", n_end_users=10, n_jobs=10,
+                        batch=False, progress_callback=None):
+        """
+        Constructs the full hierarchy from Industry to Jobs with incremental saving, for callers
+        without an event loop. With batch set, each level is submitted as one OpenAI Batch job
+        (half the cost, results within 24h); progress_callback(batch) is called while polling.
+        See abuild_hierarchy.
+        """
+        if not batch:
+            return asyncio.run(closing_async_client(self.abuild_hierarchy(industry, fidelity, n_end_users, n_jobs)))
+        llm = BatchCollector(self.llm, progress_callback=progress_callback)
+        build = llm.run(self.abuild_hierarchy(industry, fidelity, n_end_users, n_jobs, llm=llm))
+        return asyncio.run(closing_async_client(build))
 
-    def build_hierarchy(self, industry, fidelity="comprehensive", n_end_users=10, n_jobs=10):
+    async def _aget_responses(self, prompts):
+        # The LLM interface's semaphore and rate limiter bound how many of these are in flight
+        return await gather_requests(*[self._requests.aget_response(prompt) for prompt in prompts])
+
+    async def abuild_hierarchy(self, industry, fidelity="comprehensive", n_end_users=10, n_jobs=10, llm=None):
         """
-        Constructs the full hierarchy from Industry to Jobs with incremental saving.
+        Constructs the full hierarchy from Industry to Jobs with incremental saving. Every branch
+        is built as soon as its parent is known: a sector's subsectors are requested the moment
+        the sector exists, without waiting for the slowest sibling, so the build takes about
+        tree-depth round trips with all ready prompts in flight at once. `llm` overrides the
+        object requests go through, e.g. a BatchCollector (awaited under its run()) that submits
+        each level as one batch.
         """
         self.industry = industry
         self.fidelity = fidelity
+        self._requests = llm if llm is not None else self.llm
 
         # Step 0: Check for saved progress and resume if possible
         saved_hierarchy = self._load_saved_hierarchy(industry)
@@ -113,89 +272,93 @@ class HierarchyBuilder:
             return self.root   #need to update this because just leaves is partially formed
 
         # Step 1: Initialize hierarchy if not resuming
-        self.root = Node(industry, description="Root node for industry hierarchy")
-        logging.info(f"Starting hierarchy build for industry: {industry}")
+        self.root = JobNode(industry, description="Root node for industry hierarchy")
+        self._mongo_written = {}
+        # job_nodes and unprocessed_nodes are kept current branch by branch via track_new_nodes
+        self.index_tree(self.root)
+        logging.info("Starting hierarchy build for industry: %s", industry)
 
         # Step 2: Retrieve sectors using a general get_prompt approach
         sectors_prompt = self.prompt_builder.get_prompt('sectors', industry=industry, fidelity=fidelity)
-        print(f"Generated sectors prompt: {sectors_prompt}")  # Debugging print for sectors prompt
-        sectors_response = self.llm.get_response(sectors_prompt)
-        sectors = self.parse_list(sectors_response)
-        
-
-        for sector in sectors:
-            sector_node = Node(sector["name"], parent=self.root, description=sector["description"])
-            self._save_current_hierarchy()  # Save after each sector is added
-
-            # Retrieve subsectors dynamically
-            subsectors_prompt = self.prompt_builder.get_prompt('subsectors', industry=industry, sector=sector["name"], fidelity=fidelity)
-            subsectors_response = self.llm.get_response(subsectors_prompt)
-            subsectors = self.parse_list(subsectors_response)
-            
-            for subsector in subsectors:
-                subsector_node = Node(subsector["name"], parent=sector_node, description=subsector["description"])
-                self._save_current_hierarchy()  # Save after each subsector is added
-
-                # Step 4: Retrieve end-users dynamically (providers and customers)
-                end_users_provider_prompt = self.prompt_builder.get_prompt('end_users_provider', industry=industry, sector=sector["name"], subsector=subsector["name"], n=n_end_users, fidelity=fidelity)
-                end_users_provider_response = self.llm.get_response(end_users_provider_prompt)
-                end_users_providers = self.parse_roles(end_users_provider_response)
-                
-                providers_parent_node = Node("End Users - Providers", parent=subsector_node, description="End Users who provide services or products.")
-
-                for provider in end_users_providers:
-                    provider_node = Node(provider["role"], parent=providers_parent_node, description=provider["description"])
-                    self._save_current_hierarchy()  # Save after each provider is added
-
-                    # Step 5: Retrieve Jobs-to-be-Done for Providers
-                    jobs_prompt = self.prompt_builder.get_prompt(
-                        'jtbd_industry',
-                        end_user=provider["role"],
-                        industry=industry,
-                        sector=sector["name"],
-                        subsector=subsector["name"],
-                        n=n_jobs
-                    )
-                    jobs_response = self.llm.get_response(jobs_prompt)
-                    jobs = self.parse_jobs(jobs_response)
-
-                    for job in jobs:
-                        job_node = Node(job["job"], parent=provider_node, description=job["description"], processed=False)
-                        self.job_nodes.append(job_node)  # Store Job node
-                        self._save_current_hierarchy()  # Save after each job is added
-
-                # Repeat for customer end users as well, following a similar structure as above
-                end_users_customer_prompt = self.prompt_builder.get_prompt('end_users_customer', industry=industry, sector=sector["name"], subsector=subsector["name"], n=n_end_users, fidelity=fidelity)
-                end_users_customer_response = self.llm.get_response(end_users_customer_prompt)
-                end_users_customers = self.parse_roles(end_users_customer_response)
-
-                customers_parent_node = Node("End Users - Customers", parent=subsector_node, description="End Users who purchase services or products.")
-
-                for customer in end_users_customers:
-                    customer_node = Node(customer["role"], parent=customers_parent_node, description=customer["description"])
-                    self._save_current_hierarchy()  # Save after each customer is added
-
-                    # Retrieve Jobs-to-be-Done for Customers
-                    jtbd_customers_prompt = self.prompt_builder.get_prompt(
-                        'jtbd_customers',
-                        end_user=customer["role"],
-                        industry=industry,
-                        sector=sector["name"],
-                        subsector=subsector["name"],
-                        n=n_jobs
-                    )
-                    jtbd_customers_response = self.llm.get_response(jtbd_customers_prompt)
-                    jtbd_customers = self.parse_jobs(jtbd_customers_response)
-
-                    for jtbd in jtbd_customers:
-                        jtbd_node = Node(jtbd["job"], parent=customer_node, description=jtbd["description"], processed=False)
-                        self.job_nodes.append(jtbd_node)  # Store Job node
-                        self._save_current_hierarchy()  # Save after each job is added
+        logging.debug("Generated sectors prompt: %s", sectors_prompt)
+        sectors_response = (await self._aget_responses([sectors_prompt]))[0]
+        sector_nodes = attach_children(self.root, self.parse_list(sectors_response))
+        self.track_new_nodes(sector_nodes)
+        self._save_current_hierarchy()
+
+        # Steps 3-5 run per branch; job nodes come back in tree order and are indexed together,
+        # so job_nodes lists them in the same order as the tree whichever branch finished first
+        try:
+            branches = await gather_requests(*[
+                self._abuild_sector(sector_node, n_end_users, n_jobs) for sector_node in sector_nodes
+            ])
+        except BaseException:
+            # Keep the branches finished since the last coalesced snapshot, so a resume picks them up
+            if self._dirty:
+                self._save_current_hierarchy(force=True)
+            raise
+        self.track_new_nodes([job_node for branch in branches for job_node in branch])
 
         logging.info("Hierarchy building completed.")
-        self._save_current_hierarchy()  # Final save at the end of hierarchy build
+        self._save_current_hierarchy(force=True)  # Final save at the end of hierarchy build
         return self.root
 
+    async def _abuild_sector(self, sector_node, n_end_users, n_jobs):
+        # Step 3: Retrieve the subsectors of this sector
+        response = (await self._aget_responses([self.prompt_builder.get_prompt(
+            'subsectors', industry=self.industry, sector=sector_node.name, fidelity=self.fidelity)]))[0]
+        subsector_nodes = attach_children(sector_node, self.parse_list(response))
+        self.track_new_nodes(subsector_nodes)
+        self._save_current_hierarchy()
+
+        branches = await gather_requests(*[
+            self._abuild_subsector(subsector_node, n_end_users, n_jobs) for subsector_node in subsector_nodes
+        ])
+        return [job_node for branch in branches for job_node in branch]
+
+    async def _abuild_subsector(self, subsector_node, n_end_users, n_jobs):
+        # Step 4: Retrieve provider and customer end users of this subsector together
+        providers_response, customers_response = await self._aget_responses([
+            self.prompt_builder.get_prompt(
+                prompt_name, industry=self.industry, sector=subsector_node.parent.name,
+                subsector=subsector_node.name, n=n_end_users, fidelity=self.fidelity)
+            for prompt_name in ('end_users_provider', 'end_users_customer')
+        ])
+
+        providers_parent_node = JobNode("End Users - Providers", parent=subsector_node, description="End Users who provide services or products.")
+        providers = self.parse_roles(providers_response)
+        customers_parent_node = JobNode("End Users - Customers", parent=subsector_node, description="End Users who purchase services or products.")
+        customers = self.parse_roles(customers_response)
+        end_user_nodes = []  # (end user node, jobs prompt name)
+        for parent_node, roles, jobs_prompt_name in ((providers_parent_node, providers, 'jtbd_industry'),
+                                                    (customers_parent_node, customers, 'jtbd_customers')):
+            role_nodes = attach_children(parent_node, [
+                {"name": role["role"], "description": role["description"]} for role in roles
+            ])
+            end_user_nodes.extend((role_node, jobs_prompt_name) for role_node in role_nodes)
+        self.track_new_nodes([providers_parent_node, customers_parent_node])
+        self._save_current_hierarchy()
+
+        # Step 5: Retrieve the Jobs-to-be-Done of every end user of this subsector at once
+        jobs_responses = await self._aget_responses([
+            self.prompt_builder.get_prompt(
+                jobs_prompt_name,
+                end_user=end_user_node.name,
+                industry=self.industry,
+                sector=subsector_node.parent.name,
+                subsector=subsector_node.name,
+                n=n_jobs
+            )
+            for end_user_node, jobs_prompt_name in end_user_nodes
+        ])
+        job_nodes = []
+        for (end_user_node, _), response in zip(end_user_nodes, jobs_responses):
+            # All of an end user's jobs are attached in one step
+            job_nodes.extend(attach_children(end_user_node, [
+                {"name": job["job"], "description": job["description"]} for job in self.parse_jobs(response)
+            ]))
+        return job_nodes
+
 
     def parse_response(self, response, pattern, keys=("name", "description")):
         """
@@ -203,39 +366,31 @@ class HierarchyBuilder:
 
         Args:
             response (str): The response text to be parsed.
-            pattern (str): The regex pattern to match lines in the response.
+            pattern (re.Pattern or str): A multiline regex matching one item per line; strings
+                are compiled (and cached by re) on each call.
             keys (tuple): A tuple of keys to assign to matched groups in the dictionary.
 
         Returns:
             list: A list of dictionaries with parsed information.
         """
-        items = []
-        lines = response.split('\n')
-        regex = re.compile(pattern)
-
-        for line in lines:
-            match = regex.match(line)
-            if match:
-                # Map matched groups to the specified keys
-                parsed_item = {key: match.group(i + 1).strip() for i, key in enumerate(keys)}
-                items.append(parsed_item)
-            else:
-                logging.warning(f"Line did not match pattern: {line}")
-
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.MULTILINE)
+        # One scan over the whole response instead of splitting it and matching line by line;
+        # groups() and zip keep the per-item work in C rather than a nested comprehension
+        items = [dict(zip(keys, map(str.strip, match.groups()))) for match in pattern.finditer(response)]
+        if not items and response.strip():
+            logging.warning("No lines matched pattern: %s", pattern.pattern)
         return items
 
     def parse_list(self, response):
-        pattern = r'^\d+\.\s*\*\*(.+?)\*\*(?::\s*|)\s*(.+)$'
-        logging.debug(f"Parsing response: {response}")  # Debugging print for incoming response
-        parsed = self.parse_response(response, pattern)
-        logging.debug(f"Parsed items: {parsed}")  # Debugging print for parsed items
+        logging.debug("Parsing response: %s", response)  # Debugging print for incoming response
+        parsed = self.parse_response(response, LIST_ITEM_RE)
+        logging.debug("Parsed items: %s", parsed)  # Debugging print for parsed items
         return parsed
 
     def parse_roles(self, response):
-        pattern = r'^\d+\.\s+\*\*(.+?)\*\*:\s+(.+)$'
-        return self.parse_response(response, pattern, keys=("role", "description"))
+        return self.parse_response(response, ROLE_ITEM_RE, keys=("role", "description"))
 
     def parse_jobs(self, response):
-        pattern = r'^\d+\.\s+\*\*(.+?)\*\*\s+-\s+(.+)$'
-        return self.parse_response(response, pattern, keys=("job", "description"))
+        return self.parse_response(response, JOB_ITEM_RE, keys=("job", "description"))
 
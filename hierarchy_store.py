@@ -0,0 +1,100 @@
+# hierarchy_store.py
+import sqlite3
+import threading
+
+from config import HIERARCHY_STORE_PATH
+from utils import JobNode, save_hierarchy_to_file
+
+
+class HierarchyStore:
+    """
+    SQLite-backed hierarchy with one row per node. New nodes are inserted as they are created
+    and processed flags are updated in place, so saving progress costs O(new nodes) instead of
+    rewriting the whole JSON file, and an interrupted session loses at most the step in flight.
+    """
+    def __init__(self, path=HIERARCHY_STORE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        # id(node) -> row id for every node of the loaded or saved tree
+        self._row_ids = {}
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes ("
+                "id INTEGER PRIMARY KEY, parent_id INTEGER, name TEXT, description TEXT, processed INTEGER)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _insert_subtrees(self, conn, nodes):
+        # Parents are inserted before their children, so every parent_id is already known
+        stack = list(reversed(nodes))
+        while stack:
+            node = stack.pop()
+            parent_id = self._row_ids.get(id(node.parent)) if node.parent is not None else None
+            cursor = conn.execute(
+                "INSERT INTO nodes (parent_id, name, description, processed) VALUES (?, ?, ?, ?)",
+                (parent_id, node.name, getattr(node, 'description', ''), int(getattr(node, 'processed', False)))
+            )
+            self._row_ids[id(node)] = cursor.lastrowid
+            stack.extend(reversed(node.children))
+
+    def save_tree(self, root):
+        """
+        Replaces the stored hierarchy with the tree under root.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM nodes")
+            self._row_ids = {}
+            self._insert_subtrees(conn, [root])
+            conn.commit()
+
+    def add_nodes(self, nodes):
+        """
+        Inserts newly attached nodes (and any children they already have) in one transaction.
+        Their parents must already be stored.
+        """
+        with self._lock:
+            conn = self._connect()
+            self._insert_subtrees(conn, [node for node in nodes if id(node) not in self._row_ids])
+            conn.commit()
+
+    def mark_processed(self, *nodes):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "UPDATE nodes SET processed = 1 WHERE id = ?",
+                [(self._row_ids[id(node)],) for node in nodes if id(node) in self._row_ids]
+            )
+            conn.commit()
+
+    def load(self):
+        """
+        Rebuilds the tree from a single ordered scan. Returns the root node, or None if the store is empty.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, parent_id, name, description, processed FROM nodes ORDER BY id"
+            ).fetchall()
+
+        root = None
+        nodes_by_row = {}
+        self._row_ids = {}
+        for row_id, parent_id, name, description, processed in rows:
+            node = JobNode(name, parent=nodes_by_row.get(parent_id), description=description or '',
+                           processed=bool(processed))
+            nodes_by_row[row_id] = node
+            self._row_ids[id(node)] = row_id
+            if parent_id is None and root is None:
+                root = node
+        return root
+
+    def export_json(self, root, filename):
+        """
+        Writes the hierarchy as JSON for tools that read the file format.
+        """
+        return save_hierarchy_to_file(root, filename)
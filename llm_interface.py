@@ -1,37 +1,392 @@
 # llm_interface.py
+import asyncio
+import contextvars
+import importlib.util
 import json
+import logging
+import time
+import weakref
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from config import OPENAI_API_KEY, MODEL_NAME, TEMPERATURE, MAX_TOKENS, MAX_CONCURRENCY, RATE_LIMIT_RPM, BATCH_POLL_INTERVAL
+from config import HTTP2_ENABLED, HTTP_TIMEOUT, MAX_RETRIES
+from config import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_TEMPERATURE, SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, EMBEDDING_MODEL
+from response_cache import ResponseCache
+
+SYSTEM_PROMPT = "You are a helpful jobs-to-be-done job mapping research expert."
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# HTTP/2 needs the optional h2 package; without it the pooled client stays on HTTP/1.1 keep-alive
+USE_HTTP2 = HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+# Sync client shared by every LLMInterface in the process; see get_shared_client
+_shared_client = None
+
+
+def get_shared_client():
+    """
+    Returns the process-wide OpenAI client. Its connection pool outlives any one LLMInterface,
+    so Streamlit reruns (which build a new interface each time) keep their warm connections.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = OpenAI(api_key=OPENAI_API_KEY, timeout=HTTP_TIMEOUT, max_retries=MAX_RETRIES,
+                                http_client=DefaultHttpxClient(http2=USE_HTTP2))
+    return _shared_client
+
+
+# Running event loop -> AsyncOpenAI client; see get_shared_async_client
+_shared_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_shared_async_client():
+    """
+    Returns the AsyncOpenAI client for the running event loop, shared by every LLMInterface used
+    on it. httpx async connections are bound to the loop that opened them, so each asyncio.run
+    gets its own client; run the coroutine through closing_async_client to close it (releasing
+    its pooled connections) before the loop shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    client = _shared_async_clients.get(loop)
+    if client is None:
+        client = _shared_async_clients[loop] = AsyncOpenAI(
+            api_key=OPENAI_API_KEY, timeout=HTTP_TIMEOUT, max_retries=MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(http2=USE_HTTP2))
+    return client
+
+
+async def closing_async_client(awaitable):
+    """
+    Awaits `awaitable`, then closes the AsyncOpenAI client it opened on the running loop, if any.
+    Wrap the coroutine given to asyncio.run with this, e.g. asyncio.run(closing_async_client(main())).
+    """
+    try:
+        return await awaitable
+    finally:
+        client = _shared_async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+
+class RateLimiter:
+    """
+    Spaces out request starts so no more than `rpm` requests begin per minute.
+    """
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
 
-from openai import OpenAI
-from config import OPENAI_API_KEY, MODEL_NAME, TEMPERATURE, MAX_TOKENS
 
 class LLMInterface:
-    def __init__(self):
-        # Instantiate an OpenAI client with the API key
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+    def __init__(self, use_cache=RESPONSE_CACHE_ENABLED, max_concurrency=None):
+        # The OpenAI client's connection pool is reused by every call, so the TCP and TLS
+        # handshakes happen once per process rather than once per step
+        self.client = get_shared_client()
         self.model = MODEL_NAME
         self.temperature = TEMPERATURE
         self.max_tokens = MAX_TOKENS
+        self.cache = ResponseCache() if use_cache else None
+        # Requests in flight at once on an event loop; None means config.MAX_CONCURRENCY
+        self.max_concurrency = max_concurrency
+        # Concurrency limits and in-flight requests are bound to the event loop they were created
+        # on, so they are set up lazily and rebuilt whenever a new loop (e.g. a new asyncio.run) is used
+        self._async_loop = None
+        self._sem = None
+        self._rate_limiter = None
+        # Cache key -> future of the request currently fetching it on the async client's loop
+        self._inflight = {}
+        # Prompt tokens sent, and how many of them the provider served from its prefix cache
+        self.usage = {"prompt_tokens": 0, "cached_tokens": 0}
+
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_loop = loop
+            # Limit concurrent requests to avoid bursting into 429 rate limits
+            self._sem = asyncio.Semaphore(self.max_concurrency or MAX_CONCURRENCY)
+            self._rate_limiter = RateLimiter(RATE_LIMIT_RPM)
+            self._inflight = {}
+        return get_shared_async_client()
+
+    def _build_request(self, prompt, temperature=None, response_format=None, max_tokens=None):
+        """
+        Build the chat completion keyword arguments shared by the sync and async calls. `prompt` is
+        either the user message text or a full message list; callers passing a list should keep
+        static instructions in the leading messages so the provider's prefix cache can reuse them.
+        """
+        if isinstance(prompt, list):
+            messages = prompt
+        else:
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature if temperature is None else temperature,
+            "max_tokens": self.max_tokens if max_tokens is None else max_tokens,
+            "n": 1,
+            "stop": None,
+        }
+        if response_format is not None:
+            request["response_format"] = response_format
+        return request
 
+    def get_response(self, prompt, temperature=None, response_format=None, max_tokens=None):
+        request = self._build_request(prompt, temperature, response_format, max_tokens)
+        cached = self._cache_get(request, prompt)
+        if cached is not None:
+            return cached
+        embedding = None
+        if self._cacheable(request) and SEMANTIC_CACHE_ENABLED:
+            embedding = self._embed(self._semantic_text(prompt))
+            cached = self._cache_get_similar(request, embedding)
+            if cached is not None:
+                return cached
 
-    def get_response(self, prompt):
         try:
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful jobs-to-be-done job mapping research expert."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                n=1,
-                stop=None,
-            )
-            content = response.choices[0].message['content'].strip()
+            response = self.client.chat.completions.create(**request)
+            content = response.choices[0].message.content.strip()
+            self._record_usage(response)
+        except Exception as e:
+            print(f"Error communicating with LLM: {e}")
+            return ""
+        self._cache_set(request, prompt, content, embedding)
+        return content
+
+    async def aget_response(self, prompt, temperature=None, response_format=None, max_tokens=None):
+        """
+        Async variant of get_response so independent prompts can be awaited concurrently.
+        Concurrent calls with the same request share one in-flight LLM call and its result.
+        """
+        request = self._build_request(prompt, temperature, response_format, max_tokens)
+        cached = self._cache_get(request, prompt)
+        if cached is not None:
+            return cached
+
+        key = ResponseCache.make_key(request["model"], request["temperature"], request["max_tokens"],
+                                     self._cache_text(request, prompt))
+        self._get_async_client()
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # Shielded so a cancelled follower does not cancel the call the others await
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            content = await self._afetch(request, prompt)
+            future.set_result(content)
             return content
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                future.cancel()
+
+    async def _afetch(self, request, prompt):
+        embedding = None
+        if self._cacheable(request) and SEMANTIC_CACHE_ENABLED:
+            embedding = await self._aembed(self._semantic_text(prompt))
+            cached = self._cache_get_similar(request, embedding)
+            if cached is not None:
+                return cached
+
+        try:
+            client = self._get_async_client()
+            async with self._sem:
+                await self._rate_limiter.acquire()
+                response = await client.chat.completions.create(**request)
+            content = response.choices[0].message.content.strip()
+            self._record_usage(response)
         except Exception as e:
             print(f"Error communicating with LLM: {e}")
             return ""
-            
+        self._cache_set(request, prompt, content, embedding)
+        return content
+
+    def stream_response(self, prompt, temperature=None):
+        """
+        Yields the response text in chunks as they arrive, e.g. for st.write_stream.
+        """
+        request = self._build_request(prompt, temperature)
+        cached = self._cache_get(request, prompt)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        try:
+            for chunk in self.client.chat.completions.create(**request, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    chunks.append(delta)
+                    yield delta
+        except Exception as e:
+            print(f"Error communicating with LLM: {e}")
+            return
+        self._cache_set(request, prompt, "".join(chunks).strip())
+
+    async def astream_response(self, prompt, temperature=None):
+        """
+        Async variant of stream_response, subject to the same concurrency and rate limits as aget_response.
+        """
+        request = self._build_request(prompt, temperature)
+        cached = self._cache_get(request, prompt)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        try:
+            client = self._get_async_client()
+            async with self._sem:
+                await self._rate_limiter.acquire()
+                stream = await client.chat.completions.create(**request, stream=True)
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+        except Exception as e:
+            print(f"Error communicating with LLM: {e}")
+            return
+        self._cache_set(request, prompt, "".join(chunks).strip())
+
+    def _cacheable(self, request):
+        return bool(self.cache) and (RESPONSE_CACHE_MAX_TEMPERATURE is None
+                                     or request["temperature"] <= RESPONSE_CACHE_MAX_TEMPERATURE)
+
+    @staticmethod
+    def _semantic_text(prompt):
+        # Case and whitespace differences should not move a prompt away from its near-duplicates
+        return " ".join(LLMInterface._prompt_text(prompt).lower().split())
+
+    @staticmethod
+    def _prompt_text(prompt):
+        # Message lists are cached and embedded by their JSON form
+        return prompt if isinstance(prompt, str) else json.dumps(prompt)
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if not isinstance(prompt_tokens, int):
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["cached_tokens"] += cached_tokens
+        logging.debug("Prompt tokens: %s (%s from prefix cache)", prompt_tokens, cached_tokens)
+
+    @classmethod
+    def _cache_text(cls, request, prompt):
+        # A response requested in a structured format must not be served for a free-form request
+        # (or vice versa), so the format is part of the cached prompt text when one is set
+        text = cls._prompt_text(prompt)
+        if "response_format" in request:
+            text += "\n" + json.dumps(request["response_format"], sort_keys=True)
+        return text
+
+    def _cache_get(self, request, prompt):
+        if not self._cacheable(request):
+            return None
+        return self.cache.get(request["model"], request["temperature"], request["max_tokens"],
+                              self._cache_text(request, prompt))
+
+    def _cache_get_similar(self, request, embedding):
+        if embedding is None:
+            return None
+        return self.cache.get_similar(request["model"], request["temperature"], request["max_tokens"],
+                                      embedding, SEMANTIC_CACHE_THRESHOLD, request.get("response_format"))
+
+    def _cache_set(self, request, prompt, content, embedding=None):
+        # Empty responses are usually failures, so they are not worth remembering
+        if self._cacheable(request) and content:
+            self.cache.set(request["model"], request["temperature"], request["max_tokens"],
+                           self._cache_text(request, prompt), content, embedding,
+                           request.get("response_format"))
+
+    def clear_cache(self, prompt=None, temperature=None, response_format=None, max_tokens=None):
+        """
+        Drops the cached response for one prompt (with the same request parameters it was sent
+        with), or the whole cache when no prompt is given.
+        """
+        if not self.cache:
+            return
+        if prompt is None:
+            self.cache.clear()
+            return
+        request = self._build_request(prompt, temperature, response_format, max_tokens)
+        self.cache.delete(request["model"], request["temperature"], request["max_tokens"],
+                          self._cache_text(request, prompt))
+
+    def _embed(self, prompt):
+        try:
+            return self.client.embeddings.create(model=EMBEDDING_MODEL, input=prompt).data[0].embedding
+        except Exception as e:
+            print(f"Error computing prompt embedding: {e}")
+            return None
+
+    async def _aembed(self, prompt):
+        try:
+            response = await self._get_async_client().embeddings.create(model=EMBEDDING_MODEL, input=prompt)
+            return response.data[0].embedding
+        except Exception as e:
+            print(f"Error computing prompt embedding: {e}")
+            return None
+
+    async def arun_batch(self, requests, progress_callback=None, poll_interval=BATCH_POLL_INTERVAL):
+        """
+        Runs chat completion requests through the OpenAI Batch API (50% cost, 24h window).
+        `requests` is a list of (custom_id, request_body) pairs; returns a dict of custom_id -> content.
+        The job is polled with async sleeps, so progress_callback(batch) runs on the event loop's thread.
+        """
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+            for custom_id, body in requests
+        ]
+        try:
+            client = self._get_async_client()
+            batch_file = await client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+                                                   purpose="batch")
+            batch = await client.batches.create(input_file_id=batch_file.id,
+                                                endpoint="/v1/chat/completions",
+                                                completion_window="24h")
+            while batch.status not in BATCH_TERMINAL_STATUSES:
+                if progress_callback:
+                    progress_callback(batch)
+                await asyncio.sleep(poll_interval)
+                batch = await client.batches.retrieve(batch.id)
+            if progress_callback:
+                progress_callback(batch)
+
+            if batch.status != "completed" or not batch.output_file_id:
+                print(f"Batch {batch.id} ended with status '{batch.status}'")
+                return {}
+            output = (await client.files.content(batch.output_file_id)).text
+        except Exception as e:
+            print(f"Error running LLM batch: {e}")
+            return {}
+
+        results = {}
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            body = (record.get("response") or {}).get("body") or {}
+            choices = body.get("choices") or []
+            if choices:
+                results[record["custom_id"]] = choices[0]["message"]["content"].strip()
+        return results
+
     # def get_response(self, prompt, tools=None):
     #     try:
     #         # Construct the messages array
@@ -73,3 +428,154 @@ class LLMInterface:
     #     except Exception as e:
     #         print(f"Error communicating with LLM: {e}")
     #         return ""
+
+
+# The BatchCollector whose run() the current task is part of, if any
+_active_collector = contextvars.ContextVar("active_batch_collector", default=None)
+
+
+def gather_requests(*awaitables):
+    """
+    asyncio.gather for work that may send LLM requests. Under BatchCollector.run it also hands
+    the caller's place in the collector's count of outstanding callers to the awaitables, so a
+    batch is submitted exactly when every one of them is waiting on it or done.
+    """
+    collector = _active_collector.get()
+    if collector is None:
+        return asyncio.gather(*awaitables)
+    return collector.gather(*awaitables)
+
+
+class BatchCollector:
+    """
+    Drop-in stand-in for LLMInterface.aget_response that queues prompts instead of sending them.
+    Work is run with run() and fans out with gather_requests, which keep a count of the callers
+    that can still queue a prompt. Once that count drops to zero, i.e. every caller is waiting on
+    the queue or done, the queue is submitted as one OpenAI Batch job and each caller is resumed
+    with its own result. Steps that depend on a parent step naturally land in the next batch.
+    Requests the batch returns no result for (e.g. the Batch API is unavailable or the job failed)
+    are sent through the live API instead. Like aget_response, prompts answered by the response
+    cache are not sent at all, identical queued requests are sent once, and batch results are
+    written back to the cache.
+    """
+    def __init__(self, llm, progress_callback=None, poll_interval=BATCH_POLL_INTERVAL):
+        self.llm = llm
+        self.progress_callback = progress_callback
+        self.poll_interval = poll_interval
+        self._pending = []
+        # Serialized request -> future of the queued request it duplicates
+        self._queued = {}
+        # Future -> number of callers waiting on it
+        self._waiters = {}
+        # Callers that are running, i.e. neither waiting on the queue nor on gathered work
+        self._outstanding = 0
+        self._counter = 0
+        self._flush_task = None
+
+    async def run(self, awaitable):
+        """
+        Awaits `awaitable` as the collector's first caller; concurrent work inside it must be
+        started with gather_requests.
+        """
+        token = _active_collector.set(self)
+        self._outstanding += 1
+        try:
+            return await awaitable
+        finally:
+            self._release()
+            _active_collector.reset(token)
+
+    def gather(self, *awaitables):
+        """
+        Like asyncio.gather, for a caller under run(): the caller stops counting as outstanding
+        and each awaitable starts counting, until the last one finishes and the caller resumes.
+        Returns once every awaitable is done, raising the first error if any failed.
+        """
+        if not awaitables:
+            return asyncio.gather()
+        self._outstanding += len(awaitables) - 1
+        return self._agather(awaitables)
+
+    async def _agather(self, awaitables):
+        remaining = len(awaitables)
+
+        async def counted(awaitable):
+            nonlocal remaining
+            try:
+                return await awaitable
+            finally:
+                remaining -= 1
+                # The last one to finish hands its place back to the caller
+                if remaining:
+                    self._release()
+
+        results = await asyncio.gather(*[counted(awaitable) for awaitable in awaitables], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def _release(self):
+        self._outstanding -= 1
+        if self._outstanding == 0 and self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    def _resolve(self, future, result=None, error=None):
+        # Callers count as outstanding again from the moment their result is set, not from when
+        # they are next scheduled, so their follow-up prompts cannot miss the next batch
+        self._outstanding += self._waiters.pop(future, 0)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def aget_response(self, prompt, temperature=None, response_format=None, max_tokens=None):
+        if _active_collector.get() is not self:
+            raise RuntimeError("BatchCollector.aget_response must be awaited under BatchCollector.run")
+        request = self.llm._build_request(prompt, temperature, response_format, max_tokens)
+        cached = self.llm._cache_get(request, prompt)
+        if cached is not None:
+            return cached
+        key = json.dumps(request, sort_keys=True)
+        future = self._queued.get(key)
+        if future is None:
+            future = self._queued[key] = asyncio.get_running_loop().create_future()
+            self._counter += 1
+            self._pending.append((f"request-{self._counter}", request, future,
+                                  (prompt, temperature, response_format, max_tokens)))
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        self._release()
+        return await asyncio.shield(future)
+
+    async def _flush(self):
+        pending, self._pending = self._pending, []
+        self._queued = {}
+        error = None
+        try:
+            results = await self.llm.arun_batch([(custom_id, body) for custom_id, body, _, _ in pending],
+                                                progress_callback=self.progress_callback,
+                                                poll_interval=self.poll_interval)
+            for custom_id, request, _, args in pending:
+                if custom_id in results:
+                    self.llm._cache_set(request, args[0], results[custom_id])
+            # Requests sent directly are cached by aget_response itself
+            missing = [(future, args) for custom_id, _, future, args in pending if custom_id not in results]
+            if missing:
+                logging.warning("Batch returned no result for %s of %s requests; sending them directly.",
+                                len(missing), len(pending))
+                fallback = await asyncio.gather(*[self.llm.aget_response(*args) for _, args in missing],
+                                                return_exceptions=True)
+                for (future, _), response in zip(missing, fallback):
+                    self._resolve(future, "" if isinstance(response, Exception) else response)
+            for custom_id, _, future, _ in pending:
+                if not future.done():
+                    self._resolve(future, results[custom_id])
+        except Exception as e:
+            logging.exception("Error submitting LLM batch: %s", e)
+            error = e
+        finally:
+            # Every caller is resumed, even if the batch failed or was cancelled
+            for _, _, future, _ in pending:
+                if not future.done():
+                    self._resolve(future, error=error or RuntimeError("LLM batch was cancelled"))
+            self._flush_task = None
@@ -1,16 +1,18 @@
 # main.py
+import argparse
 import logging
 import os
 
+from config import LOG_LEVEL
 from hierarchy_builder import HierarchyBuilder
 from llm_interface import LLMInterface
 from prompt_builder import PromptBuilder
-from utils import save_hierarchy_to_file, save_hierarchy_to_markdown
+from utils import get_path_str, save_hierarchy_to_file, save_hierarchy_to_markdown
 from visualizer import Visualizer
 
 # Configure logging at the very beginning
 logging.basicConfig(
-    level=logging.INFO,  # Set to DEBUG for more detailed logs
+    level=LOG_LEVEL,  # Set JTBD_DEBUG=1 for more detailed logs
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
@@ -29,7 +31,7 @@ def list_jobs(hierarchy_builder):
     print("---------------------------------------")
     for idx, job_node in enumerate(hierarchy_builder.job_nodes, start=1):
         # Retrieve the full path to the Job node for better context
-        path = "/".join([ancestor.name for ancestor in job_node.path])
+        path = get_path_str(job_node)
         print(f"{idx}. {path}")
     print("---------------------------------------")
 
@@ -66,12 +68,22 @@ def process_selected_jobs(selected_jobs, hierarchy_builder, prompt_builder, llm)
         # desired_outcomes = run_desired_outcomes_prompt(job_node)
         pass  # Replace with actual processing
         
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build a Jobs-to-be-Done hierarchy for an industry.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always query the LLM instead of reusing cached responses.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit each level of the hierarchy as one OpenAI Batch job (50%% cost, results within 24h).")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # Step 0: Get User Inputs
     industry, fidelity = get_user_inputs()
 
     # Initialize components
-    llm = LLMInterface()
+    llm = LLMInterface(use_cache=not args.no_cache)
     prompt_builder = PromptBuilder()
     hierarchy_builder = HierarchyBuilder(llm,
                                          prompt_builder,
@@ -80,8 +92,11 @@ def main():
 
     # Step 1-4: Build Hierarchy (with iterative saving and resuming)
     logging.info("Starting hierarchy generation. This may take some time...")
-    hierarchy_root = hierarchy_builder.build_hierarchy(industry, fidelity=fidelity, n_end_users=2, n_jobs=2)
+    hierarchy_root = hierarchy_builder.build_hierarchy(industry, fidelity=fidelity, n_end_users=2, n_jobs=2,
+                                                       batch=args.batch)
     logging.info("Hierarchy generation completed.")
+    if llm.cache:
+        logging.info("Response cache: %(hits)s hits, %(misses)s misses, %(similar_hits)s similar hits.", llm.cache.stats)
 
     # Step 2: Visualize Hierarchy
     logging.info("Displaying generated hierarchy.")
@@ -90,12 +105,12 @@ def main():
     # Step 3: Save Hierarchy to JSON File
     json_filename = f"{industry}_hierarchy.json"
     save_hierarchy_to_file(hierarchy_root, json_filename)
-    logging.info(f"Hierarchy saved to '{json_filename}'.")
+    logging.info("Hierarchy saved to '%s'.", json_filename)
 
     # Step 4: Convert and Save Hierarchy to Text File
     text_filename = f"{industry}_hierarchy_output.md"
-    save_hierarchy_to_markdown(json_filename, text_filename)
-    logging.info(f"Hierarchical text saved to '{text_filename}'. You can now copy and paste this into Coda or Notion.")
+    save_hierarchy_to_markdown(hierarchy_root, text_filename)
+    logging.info("Hierarchical text saved to '%s'. You can now copy and paste this into Coda or Notion.", text_filename)
 
 
     # # Step 5: List all Jobs and Allow User to Select
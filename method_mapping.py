@@ -1,11 +0,0 @@
-# method_mapping.py
-
-# This dictionary maps long-form step names to their corresponding short-form method names
-STEP_NAME_TO_METHOD = {
-    "Desired Outcomes (success metrics)": "process_desired_outcomes",
-    "Themed Desired Outcomes (Themed Success Metrics)": "process_themed_desired_outcomes",
-    "Situational and Complexity Factors": "process_situational_complexity_factors",
-    "Financial Metrics of Purchasing Decision Makers": "process_financial_metrics",
-    "Potential Root Causes Preventing the Ideal State": "process_potential_root_causes",
-    # Add more mappings as needed for other long-form step names...
-}
\ No newline at end of file
@@ -1,9 +1,26 @@
 # mongo_manager.py
 from pymongo import MongoClient
 
+from config import MONGO_MAX_POOL_SIZE
+
+# uri -> MongoClient shared by every MongoDBManager in the process; see get_client
+_clients = {}
+
+
+def get_client(uri):
+    """
+    Returns the process-wide MongoClient for uri. MongoClient is thread-safe and pools its
+    connections, so reusing it spares each new manager (e.g. on a Streamlit rerun) the
+    connection and authentication handshakes.
+    """
+    if uri not in _clients:
+        _clients[uri] = MongoClient(uri, maxPoolSize=MONGO_MAX_POOL_SIZE)
+    return _clients[uri]
+
+
 class MongoDBManager:
     def __init__(self, uri, db_name):
-        self.client = MongoClient(uri)
+        self.client = get_client(uri)
         self.db = self.client[db_name]
         self.collection_name = None
 
@@ -20,6 +37,11 @@ class MongoDBManager:
             raise ValueError("Collection name is not set.")
         return self.db[self.collection_name].find_one(query)
 
+    def find_entries(self, query):
+        if not self.collection_name:
+            raise ValueError("Collection name is not set.")
+        return list(self.db[self.collection_name].find(query))
+
     def update_entry(self, query, new_values):
         if not self.collection_name:
             raise ValueError("Collection name is not set.")
@@ -30,6 +52,27 @@ class MongoDBManager:
             raise ValueError("Collection name is not set.")
         return self.db[self.collection_name].delete_one(query)
 
+    def bulk_write(self, operations, write_concern=None):
+        """
+        Sends several write operations in one round trip. Unordered, so the server may apply
+        them in parallel; pass a WriteConcern to relax acknowledgement for intermediate writes.
+        """
+        if not self.collection_name:
+            raise ValueError("Collection name is not set.")
+        collection = self.db[self.collection_name]
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        return collection.bulk_write(operations, ordered=False)
+
+    def create_index(self, keys, **kwargs):
+        """
+        Creates an index on the current collection (a no-op if it already exists). keys is a
+        list of (field, direction) pairs, e.g. [("industry", 1)].
+        """
+        if not self.collection_name:
+            raise ValueError("Collection name is not set.")
+        return self.db[self.collection_name].create_index(keys, **kwargs)
+
     def get_all_entries(self):
         if not self.collection_name:
             raise ValueError("Collection name is not set.")
@@ -1,14 +1,34 @@
+import functools
 import os
 import logging
 import re
 import yaml
 
-logging.basicConfig(level=logging.DEBUG)
+from utils import loads_json
+
+try:
+    # pydantic 2 (installed with the openai SDK) validates JSON in one compiled pass
+    from pydantic import BaseModel, ValidationError
+
+    class ParsedItem(BaseModel):
+        name: str
+        description: str = ""
+
+    class StructuredItems(BaseModel):
+        items: list[ParsedItem]
+
+    if not hasattr(StructuredItems, "model_validate_json"):  # pydantic 1
+        StructuredItems = None
+except ImportError:
+    StructuredItems = None
 
 
 class PromptBuilder:
-    def __init__(self, prompts_dir='prompts'):
+    def __init__(self, prompts_dir='prompts', cache_size=4096):
         self.prompts = {}
+        # Formatted prompts are memoized per instance: repeated runs over the same jobs and
+        # shared ancestor contexts rebuild identical prompts
+        self._format_cached = functools.lru_cache(maxsize=cache_size)(self._format_prompt)
         self.load_prompts(prompts_dir)
 
     def load_prompts(self, prompts_dir):
@@ -30,17 +50,29 @@ class PromptBuilder:
                         # Store the template and parameters for each prompt
                         self.prompts[prompt_name] = {
                             'template': content['prompt'],
-                            'parameters': content.get('parameters', {})
+                            'parameters': content.get('parameters', {}),
+                            'description': (content.get('description') or '').strip()
                         }
-                        logging.info(f"Loaded prompt: {prompt_name} from {path}")
+                        logging.info("Loaded prompt: %s from %s", prompt_name, path)
 
         # Debug: List all loaded prompts
-        logging.debug(f"Available prompts: {list(self.prompts.keys())}")
+        logging.debug("Available prompts: %s", list(self.prompts.keys()))
+        self._format_cached.cache_clear()
 
     def get_prompt(self, prompt_name, **kwargs):
         """
         Retrieve and format a prompt by name with provided keyword arguments.
         """
+        key = tuple(sorted(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable argument values can't be memoized; format them directly
+            return self._format_prompt(prompt_name, key)
+        return self._format_cached(prompt_name, key)
+
+    def _format_prompt(self, prompt_name, kwargs_items):
+        kwargs = dict(kwargs_items)
         prompt_data = self.prompts.get(prompt_name)
         if not prompt_data:
             raise ValueError(f"Prompt '{prompt_name}' not found.")
@@ -89,6 +121,33 @@ class PromptBuilder:
     def build_themed_desired_outcomes_prompt(self, end_user, job, context, step, n):
         return self.get_prompt('themed_desired_outcomes', end_user=end_user, job=job, context=context, step=step, n=n)
 
+    def build_desired_outcomes_with_themes_prompt(self, end_user, job, context, step, n, n_themed):
+        return self.get_prompt('desired_outcomes_with_themes', end_user=end_user, job=job, context=context, step=step, n=n, n_themed=n_themed)
+
+    def build_multi_step_prompt(self, end_user, job, context, steps):
+        """
+        Builds one prompt covering several independent steps. `steps` is a sequence of
+        (prompt_name, n) pairs; each step's own prompt description says what to generate, and
+        its prompt name is the JSON key its items are returned under.
+        """
+        step_list = "\n".join(
+            f'- "{prompt_name}" ({n} items): {self.prompts[prompt_name]["description"]}'
+            for prompt_name, n in steps
+        )
+        return self.get_prompt('multi_step', end_user=end_user, job=job, context=context, step_list=step_list)
+
+    def build_multi_job_prompt(self, prompt_name, rows, n):
+        """
+        Builds one prompt running a single step for several jobs. `rows` is a sequence of
+        {'end_user', 'job', 'context'} dicts; items for rows[i] are returned under the key str(i + 1).
+        """
+        job_list = "\n".join(
+            f"{i}. End user: {row['end_user']}; Job: {row['job']}; Context: {row.get('context', '')}"
+            for i, row in enumerate(rows, start=1)
+        )
+        return self.get_prompt('multi_job', step_description=self.prompts[prompt_name]["description"].strip(),
+                               n=n, job_list=job_list)
+
     def build_situational_and_complexity_factors_prompt(self, end_user, job, context, n):
         return self.get_prompt('situational_and_complexity_factors', end_user=end_user, job=job, context=context, n=n)
 
@@ -112,29 +171,39 @@ class PromptBuilder:
 
 
 class PromptParser:
+    # Numbered markdown list item, with the name optionally in bold and any dash or colon separator
+    LIST_ITEM_PATTERN = re.compile(r'^\s*\d+\.\s*(?:\*\*(.+?)\*\*|(.+?))\s*[:\-–—]\s*(.+)$')
+    # The same item pattern for scanning a whole response; [ \t] keeps each match on one line
+    LIST_ITEMS_PATTERN = re.compile(r'^[ \t]*\d+\.[ \t]*(?:\*\*(.+?)\*\*|(.+?))[ \t]*[:\-–—][ \t]*(.+)$',
+                                    re.MULTILINE)
+
+    def parse_list_line(self, line):
+        """
+        Parses a single numbered markdown list line into {'name', 'description'}, or returns None
+        for blank or non-matching lines. Lets streamed responses be parsed line by line.
+        """
+        if not line.strip():
+            return None
+        match = self.LIST_ITEM_PATTERN.match(line)
+        if not match:
+            logging.warning("Line did not match any known pattern and was skipped: '%s'", line)
+            return None
+        # Use the first capture group (bold name) if it exists, otherwise the second group (non-bold name)
+        name = match.group(1) if match.group(1) else match.group(2)
+        return {"name": name.strip(), "description": match.group(3).strip()}
+
     def _parse_list_response(self, response):
         """
         Helper method to parse a numbered markdown list into a list of dictionaries.
-        Each dictionary contains 'name' and 'description'.
+        Each dictionary contains 'name' and 'description'. The response is scanned in one pass
+        rather than split into lines; lines that are not list items are skipped.
         """
-        parsed_items = []
-        lines = response.strip().split('\n')
-
-        # Updated regex pattern to handle different separators and name formatting styles
-        pattern = re.compile(r'^\s*\d+\.\s*(?:\*\*(.+?)\*\*|(.+?))\s*[:\-–—]\s*(.+)$')
-
-        for line in lines:
-            if line.strip():
-                match = pattern.match(line)
-                if match:
-                    # Use the first capture group (bold name) if it exists, otherwise the second group (non-bold name)
-                    name = match.group(1) if match.group(1) else match.group(2)
-                    description = match.group(3).strip()
-                    parsed_items.append({"name": name.strip(), "description": description})
-
-                else:
-                    logging.warning(f"Line did not match any known pattern and was skipped: '{line}'")
-
+        parsed_items = [
+            {"name": (match.group(1) or match.group(2)).strip(), "description": match.group(3).strip()}
+            for match in self.LIST_ITEMS_PATTERN.finditer(response)
+        ]
+        if not parsed_items and response.strip():
+            logging.warning("No list items found in response: '%s'", response[:200])
         return parsed_items
 
     # Refactored parsing methods for each prompt response
@@ -150,6 +219,72 @@ class PromptParser:
     def parse_themed_desired_outcomes(self, response):
         return self._parse_list_response(response)
 
+    def _parse_json_groups(self, response, keys, label):
+        """
+        Decodes a JSON object response and returns {key: [...]} for each key, keeping only each
+        item's 'name' and 'description'. Missing keys map to an empty list.
+        """
+        # Models sometimes wrap the JSON in a code fence or add stray text around it
+        start, end = response.find('{'), response.rfind('}')
+        try:
+            data = loads_json(response[start:end + 1]) if start != -1 else {}
+        except ValueError as e:  # json and orjson decode errors are both ValueErrors
+            logging.warning("Could not decode %s JSON: %s", label, e)
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+
+        groups = {}
+        for key in keys:
+            items = data.get(key)
+            items = [_json_item(item) for item in items] if isinstance(items, list) else []
+            groups[key] = [item for item in items if item]
+        return groups
+
+    def parse_structured_items(self, response):
+        """
+        Parses a structured-output response of the form {"items": [...]} into a list of
+        dictionaries with 'name' and 'description'. Responses that match the schema are
+        decoded and validated in one pass; anything else goes through the lenient JSON parser.
+        """
+        if StructuredItems is not None:
+            try:
+                parsed = StructuredItems.model_validate_json(response)
+            except ValidationError:
+                pass
+            else:
+                return [{"name": item.name.strip(), "description": item.description.strip()}
+                        for item in parsed.items if item.name.strip()]
+        return self._parse_json_groups(response, ('items',), "structured")['items']
+
+    def json_item_scanner(self):
+        """
+        Returns a JsonItemScanner for parsing a grouped JSON response while it streams in.
+        """
+        return JsonItemScanner()
+
+    def parse_desired_outcomes_with_themes(self, response):
+        """
+        Parses the fused desired outcomes JSON response into {'outcomes': [...], 'themes': [...]},
+        where each item is a dictionary with 'name' and 'description'.
+        """
+        return self._parse_json_groups(response, ('outcomes', 'themes'), "desired outcomes")
+
+    def parse_multi_step(self, response, keys):
+        """
+        Parses a multi-step JSON response into {key: [...]} for each expected key, where each
+        item is a dictionary with 'name' and 'description'. Missing keys map to an empty list.
+        """
+        return self._parse_json_groups(response, keys, "multi-step")
+
+    def parse_multi_job(self, response, count):
+        """
+        Parses a multi-job JSON response into one list of items per job, in job order.
+        """
+        keys = [str(i) for i in range(1, count + 1)]
+        parsed = self._parse_json_groups(response, keys, "multi-job")
+        return [parsed[key] for key in keys]
+
     def parse_situational_and_complexity_factors(self, response):
         return self._parse_list_response(response)
 
@@ -170,3 +305,70 @@ class PromptParser:
 
     def parse_potential_root_causes_preventing_the_ideal_state(self, response):
         return self._parse_list_response(response)
+
+
+def _json_item(item):
+    """
+    Returns a decoded JSON item as {'name', 'description'}, or None if it has no string name.
+    Models occasionally emit other types (numbers, nulls, nested objects) for either field.
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("name"), str) or not item["name"].strip():
+        return None
+    return {"name": item["name"].strip(), "description": str(item.get("description") or "").strip()}
+
+
+class JsonItemScanner:
+    """
+    Incremental parser for streamed responses shaped like {"group": [{...}, ...], ...}. feed()
+    takes each chunk as it arrives and returns (group, item) for every item object completed so
+    far, so nodes can be attached while the model is still writing the rest of the response.
+    Text before the opening brace (e.g. a code fence) is ignored.
+    """
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._group = None
+        self._item_start = None
+
+    def feed(self, chunk):
+        self._text += chunk
+        items = []
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    # Strings directly inside the top-level object are group keys (or scalar values)
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:pos]
+                continue
+            if char == '"' and self._depth > 0:
+                self._in_string = True
+                self._string_start = pos
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 2 and char == '[':
+                    self._group = self._last_string
+                elif self._depth == 3 and char == '{':
+                    self._item_start = pos
+            elif char in '}]' and self._depth > 0:
+                if self._depth == 3 and char == '}' and self._item_start is not None:
+                    try:
+                        items.append((self._group, loads_json(text[self._item_start:pos + 1])))
+                    except ValueError as e:
+                        logging.warning("Could not decode streamed item: %s", e)
+                    self._item_start = None
+                self._depth -= 1
+        self._pos = len(text)
+        items = [(group, _json_item(item)) for group, item in items]
+        return [(group, item) for group, item in items if item]
@@ -0,0 +1,170 @@
+# response_cache.py
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of LLM responses keyed on (model, temperature, max_tokens, prompt).
+    Survives Streamlit reruns and console sessions. Prompt embeddings can be stored alongside
+    responses so near-duplicate prompts can be served via get_similar, which only matches
+    entries stored with the same model, temperature, max_tokens and response format.
+    """
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        # scope -> [unit-normalized embedding matrix, responses, created_at], loaded from the table
+        # on the first get_similar and kept in step with set(), so lookups are one matrix product
+        self._embedding_index = {}
+        # Lookup counters for this process; get_similar hits are counted separately
+        self.stats = {"hits": 0, "misses": 0, "similar_hits": 0}
+
+    def _connect(self):
+        # Opened lazily so constructing the cache (e.g. on every Streamlit rerun) costs nothing
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, prompt TEXT, response TEXT, "
+                "embedding TEXT, created_at REAL, scope TEXT)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+            if "scope" not in columns:
+                # Rows from before similarity lookups were scoped keep a NULL scope and never match
+                self._conn.execute("ALTER TABLE responses ADD COLUMN scope TEXT")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(model, temperature, max_tokens, prompt):
+        raw = json.dumps([model, temperature, max_tokens, prompt])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_scope(model, temperature, max_tokens, response_format=None):
+        # Similar prompts are only interchangeable when they were answered under the same request
+        # parameters; a free-form reply must never be served to a structured request
+        return json.dumps([model, temperature, max_tokens, response_format], sort_keys=True)
+
+    @staticmethod
+    def _encode_embedding(embedding):
+        # Raw float32 bytes: a fraction of the size of the JSON text and no parsing on load
+        if embedding is None:
+            return None
+        import numpy as np
+
+        return np.asarray(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _decode_embedding(value):
+        import numpy as np
+
+        # Entries written before embeddings were stored as bytes hold JSON text
+        if isinstance(value, str):
+            return json.loads(value)
+        return np.frombuffer(value, dtype=np.float32)
+
+    def _min_created_at(self):
+        return time.time() - self.ttl if self.ttl else 0.0
+
+    def get(self, model, temperature, max_tokens, prompt):
+        """
+        Returns the cached response for an exact prompt match, or None.
+        """
+        key = self.make_key(model, temperature, max_tokens, prompt)
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                (key, self._min_created_at())
+            ).fetchone()
+            self.stats["hits" if row else "misses"] += 1
+        return row[0] if row else None
+
+    def set(self, model, temperature, max_tokens, prompt, response, embedding=None, response_format=None):
+        key = self.make_key(model, temperature, max_tokens, prompt)
+        scope = self.make_scope(model, temperature, max_tokens, response_format)
+        created_at = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, prompt, response, embedding, created_at, scope) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, prompt, response, self._encode_embedding(embedding), created_at, scope)
+            )
+            conn.commit()
+            if embedding is not None and scope in self._embedding_index:
+                self._add_to_index(scope, [embedding], [response], [created_at])
+
+    def delete(self, model, temperature, max_tokens, prompt):
+        key = self.make_key(model, temperature, max_tokens, prompt)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            # The deleted row's scope is not known from the key, so every index is reloaded lazily
+            self._embedding_index.clear()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+            self._embedding_index.clear()
+
+    def _add_to_index(self, scope, embeddings, responses, created_at):
+        import numpy as np
+
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        if scope in self._embedding_index:
+            index = self._embedding_index[scope]
+            if index[0].shape[1] == matrix.shape[1]:
+                matrix = np.vstack([index[0], matrix])
+                responses = index[1] + responses
+                created_at = np.concatenate([index[2], created_at])
+            else:
+                logging.warning("Embedding size changed for scope %s; rebuilding its similarity index.", scope)
+        self._embedding_index[scope] = [matrix, list(responses), np.asarray(created_at, dtype=np.float64)]
+
+    def get_similar(self, model, temperature, max_tokens, embedding, threshold, response_format=None):
+        """
+        Returns the cached response whose prompt embedding has the highest cosine similarity
+        to `embedding`, if that similarity is above `threshold`; otherwise None. Only entries
+        stored with the same model, temperature, max_tokens and response_format are considered.
+        """
+        import numpy as np
+
+        scope = self.make_scope(model, temperature, max_tokens, response_format)
+        with self._lock:
+            if scope not in self._embedding_index:
+                rows = self._connect().execute(
+                    "SELECT response, embedding, created_at FROM responses "
+                    "WHERE scope = ? AND embedding IS NOT NULL AND created_at >= ?",
+                    (scope, self._min_created_at())
+                ).fetchall()
+                if not rows:
+                    return None
+                self._add_to_index(scope, [self._decode_embedding(row[1]) for row in rows],
+                                   [row[0] for row in rows], [row[2] for row in rows])
+            matrix, responses, created_at = self._embedding_index[scope]
+
+        query = np.asarray(embedding, dtype=np.float32)
+        if len(responses) == 0 or query.shape[0] != matrix.shape[1]:
+            return None
+        similarities = matrix @ (query / (np.linalg.norm(query) or 1))
+        # Entries older than the TTL stay in the index but can no longer match
+        similarities[created_at < self._min_created_at()] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] >= threshold:
+            self.stats["similar_hits"] += 1
+            return responses[best]
+        return None
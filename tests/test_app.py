@@ -1,11 +1,17 @@
 # tests/test_app.py
+import asyncio
+import io
+import json
 import logging
 
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from anytree import Node, RenderTree
 
-from app import process_job, display_job_selection  # Ensure process_job is correctly imported from app.py
+from app import process_job, process_job_steps, process_jobs_async, display_job_selection, json_to_anytree, load_hierarchy_stream, filter_job_paths, ui_error  # Ensure process_job is correctly imported from app.py
+from downstream_processor import DownstreamProcessor
+from llm_interface import BatchCollector
+from prompt_builder import PromptBuilder
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -73,6 +79,40 @@ class TestDisplayJobSelection(unittest.TestCase):
         # Ensure process_job is not called since no jobs are selected
         mock_downstream_processor.process_job.assert_not_called()
 
+    @patch('app.save_hierarchy_to_markdown')
+    @patch('app.save_hierarchy_to_file')
+    @patch('app.process_jobs_async', new_callable=MagicMock)
+    @patch('app.asyncio.run')
+    @patch('app.st')
+    def test_display_job_selection_processes_only_selected_jobs(self, mock_st, mock_run, mock_process_jobs_async,
+                                                                mock_save_file, mock_save_markdown):
+        """
+        Test that only the Jobs whose paths were selected are passed on for processing.
+        """
+        root = Node("Finance")
+        jobs = [Node(f"Job{i}", parent=root, description="", processed=False) for i in range(5)]
+        mock_hierarchy_builder = MagicMock()
+        mock_hierarchy_builder.job_nodes = jobs
+        mock_hierarchy_builder.industry = "Finance"
+
+        mock_st.text_input.return_value = ""
+        mock_st.multiselect.return_value = ["Finance/Job3", "Finance/Job1"]
+        mock_st.button.return_value = True
+        # The wrapped coroutine is never run
+        mock_run.side_effect = lambda coroutine: coroutine.close()
+
+        mock_downstream_processor = MagicMock()
+        display_job_selection(mock_hierarchy_builder, mock_downstream_processor, MagicMock())
+
+        options = mock_st.multiselect.call_args.kwargs["options"]
+        self.assertIsInstance(options, list)
+        self.assertEqual(len(options), 5)
+
+        selected_job_nodes = mock_process_jobs_async.call_args.args[0]
+        self.assertEqual(selected_job_nodes, [jobs[1], jobs[3]])
+        mock_run.assert_called_once()
+        mock_downstream_processor.flush.assert_called_once_with(mock_hierarchy_builder.root, "Finance_hierarchy.json")
+
 
     # @patch('app.st')
     # def test_display_job_selection_with_jobs_and_selection(self, mock_st):
@@ -207,120 +247,29 @@ class TestApp(unittest.TestCase):
                              description="Root of the job hierarchy",
                              processed=False)
 
-        # Mock downstream_processor with methods that add child nodes
-        self.downstream_processor = MagicMock()
-
-        # Define side effects for each processing method
-        def process_job_contexts(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Job Contexts' under '{node.name}'")
-            # Add 'Job Contexts' as a child with processed=False
-            job_contexts = Node(
-                "Job Contexts",
-                parent=node,
-                description="Handles job contexts",
-                processed=False  # Set to False for further processing
-            )
-
-        def process_job_map(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Job Map' under '{node.name}'")
-            # Add 'Job Map' as a child under 'Job Contexts' with processed=False
-            job_map = Node("Job Map",
-                           parent=node,
-                           description="Handles job mapping",
-                           processed=False)
-
-        def process_desired_outcomes_success_metrics(node, n, fidelity, temp):
-            logging.debug(
-                f"Mock: Adding 'Desired Outcomes' under '{node.name}'")
-            # Add 'Desired Outcomes (success metrics)' under 'Job Map' with processed=False
-            desired_outcomes = Node("Desired Outcomes (success metrics)",
-                                    parent=node,
-                                    description="Handles desired outcomes",
-                                    processed=False)
-
-        def process_themed_desired_outcomes_themed_success_metrics(
-                node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Themed Success Metrics' under '{node.name}'")
-            # Add 'Themed Desired Outcomes (Themed Success Metrics)' under 'Job Map' with processed=False
-            themed_desired_outcomes = Node(
-                "Themed Desired Outcomes (Themed Success Metrics)",
-                parent=node,
-                description="Handles themed desired outcomes",
-                processed=False)
-
-        def process_situational_complexity_factors(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Situational and Complexity factors' under '{node.name}'")
-            # Add 'Situational and Complexity Factors' under 'Job Contexts' with processed=False
-            situational_factors = Node(
-                "Situational and Complexity Factors",
-                parent=node,
-                description="Handles situational factors",
-                processed=False)
-
-        def process_related_jobs(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Related Jobs' under '{node.name}'")
-            # Add 'Related Jobs' under 'Job Contexts' with processed=False
-            related_jobs = Node("Related Jobs",
-                                parent=node,
-                                description="Handles related jobs",
-                                processed=False)
-
-        def process_emotional_jobs(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Emotional Jobs' under '{node.name}'")
-            # Add 'Emotional Jobs' under 'Job Contexts' with processed=False
-            emotional_jobs = Node("Emotional Jobs",
-                                  parent=node,
-                                  description="Handles emotional jobs",
-                                  processed=False)
-
-        def process_social_jobs(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Social Jobs' under '{node.name}'")
-            # Add 'Social Jobs' under 'Job Contexts' with processed=False
-            social_jobs = Node("Social Jobs",
-                               parent=node,
-                               description="Handles social jobs",
-                               processed=False)
-
-        def process_financial_metrics_of_purchasing_decision_makers(
-                node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Financial Metrics' under '{node.name}'")
-            # Add 'Financial Metrics of Purchasing Decision Makers' under 'Job Contexts' with processed=False
-            financial_metrics = Node(
-                "Financial Metrics of Purchasing Decision Makers",
-                parent=node,
-                description="Handles financial metrics",
-                processed=False)
-
-        def process_ideal_job_state(node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Ideal Job State' under '{node.name}'")
-            # Add 'Ideal Job State' under 'Job Contexts' with processed=False
-            ideal_job_state = Node("Ideal Job State",
-                                   parent=node,
-                                   description="Handles ideal job state",
-                                   processed=False)
-
-        def process_potential_root_causes_preventing_the_ideal_state(
-                node, n, fidelity, temp):
-            logging.debug(f"Mock: Adding 'Potential Root Causes' under '{node.name}'")
-            # Add 'Potential Root Causes Preventing the Ideal State' under 'Ideal Job State' with processed=False
-            root_causes = Node(
-                "Potential Root Causes Preventing the Ideal State",
-                parent=node,
-                description="Handles root causes",
-                processed=False)
-
-        # Assign side effects to the mocked methods
-        self.downstream_processor.process_job_contexts.side_effect = process_job_contexts
-        self.downstream_processor.process_job_map.side_effect = process_job_map
-        self.downstream_processor.process_desired_outcomes_success_metrics.side_effect = process_desired_outcomes_success_metrics
-        self.downstream_processor.process_themed_desired_outcomes_themed_success_metrics.side_effect = process_themed_desired_outcomes_themed_success_metrics
-        self.downstream_processor.process_situational_complexity_factors.side_effect = process_situational_complexity_factors
-        self.downstream_processor.process_related_jobs.side_effect = process_related_jobs
-        self.downstream_processor.process_emotional_jobs.side_effect = process_emotional_jobs
-        self.downstream_processor.process_social_jobs.side_effect = process_social_jobs
-        self.downstream_processor.process_financial_metrics_of_purchasing_decision_makers.side_effect = process_financial_metrics_of_purchasing_decision_makers
-        self.downstream_processor.process_ideal_job_state.side_effect = process_ideal_job_state
-        self.downstream_processor.process_potential_root_causes_preventing_the_ideal_state.side_effect = process_potential_root_causes_preventing_the_ideal_state
+        # Mock downstream_processor with the methods process_job_steps calls, adding one child per node
+        descriptions = {
+            'Job Contexts': "Handles job contexts",
+            'Job Map': "Handles job mapping",
+            'Desired Outcomes with Themes': "Handles desired outcomes and their themes",
+            'Situational and Complexity Factors': "Handles situational factors",
+            'Related Jobs': "Handles related jobs",
+            'Emotional Jobs': "Handles emotional jobs",
+            'Social Jobs': "Handles social jobs",
+            'Financial Metrics of Purchasing Decision Makers': "Handles financial metrics",
+            'Ideal Job State': "Handles ideal job state",
+            'Potential Root Causes Preventing the Ideal State': "Handles root causes",
+        }
+
+        async def add_step(nodes, step, n, *args, **kwargs):
+            logging.debug(f"Mock: Adding '{step}' under {len(nodes)} nodes")
+            # Add the step as a child with processed=False, for further processing
+            return [[Node(step, parent=node, description=descriptions[step], processed=False)]
+                    for node in nodes]
+
+        self.downstream_processor = MagicMock(batchable_steps=frozenset({'Related Jobs'}), stream_callback=None)
+        self.downstream_processor.aprocess_siblings = AsyncMock(side_effect=add_step)
+        self.downstream_processor.process_step_batch = AsyncMock(side_effect=add_step)
 
         # Mock hierarchy_builder and visualizer if needed
         self.hierarchy_builder = MagicMock()
@@ -348,29 +297,14 @@ class TestApp(unittest.TestCase):
         self.assertIsNotNone(job_map,
                              "'Job Map' should be a child of 'Job Contexts'")
         self.assertEqual(len(job_map.children),
-                         2)  # 'Desired Outcomes' and 'Themed Desired Outcomes'
-        desired_outcomes = next((child for child in job_map.children
-                                 if child.name == "Desired Outcomes (success metrics)"), None)
-        self.assertIsNotNone(
-            desired_outcomes,
-            "'Desired Outcomes (success metrics)' should be a child of 'Job Map'"
-        )
+                         1)  # One step adds the desired outcomes and their themes
+        desired_outcomes = job_map.children[0]
+        self.assertEqual(desired_outcomes.name, "Desired Outcomes with Themes")
         self.assertEqual(desired_outcomes.description,
-                         "Handles desired outcomes")
+                         "Handles desired outcomes and their themes")
         self.assertEqual(len(desired_outcomes.children),
                          0)  # Further children not mocked here
 
-        themed_desired_outcomes = next(
-            (child for child in job_map.children if child.name ==
-             "Themed Desired Outcomes (Themed Success Metrics)"), None)
-        self.assertIsNotNone(
-            themed_desired_outcomes,
-            "'Themed Desired Outcomes (Themed Success Metrics)' should be a child of 'Job Map'"
-        )
-        self.assertEqual(themed_desired_outcomes.description,
-                         "Handles themed desired outcomes")
-        self.assertEqual(len(themed_desired_outcomes.children), 0)
-
         # Verify 'Potential Root Causes Preventing the Ideal State' under 'Ideal Job State'
         ideal_job_state = next((child for child in job_contexts.children
                                 if child.name == "Ideal Job State"), None)
@@ -438,5 +372,205 @@ class TestApp(unittest.TestCase):
         #     print("%s%s" % (pre, node.name))
 
 
+class TestProcessJobsAsync(unittest.TestCase):
+
+    def test_each_step_runs_for_all_jobs_at_once(self):
+        """
+        Test that every step is dispatched once for all jobs, and child steps run under the nodes
+        their parent step added.
+        """
+        root = Node("Finance")
+        jobs = [Node(f"Job{i}", parent=root, description="", processed=False) for i in range(2)]
+
+        async def aprocess_siblings(nodes, step, n, *args, **kwargs):
+            return [[Node(step, parent=node, description="", processed=False)] for node in nodes]
+
+        downstream_processor = MagicMock(batchable_steps=frozenset({'Related Jobs'}), stream_callback=None)
+        downstream_processor.aprocess_siblings = AsyncMock(side_effect=aprocess_siblings)
+        downstream_processor.process_step_batch = AsyncMock(side_effect=aprocess_siblings)
+        hierarchy_builder = MagicMock(fidelity="high")
+
+        asyncio.run(process_jobs_async(jobs, downstream_processor, hierarchy_builder))
+
+        calls = {call.args[1]: call.args[0] for call in downstream_processor.aprocess_siblings.call_args_list}
+        self.assertEqual(len(downstream_processor.aprocess_siblings.call_args_list), len(calls))
+        self.assertEqual(calls['Job Contexts'], jobs)
+        self.assertEqual(calls['Job Map'], [job.children[0] for job in jobs])
+        self.assertEqual([node.name for node in calls['Desired Outcomes with Themes']], ['Job Map', 'Job Map'])
+        # Steps that can be batched across jobs share requests instead
+        self.assertNotIn('Related Jobs', calls)
+        downstream_processor.process_step_batch.assert_awaited_once_with(calls['Job Map'], 'Related Jobs', 10)
+        hierarchy_builder.mark_processed.assert_any_call(jobs[0])
+        hierarchy_builder.mark_processed.assert_any_call(jobs[1])
+
+
+    def test_sibling_steps_all_run_when_responses_are_cached(self):
+        """
+        Test that an LLM answering without suspending (a cache hit) still runs every sibling step:
+        the first step to finish must not make the others skip the node.
+        """
+        llm = MagicMock()
+        llm.aget_response = AsyncMock(return_value="1. **Item** - Description.")
+        downstream_processor = DownstreamProcessor(PromptBuilder(), llm, structured_outputs=False)
+        job = Node("Open an account", parent=Node("Customer", parent=Node("Finance")),
+                   description="", processed=False)
+        steps = [{'step': step, 'n': 1} for step in
+                 ('Related Jobs', 'Emotional Jobs', 'Social Jobs', 'Situational and Complexity Factors')]
+
+        asyncio.run(process_job_steps([job], steps, downstream_processor, MagicMock(fidelity="high")))
+
+        self.assertEqual(llm.aget_response.await_count, 4)
+        self.assertEqual(len(job.children), 4)
+
+
+    def test_batch_mode_submits_one_batch_per_step_level(self):
+        """
+        Test that under a BatchCollector every level of the step hierarchy is one batch, including
+        child steps whose parents finished at different times within a level.
+        """
+        llm = MagicMock()
+        llm._build_request.side_effect = lambda prompt, *args: {"prompt": prompt}
+        llm._cache_get.return_value = None
+        batch_sizes = []
+
+        async def fake_arun_batch(requests, progress_callback=None, poll_interval=None):
+            batch_sizes.append(len(requests))
+            return {custom_id: "1. **Item** - Description." for custom_id, _ in requests}
+
+        llm.arun_batch = AsyncMock(side_effect=fake_arun_batch)
+        collector = BatchCollector(llm)
+        downstream_processor = DownstreamProcessor(PromptBuilder(), collector, structured_outputs=False)
+        job = Node("Open an account", parent=Node("Customer", parent=Node("Finance")),
+                   description="", processed=False)
+
+        asyncio.run(collector.run(process_jobs_async([job], downstream_processor, MagicMock(fidelity="high"))))
+
+        # Job Contexts; its seven child steps; then Desired Outcomes (Root Causes lacks its
+        # inputs under these stand-in answers, so it is skipped without a request)
+        self.assertEqual(batch_sizes, [1, 7, 1])
+        llm.aget_response.assert_not_called()
+
+
+class TestJsonToAnytree(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "name": "Finance",
+            "description": "Root",
+            "children": [
+                {"name": "Banking", "children": [
+                    {"name": "Open an account", "processed": True},
+                    {"name": "Apply for a loan"},
+                ]},
+                {"name": "Insurance", "children": [{"name": "File a claim"}]},
+            ]
+        }
+
+    def test_builds_tree_preserving_child_order(self):
+        root = json_to_anytree(self.data)
+
+        self.assertEqual(root.name, "Finance")
+        self.assertEqual([child.name for child in root.children], ["Banking", "Insurance"])
+        banking = root.children[0]
+        self.assertEqual([child.name for child in banking.children], ["Open an account", "Apply for a loan"])
+        self.assertTrue(banking.children[0].processed)
+        self.assertEqual(banking.children[1].path[0], root)
+
+    @patch('app.st')
+    def test_skips_subtrees_missing_a_name(self, mock_st):
+        self.data["children"].append({"description": "no name", "children": [{"name": "Orphan"}]})
+
+        root = json_to_anytree(self.data)
+
+        self.assertEqual([child.name for child in root.children], ["Banking", "Insurance"])
+        mock_st.error.assert_called_once()
+
+
+class TestFilterJobPaths(unittest.TestCase):
+    def test_case_insensitive_substring_match_preserves_order(self):
+        job_paths = ["Finance/Banking/Open an Account", "Finance/Insurance/File a claim", "Finance/Banking/Close ACCOUNT"]
+
+        self.assertEqual(filter_job_paths(job_paths, "account"),
+                         ["Finance/Banking/Open an Account", "Finance/Banking/Close ACCOUNT"])
+        self.assertEqual(filter_job_paths(job_paths, "mortgage"), [])
+        self.assertEqual(filter_job_paths(job_paths, ""), job_paths)
+
+
+class TestUiError(unittest.TestCase):
+    @patch('app.st')
+    @patch('app.get_script_run_ctx', return_value=None)
+    def test_logs_outside_a_streamlit_session(self, mock_ctx, mock_st):
+        with self.assertLogs(level='ERROR'):
+            ui_error("No prompt mapping found")
+        mock_st.error.assert_not_called()
+
+    @patch('app.st')
+    @patch('app.get_script_run_ctx', return_value=object())
+    def test_shows_error_inside_a_streamlit_session(self, mock_ctx, mock_st):
+        ui_error("No prompt mapping found")
+        mock_st.error.assert_called_once_with("No prompt mapping found")
+
+
+def ijson_events(value, prefix=''):
+    """
+    Minimal stand-in for ijson.parse, yielding (prefix, event, value) tuples for a decoded JSON value.
+    """
+    if isinstance(value, dict):
+        yield prefix, 'start_map', None
+        for key, item in value.items():
+            yield prefix, 'map_key', key
+            yield from ijson_events(item, f"{prefix}.{key}".lstrip('.'))
+        yield prefix, 'end_map', None
+    elif isinstance(value, list):
+        yield prefix, 'start_array', None
+        for item in value:
+            yield from ijson_events(item, f"{prefix}.item".lstrip('.'))
+        yield prefix, 'end_array', None
+    elif isinstance(value, bool):
+        yield prefix, 'boolean', value
+    elif isinstance(value, str):
+        yield prefix, 'string', value
+    else:
+        yield prefix, 'number' if value is not None else 'null', value
+
+
+class TestLoadHierarchyStream(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "name": "Finance",
+            "description": "Root",
+            "metadata": {"name": "ignored"},
+            "children": [
+                {"name": "Banking", "processed": True, "children": [{"name": "Open an account"}]},
+                {"description": "no name", "children": [{"name": "Orphan"}]},
+                {"children": [], "name": "Insurance", "description": "Name after children"},
+            ]
+        }
+
+    def assert_loaded(self, root):
+        self.assertEqual(root.name, "Finance")
+        self.assertEqual(root.description, "Root")
+        self.assertEqual([child.name for child in root.children], ["Banking", "Insurance"])
+        self.assertTrue(root.children[0].processed)
+        self.assertEqual(root.children[0].children[0].name, "Open an account")
+        self.assertEqual(root.children[1].description, "Name after children")
+
+    @patch('app.st')
+    def test_builds_tree_from_parse_events(self, mock_st):
+        fake_ijson = MagicMock()
+        fake_ijson.parse.side_effect = lambda file_obj: ijson_events(json.load(file_obj))
+        with patch('app.ijson', fake_ijson):
+            root = load_hierarchy_stream(io.StringIO(json.dumps(self.data)))
+
+        self.assert_loaded(root)
+        mock_st.error.assert_called_once()
+
+    @patch('app.st')
+    def test_falls_back_to_json_load_without_ijson(self, mock_st):
+        with patch('app.ijson', None):
+            root = load_hierarchy_stream(io.StringIO(json.dumps(self.data)))
+
+        self.assert_loaded(root)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,13 @@
 # test_console_app.py
 
+import json
+import asyncio
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from anytree import Node
-from console_app import load_hierarchy, save_hierarchy, get_job_nodes, process_node, display_leaf_nodes, select_node_for_processing, process_steps
+from downstream_processor import DownstreamProcessor
+from prompt_builder import PromptBuilder
+from console_app import load_hierarchy, save_hierarchy, get_job_nodes, process_node, display_leaf_nodes, select_node_for_processing, process_steps, select_nodes_for_processing, process_nodes
 
 class TestConsoleApp(unittest.TestCase):
 
@@ -18,62 +22,48 @@ class TestConsoleApp(unittest.TestCase):
         end_users_providers = Node("End Users - Providers", parent=retail_banking, processed=False, description="Providers of banking services")
         self.mock_leaf_node = Node("Providing Financial Solutions", parent=end_users_providers, processed=False, description="Mock Leaf Node")
 
-        # Mock downstream processor with all methods
-        self.mock_downstream_processor = MagicMock()
-
-        # Add mock methods to simulate creating children nodes
-        def mock_process_job_contexts(node, n, fidelity, temp):
-            Node("Job Map", parent=node, description="Mock Job Map node", processed=False)
-
-        def mock_process_job_map(node, fidelity, temp):
-            Node("Desired Outcomes", parent=node, description="Mock Desired Outcomes node", processed=False)
-
-        def mock_process_desired_outcomes(node, n, fidelity, temp):
-            # "Themed Desired Outcomes" should not be under "Desired Outcomes" but should be a sibling in the context of "Job Map".
-            # This means we add it under "Job Map" (node.parent) instead of "Desired Outcomes"
-            Node("Themed Desired Outcomes", parent=node.parent, description="Mock Themed Desired Outcomes node", processed=False)
-
-        def mock_process_themed_desired_outcomes(node, n, fidelity, temp):
-            # This should remain consistent and ensure that "Situational Complexity Factors" is added under "Job Map"
-            Node("Situational Complexity Factors", parent=node.parent, description="Mock Situational Factors node", processed=False)
-
-
-        # Assign side effects to each mock method
-        self.mock_downstream_processor.process_job_contexts.side_effect = mock_process_job_contexts
-        self.mock_downstream_processor.process_job_map.side_effect = mock_process_job_map
-        self.mock_downstream_processor.process_desired_outcomes.side_effect = mock_process_desired_outcomes
-        self.mock_downstream_processor.process_themed_desired_outcomes.side_effect = mock_process_themed_desired_outcomes
-
-
-        # Correct mock names
-        # self.mock_downstream_processor.process_themed_desired_outcomes_themed_success_metrics.side_effect = mock_process_themed_desired_outcomes
-        # self.mock_downstream_processor.process_situational_complexity_factors.side_effect = mock_process_situational_complexity_factors
-        # self.mock_downstream_processor.process_related_jobs.side_effect = mock_process_related_jobs
-        # self.mock_downstream_processor.process_emotional_jobs.side_effect = mock_process_emotional_jobs
-        # self.mock_downstream_processor.process_social_jobs.side_effect = mock_process_social_jobs
-        # self.mock_downstream_processor.process_financial_metrics_of_purchasing_decision_makers.side_effect = mock_process_financial_metrics
-        # self.mock_downstream_processor.process_ideal_job_state.side_effect = mock_process_ideal_job_state
-
-
-
+        # Mock downstream processor with the step methods process_steps calls, each adding a
+        # child named after its step and returning it
+        self.mock_downstream_processor = MagicMock(sibling_batch_steps=frozenset())
+
+        def adds_child(name):
+            async def add_child(node, **kwargs):
+                return [Node(name, parent=node, description=f"Mock {name} node", processed=False)]
+            return AsyncMock(side_effect=add_child)
+
+        for method_name, name in [
+            ('process_job_contexts', "Job Contexts"),
+            ('process_job_map', "Job Map"),
+            ('process_desired_outcomes', "Desired Outcomes"),
+            ('process_themed_desired_outcomes', "Themed Desired Outcomes"),
+            ('process_situational_complexity_factors', "Situational Complexity Factors"),
+            ('process_related_jobs', "Related Jobs"),
+            ('process_emotional_jobs', "Emotional Jobs"),
+            ('process_social_jobs', "Social Jobs"),
+            ('process_financial_metrics', "Financial Metrics"),
+            ('process_ideal_job_state', "Ideal Job State"),
+            ('process_potential_root_causes', "Root Causes"),
+        ]:
+            setattr(self.mock_downstream_processor, method_name, adds_child(name))
 
     def test_load_hierarchy(self):
         """
         Test that the hierarchy loads correctly from a JSON file.
         """
-        with patch("builtins.open", unittest.mock.mock_open(read_data='{"name": "Finance"}')), \
-             patch("json.load", return_value={"name": "Finance"}):
+        with patch("builtins.open", unittest.mock.mock_open(read_data=b'{"name": "Finance"}')) as mocked_file:
             root_node = load_hierarchy("mock_hierarchy.json")
+            mocked_file.assert_called_once_with("mock_hierarchy.json", "rb")
             self.assertEqual(root_node.name, "Finance")
 
     def test_save_hierarchy(self):
         """
         Test that the hierarchy saves correctly to a JSON file.
         """
-        with patch("json.dump") as mock_json_dump, \
-             patch("builtins.open", unittest.mock.mock_open()):
+        with patch("builtins.open", unittest.mock.mock_open()) as mocked_file:
             save_hierarchy(self.root, "mock_hierarchy.json")
-            mock_json_dump.assert_called_once()
+            mocked_file.assert_called_once_with("mock_hierarchy.json", "wb")
+            written_data = b"".join(call.args[0] for call in mocked_file().write.call_args_list)
+            self.assertEqual(json.loads(written_data)["name"], self.root.name)
 
     def test_get_job_nodes(self):
         """
@@ -90,45 +80,37 @@ class TestConsoleApp(unittest.TestCase):
         process_node(self.mock_leaf_node, self.mock_downstream_processor)
 
         # Verify that process_job_contexts was called and a child was created
-        self.mock_downstream_processor.process_job_contexts.assert_called()
-        job_map_node = self.mock_leaf_node.children[-1]
-        self.assertEqual(job_map_node.name, "Job Map")
+        self.mock_downstream_processor.process_job_contexts.assert_called_once_with(
+            node=self.mock_leaf_node, n=10, fidelity="comprehensive", temp=0.1
+        )
+        job_contexts_node = self.mock_leaf_node.children[-1]
+        self.assertEqual(job_contexts_node.name, "Job Contexts")
+        self.assertEqual(len(job_contexts_node.children), 7)
 
-        # Verify that process_job_map was called for the "Job Map" node
+        # Verify that process_job_map was called under "Job Contexts"
+        job_map_node = next(child for child in job_contexts_node.children if child.name == "Job Map")
         self.mock_downstream_processor.process_job_map.assert_called_once_with(
-            node=job_map_node, fidelity="med", temp=0.1
+            node=job_contexts_node, fidelity="med", temp=0.1
         )
 
-        # Verify that process_desired_outcomes was called with the "Desired Outcomes" node
-        desired_outcomes_node = job_map_node.children[-1]
+        # Verify that the desired outcomes and their themes are siblings under "Job Map"
         self.mock_downstream_processor.process_desired_outcomes.assert_called_once_with(
-            node=desired_outcomes_node, n=20, fidelity="comprehensive", temp=0.1
+            node=job_map_node, n=20, fidelity="comprehensive", temp=0.1
         )
-
-        # Verify that process_themed_desired_outcomes was called with the "Themed Desired Outcomes" node
-        themed_outcomes_node = desired_outcomes_node.children[-1]
-        self.assertEqual(themed_outcomes_node.name, "Themed Desired Outcomes")
         self.mock_downstream_processor.process_themed_desired_outcomes.assert_called_once_with(
-            node=themed_outcomes_node, n=10, fidelity="comprehensive", temp=0.1
+            node=job_map_node, n=10, fidelity="comprehensive", temp=0.1
         )
+        self.assertEqual(sorted(child.name for child in job_map_node.children),
+                         ["Desired Outcomes", "Themed Desired Outcomes"])
 
-        # Verify that "Desired Outcomes" is correctly under "Job Map"
-        job_map_node = self.mock_leaf_node.children[-1]
-        desired_outcomes_node = job_map_node.children[-1]
-        self.assertEqual(desired_outcomes_node.name, "Desired Outcomes")
-    
-        # Verify that "Themed Desired Outcomes" is a sibling of "Desired Outcomes" under "Job Map"
-        themed_outcomes_node = job_map_node.children[-2]  # Assuming "Themed Desired Outcomes" is created before "Desired Outcomes"
-        self.assertEqual(themed_outcomes_node.name, "Themed Desired Outcomes")
-        self.assertEqual(themed_outcomes_node.parent, job_map_node)
-        self.assertEqual(desired_outcomes_node.parent, job_map_node)
-    
-        # Verify that "Situational Complexity Factors" is a sibling of "Job Map"'s children and correctly placed
-        situational_factors_node = job_map_node.children[-1]  # Assuming "Situational Complexity Factors" is created after "Themed Desired Outcomes"
-        self.assertEqual(situational_factors_node.name, "Situational Complexity Factors")
-        self.assertEqual(situational_factors_node.parent, job_map_node)
-
+        # Verify that the root causes are added under "Ideal Job State"
+        ideal_job_state_node = next(child for child in job_contexts_node.children if child.name == "Ideal Job State")
+        self.assertEqual([child.name for child in ideal_job_state_node.children], ["Root Causes"])
 
+        # Every node that ran its steps is marked processed, and the hierarchy is written once
+        self.assertTrue(self.mock_leaf_node.processed)
+        self.assertTrue(job_map_node.processed)
+        self.mock_downstream_processor.flush.assert_called_once_with(self.root, "hierarchy.json")
 
     def test_process_steps(self):
         """
@@ -138,26 +120,29 @@ class TestConsoleApp(unittest.TestCase):
         steps = [
             {
                 'step': 'Job Contexts',
+                'method': 'process_job_contexts',
                 'n': 10,
                 'children_steps': [
                     {
                         'step': 'Job Map',
+                        'method': 'process_job_map',
                         'n': 0,
                         'children_steps': [
-                            {'step': 'Desired Outcomes (success metrics)', 'n': 20},
-                            {'step': 'Themed Desired Outcomes (Themed Success Metrics)', 'n': 10},
+                            {'step': 'Desired Outcomes (success metrics)', 'method': 'process_desired_outcomes', 'n': 20},
+                            {'step': 'Themed Desired Outcomes (Themed Success Metrics)', 'method': 'process_themed_desired_outcomes', 'n': 10},
                         ]
                     },
-                    {'step': 'Situational Complexity Factors', 'n': 10},
-                    {'step': 'Related Jobs', 'n': 10},
-                    {'step': 'Emotional Jobs', 'n': 10},
-                    {'step': 'Social Jobs', 'n': 10},
-                    {'step': 'Financial Metrics of Purchasing Decision Makers', 'n': 10},
+                    {'step': 'Situational Complexity Factors', 'method': 'process_situational_complexity_factors', 'n': 10},
+                    {'step': 'Related Jobs', 'method': 'process_related_jobs', 'n': 10},
+                    {'step': 'Emotional Jobs', 'method': 'process_emotional_jobs', 'n': 10},
+                    {'step': 'Social Jobs', 'method': 'process_social_jobs', 'n': 10},
+                    {'step': 'Financial Metrics of Purchasing Decision Makers', 'method': 'process_financial_metrics', 'n': 10},
                     {
                         'step': 'Ideal Job State',
+                        'method': 'process_ideal_job_state',
                         'n': 15,
                         'children_steps': [
-                            {'step': 'Potential Root Causes Preventing the Ideal State', 'n': 15},
+                            {'step': 'Potential Root Causes Preventing the Ideal State', 'method': 'process_potential_root_causes', 'n': 15},
                         ]
                     },
                 ]
@@ -165,7 +150,7 @@ class TestConsoleApp(unittest.TestCase):
         ]
 
         # Call process_steps with the mock leaf node and steps
-        process_steps(self.mock_leaf_node, steps, self.mock_downstream_processor)
+        asyncio.run(process_steps(self.mock_leaf_node, steps, self.mock_downstream_processor))
 
         # Verify that all processing methods were called for each step
         self.mock_downstream_processor.process_job_contexts.assert_called_once_with(
@@ -173,28 +158,128 @@ class TestConsoleApp(unittest.TestCase):
         )
 
         # Check that each subsequent child was added correctly and processed
-        job_map_node = self.mock_leaf_node.children[-1]
-        self.assertEqual(job_map_node.name, "Job Map")
+        job_contexts_node = self.mock_leaf_node.children[-1]
+        self.assertEqual(job_contexts_node.name, "Job Contexts")
+        self.assertEqual([child.name for child in job_contexts_node.children], [
+            "Job Map", "Situational Complexity Factors", "Related Jobs", "Emotional Jobs",
+            "Social Jobs", "Financial Metrics", "Ideal Job State",
+        ])
+        job_map_node = job_contexts_node.children[0]
         self.mock_downstream_processor.process_job_map.assert_called_once_with(
-            node=job_map_node, fidelity="med", temp=0.1
+            node=job_contexts_node, fidelity="med", temp=0.1
         )
 
-        desired_outcomes_node = job_map_node.children[-1]
-        self.assertEqual(desired_outcomes_node.name, "Desired Outcomes")
         self.mock_downstream_processor.process_desired_outcomes.assert_called_once_with(
-            node=desired_outcomes_node, n=20, fidelity="comprehensive", temp=0.1
+            node=job_map_node, n=20, fidelity="comprehensive", temp=0.1
         )
-
-        themed_outcomes_node = desired_outcomes_node.children[-1]
-        self.assertEqual(themed_outcomes_node.name, "Themed Desired Outcomes")
         self.mock_downstream_processor.process_themed_desired_outcomes.assert_called_once_with(
-            node=themed_outcomes_node, n=10, fidelity="comprehensive", temp=0.1
+            node=job_map_node, n=10, fidelity="comprehensive", temp=0.1
+        )
+        self.mock_downstream_processor.process_potential_root_causes.assert_called_once_with(
+            node=job_contexts_node.children[-1], n=15, fidelity="comprehensive", temp=0.1
         )
 
 
-        # Continue adding assertions as necessary to confirm the hierarchy is being built correctly
+    def test_process_steps_runs_siblings_concurrently(self):
+        """
+        Test that sibling steps are in flight at the same time and child steps run under their parent.
+        """
+        in_flight = 0
+        peak = 0
+
+        async def add_step_node(name, node, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return [Node(name, parent=node, processed=False)]
+
+        processor = MagicMock()
+        processor.process_related_jobs.side_effect = lambda **kw: add_step_node("Related Jobs", **kw)
+        processor.process_social_jobs.side_effect = lambda **kw: add_step_node("Social Jobs", **kw)
+        processor.process_ideal_job_state.side_effect = lambda **kw: add_step_node("Ideal Job State", **kw)
+        processor.process_potential_root_causes.side_effect = lambda **kw: add_step_node("Root Causes", **kw)
+        steps = [
+            {'step': 'Related Jobs', 'method': 'process_related_jobs', 'n': 10},
+            {'step': 'Social Jobs', 'method': 'process_social_jobs', 'n': 10},
+            {
+                'step': 'Ideal Job State',
+                'method': 'process_ideal_job_state',
+                'n': 15,
+                'children_steps': [
+                    {'step': 'Potential Root Causes Preventing the Ideal State', 'method': 'process_potential_root_causes', 'n': 15},
+                ]
+            },
+        ]
+        job = Node("Open an account", processed=False)
+
+        asyncio.run(process_steps(job, steps, processor))
+
+        self.assertEqual(peak, 3)
+        self.assertEqual([child.name for child in job.children], ["Related Jobs", "Social Jobs", "Ideal Job State"])
+        self.assertEqual(job.children[2].children[0].name, "Root Causes")
+        self.assertTrue(job.processed)
 
+    def test_process_steps_batches_leaf_siblings(self):
+        """
+        Test that sibling steps without children of their own go out as one sibling batch.
+        """
+        processor = MagicMock()
+        processor.sibling_batch_steps = {'process_related_jobs': 'Related Jobs', 'process_social_jobs': 'Social Jobs'}
 
+        async def add_ideal_state(node, **kwargs):
+            return [Node("Ideal", parent=node, processed=False)]
+
+        processor.process_sibling_batch = AsyncMock(return_value={})
+        processor.process_ideal_job_state.side_effect = add_ideal_state
+        steps = [
+            {'step': 'Related Jobs', 'method': 'process_related_jobs', 'n': 10},
+            {'step': 'Social Jobs', 'method': 'process_social_jobs', 'n': 10},
+            {'step': 'Ideal Job State', 'method': 'process_ideal_job_state', 'n': 15},
+        ]
+        job = Node("Open an account", processed=False)
+
+        asyncio.run(process_steps(job, steps, processor))
+
+        processor.process_sibling_batch.assert_awaited_once_with(node=job, steps=steps[:2])
+        processor.process_related_jobs.assert_not_called()
+        processor.process_ideal_job_state.assert_called_once()
+
+    def test_sibling_steps_all_run_when_responses_are_cached(self):
+        """
+        Test that an LLM answering without suspending (a cache hit) still runs every sibling step.
+        """
+        llm = MagicMock()
+        llm.aget_response = AsyncMock(return_value="1. **Item** - Description.")
+        processor = DownstreamProcessor(PromptBuilder(), llm, structured_outputs=False)
+        steps = [
+            {'step': 'Job Contexts', 'method': 'process_job_contexts', 'n': 1},
+            {'step': 'Related Jobs', 'method': 'process_related_jobs', 'n': 1},
+            {'step': 'Ideal Job State', 'method': 'process_ideal_job_state', 'n': 1},
+        ]
+
+        asyncio.run(process_steps(self.mock_leaf_node, steps, processor))
+
+        self.assertEqual(llm.aget_response.await_count, 3)
+        self.assertEqual(len(self.mock_leaf_node.children), 3)
+
+    def test_process_node_skips_processed_nodes_unless_forced(self):
+        """
+        Test that an already processed node is not re-run, and that force re-runs it without its cached responses.
+        """
+        self.mock_leaf_node.processed = True
+        with patch("builtins.print"):
+            process_node(self.mock_leaf_node, self.mock_downstream_processor)
+        self.mock_downstream_processor.process_job_contexts.assert_not_called()
+        self.mock_downstream_processor.clear_cache.assert_not_called()
+
+        with patch("builtins.print"), patch("console_app.process_steps", new_callable=AsyncMock) as mock_steps:
+            process_node(self.mock_leaf_node, self.mock_downstream_processor, force=True)
+        mock_steps.assert_awaited_once()
+        self.mock_downstream_processor.clear_cache.assert_called_once_with(
+            self.mock_leaf_node, 'Job Contexts', n=10, fidelity="comprehensive", temp=0.1)
+        self.assertTrue(self.mock_leaf_node.processed)
 
     def test_select_node_for_processing(self):
         """
@@ -204,6 +289,37 @@ class TestConsoleApp(unittest.TestCase):
             selected_node = select_node_for_processing(self.root)
             self.assertEqual(selected_node, self.mock_leaf_node)
 
+    def test_select_nodes_for_processing(self):
+        """
+        Test that comma-separated input selects several job nodes and skips invalid entries.
+        """
+        other_job = Node("Managing Risk", parent=self.mock_leaf_node.parent, processed=False, description="Second job")
+        with patch("builtins.input", return_value='2, 1, 9'), patch("builtins.print"):
+            selected_nodes = select_nodes_for_processing(self.root)
+        self.assertEqual(selected_nodes, [other_job, self.mock_leaf_node])
+
+    def test_process_nodes_processes_every_selected_job(self):
+        """
+        Test that process_nodes runs the steps for each selected job on one event loop.
+        """
+        other_job = Node("Managing Risk", parent=self.mock_leaf_node.parent, processed=False, description="Second job")
+        processor = MagicMock(sibling_batch_steps={}, store=None)
+        for name in ["process_job_contexts", "process_job_map", "process_desired_outcomes",
+                     "process_themed_desired_outcomes", "process_situational_complexity_factors",
+                     "process_related_jobs", "process_emotional_jobs", "process_social_jobs",
+                     "process_financial_metrics", "process_ideal_job_state", "process_potential_root_causes"]:
+            setattr(processor, name, AsyncMock(return_value=[]))
+
+        with patch("builtins.print"):
+            process_nodes([self.mock_leaf_node, other_job], processor)
+
+        self.assertTrue(self.mock_leaf_node.processed)
+        self.assertTrue(other_job.processed)
+        called_nodes = [call.kwargs["node"] for call in processor.process_job_contexts.call_args_list]
+        self.assertEqual(called_nodes, [self.mock_leaf_node, other_job])
+        # The buffered hierarchy is written once, after the whole gather
+        processor.flush.assert_called_once_with(self.root, "hierarchy.json")
+
     def test_display_leaf_nodes(self):
         """
         Test that leaf nodes are correctly displayed.
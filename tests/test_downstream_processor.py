@@ -1,7 +1,8 @@
 # tests/test_downstream_processor.py
 
+import asyncio
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 from anytree import Node, PreOrderIter
 from downstream_processor import DownstreamProcessor
 from prompt_builder import PromptBuilder
@@ -9,6 +10,11 @@ from llm_interface import LLMInterface
 
 class TestDownstreamProcessor(unittest.TestCase):
     def setUp(self):
+        # Stand-in OpenAI clients, so the suite needs neither an API key nor the network
+        clients = patch.multiple('llm_interface', _shared_client=None, OpenAI=MagicMock(),
+                                 AsyncOpenAI=MagicMock(side_effect=lambda **kwargs: MagicMock(close=AsyncMock())))
+        clients.start()
+        self.addCleanup(clients.stop)
         # Initialize PromptBuilder and LLMInterface with mocked responses
         self.prompt_builder = PromptBuilder(prompts_dir='prompts')
         self.llm = LLMInterface()
@@ -58,6 +64,7 @@ class TestDownstreamProcessor(unittest.TestCase):
 
         # Mock the get_response method to return responses based on the prompt content
         self.llm.get_response = MagicMock(side_effect=mock_get_response)
+        self.llm.aget_response = AsyncMock(side_effect=mock_get_response)
 
         self.downstream_processor = DownstreamProcessor(self.prompt_builder, self.llm)
 
@@ -105,33 +112,33 @@ class TestDownstreamProcessor(unittest.TestCase):
         )
 
         # Process 'Job Contexts' on 'Account Manager'
-        self.downstream_processor.process_job_contexts(
+        asyncio.run(self.downstream_processor.process_job_contexts(
             account_manager, n=2, fidelity='high', temp=0.1
-        )
+        ))
 
         # Process 'Job Map' on 'Account Manager'
-        self.downstream_processor.process_job_map(
+        asyncio.run(self.downstream_processor.process_job_map(
             account_manager, fidelity='high', temp=0.1
-        )
+        ))
 
         # Process 'Emotional Jobs' on 'Account Manager'
-        self.downstream_processor.process_emotional_jobs(
+        asyncio.run(self.downstream_processor.process_emotional_jobs(
             account_manager, n=2, fidelity='high', temp=0.1
-        )
+        ))
 
         # Process 'Social Jobs' on 'Account Manager'
-        self.downstream_processor.process_social_jobs(
+        asyncio.run(self.downstream_processor.process_social_jobs(
             account_manager, n=2, fidelity='high', temp=0.1
-        )
+        ))
 
         # Process 'Desired Outcomes Success Metrics' on each Job Context
         for context_node in account_manager.children[:2]:  # First two children are 'Job Contexts'
-            self.downstream_processor.process_desired_outcomes(
+            asyncio.run(self.downstream_processor.process_desired_outcomes(
                 context_node, n=2, fidelity='high', temp=0.1
-            )
-            self.downstream_processor.process_themed_desired_outcomes(
+            ))
+            asyncio.run(self.downstream_processor.process_themed_desired_outcomes(
                 context_node, n=2, fidelity='high', temp=0.1
-            )
+            ))
 
         # Define the expected hierarchy structure
         expected_hierarchy = [
@@ -246,5 +253,287 @@ class TestDownstreamProcessor(unittest.TestCase):
         # Traverse the 'Account Manager' node and verify its hierarchy
         self.verify_hierarchy(account_manager, expected_hierarchy)
 
+    def test_process_step_dispatches_to_prompt_and_parser(self):
+        """
+        Steps are resolved through the dispatch table to their PromptBuilder and PromptParser methods.
+        """
+        root = Node("Finance", processed=False)
+        end_user = Node("Account Manager", parent=root, processed=False)
+        job_step = Node("Verify details", parent=end_user, description="", processed=False)
+
+        new_children = self.downstream_processor.process_step(job_step, 'Desired Outcomes (success metrics)', 2, 'high')
+
+        self.assertEqual([child.name for child in new_children], ['Improved Efficiency', 'Enhanced Security'])
+        self.assertTrue(job_step.processed)
+
+    def test_aprocess_siblings_runs_the_step_for_each_node(self):
+        """
+        Sibling nodes are processed concurrently, with one request each, and results keep node order.
+        """
+        end_user = Node("Account Manager", parent=Node("Finance"), processed=False)
+        steps = [Node(f"Verify details {i}", parent=end_user, description="", processed=False) for i in range(3)]
+
+        new_children = asyncio.run(self.downstream_processor.aprocess_siblings(
+            steps, 'Desired Outcomes (success metrics)', 2, 'high'
+        ))
+
+        self.assertEqual(self.llm.aget_response.await_count, 3)
+        for step, children in zip(steps, new_children):
+            self.assertEqual([child.parent for child in children], [step, step])
+            self.assertTrue(step.processed)
+
+    def test_clear_cache_forgets_the_step_prompt_of_a_processed_node(self):
+        """
+        Clearing a step's cache rebuilds its prompt even though the node is already processed.
+        """
+        self.llm.clear_cache = MagicMock()
+        end_user = Node("Account Manager", parent=Node("Finance"), processed=False)
+        job = Node("Open an account", parent=end_user, description="", processed=True)
+
+        self.downstream_processor.clear_cache(job, 'Related Jobs', n=10, fidelity='high')
+
+        expected_prompt = self.prompt_builder.build_related_jobs_prompt(
+            end_user="Finance", job="Open an account", context="", n=10)
+        self.llm.clear_cache.assert_called_once_with(expected_prompt)
+
+    @patch('downstream_processor.update_hierarchy_in_file')
+    def test_flush_writes_only_after_changes(self, mock_update):
+        """
+        The hierarchy file is rewritten once per flush, and only if a step changed the tree.
+        """
+        end_user = Node("Account Manager", parent=Node("Finance"), processed=False)
+        job_step = Node("Verify details", parent=end_user, description="", processed=False)
+
+        self.assertFalse(self.downstream_processor.flush(end_user.root, "hierarchy.json"))
+        self.downstream_processor.process_step(job_step, 'Desired Outcomes (success metrics)', 2, 'high')
+        self.assertTrue(self.downstream_processor.flush(end_user.root, "hierarchy.json"))
+        self.assertFalse(self.downstream_processor.flush(end_user.root, "hierarchy.json"))
+
+        mock_update.assert_called_once_with(end_user.root, "hierarchy.json")
+
+    def test_step_without_end_user_is_skipped(self):
+        """
+        A node less than two levels deep has no end user, so the step is skipped instead of raising.
+        """
+        job = Node("Verify details", parent=Node("Finance"), description="", processed=False)
+
+        self.assertEqual(self.downstream_processor.process_step(job, 'Related Jobs', 2, 'high'), [])
+        self.llm.aget_response.assert_not_called()
+
+    def test_unknown_step_is_reported_to_error_sink(self):
+        """
+        Errors go to the injected error sink instead of a hard-wired Streamlit call.
+        """
+        error_sink = MagicMock()
+        downstream_processor = DownstreamProcessor(MagicMock(), self.llm, error_sink=error_sink)
+        node = Node("Verify details", parent=Node("Finance"), description="", processed=False)
+
+        self.assertEqual(downstream_processor.process_step(node, 'Unknown Step', 2, 'high'), [])
+        error_sink.assert_called_once_with("No prompt mapping found for step 'Unknown Step'.")
+
+    def test_streamed_response_is_reported_and_parsed(self):
+        """
+        With a stream_callback set, partial output is reported per chunk and each completed line becomes a child.
+        """
+        chunks = [
+            "1. **IT Managed Services Provider** - A company looking to outsource IT.\n",
+            "2. **Network Security Specialist** - Protects the network.",
+        ]
+
+        async def mock_astream_response(prompt, temperature=None):
+            for chunk in chunks:
+                yield chunk
+
+        self.llm.astream_response = mock_astream_response
+        updates = []
+        children_seen = []
+
+        def on_chunk(node, step, text):
+            updates.append((node.name, step, text))
+            children_seen.append([child.name for child in node.children])
+
+        downstream_processor = DownstreamProcessor(MagicMock(), self.llm, stream_callback=on_chunk)
+
+        root = Node("Finance", processed=False)
+        department = Node("Banking Department", parent=root, processed=False)
+        account_manager = Node("Account Manager", parent=department, description="Manages client accounts.", processed=False)
+
+        new_children = asyncio.run(downstream_processor.process_job_contexts(
+            account_manager, n=2, fidelity='high', temp=0.1
+        ))
+
+        self.assertEqual([update[2] for update in updates], [chunks[0], chunks[0] + chunks[1]])
+        # The first item was attached as soon as its line was complete
+        self.assertEqual(children_seen[0], ["IT Managed Services Provider"])
+        self.assertEqual(updates[0][:2], ("Account Manager", "Job Contexts"))
+        self.assertEqual([child.name for child in new_children],
+                         ["IT Managed Services Provider", "Network Security Specialist"])
+        self.llm.aget_response.assert_not_called()
+        self.assertTrue(account_manager.processed)
+
+    def test_desired_outcomes_with_themes_adds_both_groups_from_one_call(self):
+        """
+        The fused step makes a single LLM call and attaches an outcomes group and a themes group.
+        """
+        prompt_builder = MagicMock()
+        prompt_builder.build_desired_outcomes_with_themes_prompt.return_value = "fused prompt"
+        prompt_builder.parse_desired_outcomes_with_themes.return_value = {
+            'outcomes': [{'name': 'Minimize the time it takes to verify details', 'description': ''}],
+            'themes': [{'name': 'Confirm readiness', 'description': 'Groups verification'}],
+        }
+        self.llm.aget_response = AsyncMock(return_value='{"outcomes": [], "themes": []}')
+        downstream_processor = DownstreamProcessor(prompt_builder, self.llm, prompt_parser=prompt_builder)
+
+        root = Node("Finance", processed=False)
+        end_user = Node("Account Manager", parent=root, processed=False)
+        job_step = Node("Verify details", parent=end_user, description="", processed=False)
+
+        new_children = asyncio.run(downstream_processor.process_desired_outcomes_with_themes(
+            job_step, n=20, fidelity='high', temp=0.1, n_themed=10
+        ))
+
+        self.llm.aget_response.assert_awaited_once_with("fused prompt")
+        prompt_builder.build_desired_outcomes_with_themes_prompt.assert_called_once_with(
+            end_user="Finance", job="Verify details", context="", step="Verify details", n=20, n_themed=10
+        )
+        self.assertEqual([child.name for child in new_children],
+                         ['Desired Outcomes (success metrics)', 'Themed Desired Outcomes (Themed Success Metrics)'])
+        self.assertEqual(new_children[0].children[0].name, 'Minimize the time it takes to verify details')
+        self.assertEqual(new_children[1].children[0].description, 'Groups verification')
+        self.assertTrue(job_step.processed)
+
+    def test_streamed_grouped_response_attaches_items_as_they_complete(self):
+        """
+        With a stream_callback set, each JSON item of a grouped step is attached once its object closes.
+        """
+        chunks = [
+            '{"outcomes": [{"name": "Minimize the time it takes to verify details", "description": ""},',
+            ' {"name": "Minimize the likelihood of errors"}], "themes": [{"name": "Confirm readiness"}]}',
+        ]
+
+        async def mock_astream_response(prompt, temperature=None):
+            for chunk in chunks:
+                yield chunk
+
+        self.llm.astream_response = mock_astream_response
+        children_seen = []
+
+        def on_chunk(node, step, text):
+            children_seen.append([(child.name, len(child.children)) for child in node.children])
+
+        downstream_processor = DownstreamProcessor(MagicMock(), self.llm, stream_callback=on_chunk)
+        root = Node("Finance", processed=False)
+        end_user = Node("Account Manager", parent=root, processed=False)
+        job_step = Node("Verify details", parent=end_user, description="", processed=False)
+
+        new_children = asyncio.run(downstream_processor.process_desired_outcomes_with_themes(
+            job_step, n=2, fidelity='high', temp=0.1, n_themed=1
+        ))
+
+        # The first outcome was attached before the rest of the response arrived
+        self.assertEqual(children_seen[0], [('Desired Outcomes (success metrics)', 1)])
+        self.assertEqual([child.name for child in new_children],
+                         ['Desired Outcomes (success metrics)', 'Themed Desired Outcomes (Themed Success Metrics)'])
+        self.assertEqual([child.name for child in new_children[0].children],
+                         ['Minimize the time it takes to verify details', 'Minimize the likelihood of errors'])
+        self.assertTrue(job_step.processed)
+
+    def test_structured_outputs_decode_json_items(self):
+        """
+        With structured outputs on, the step requests a json_schema response and decodes its items.
+        """
+        self.llm.aget_response = AsyncMock(
+            return_value='{"items": [{"name": "Open an account", "description": "Start banking."}]}')
+        downstream_processor = DownstreamProcessor(PromptBuilder(), self.llm, structured_outputs=True)
+        root = Node("Finance", processed=False)
+        end_user = Node("Account Manager", parent=root, processed=False)
+        job = Node("Onboard clients", parent=end_user, description="", processed=False)
+
+        new_children = downstream_processor.process_step(job, 'Related Jobs', 1, 'high')
+
+        response_format = self.llm.aget_response.call_args.kwargs['response_format']
+        self.assertEqual(response_format['type'], 'json_schema')
+        self.assertEqual(response_format['json_schema']['schema']['required'], ['items'])
+        self.assertEqual([(child.name, child.description) for child in new_children],
+                         [("Open an account", "Start banking.")])
+
+    def test_sibling_batch_adds_every_step_from_one_call(self):
+        """
+        Independent sibling steps share a single JSON-mode LLM call and each step's items are attached.
+        """
+        prompt_builder = MagicMock()
+        prompt_builder.build_multi_step_prompt.return_value = "multi-step prompt"
+        prompt_builder.parse_multi_step.return_value = {
+            'related_jobs': [{'name': 'Compare lenders', 'description': 'Before applying'}],
+            'social_jobs': [{'name': 'Be seen as prudent', 'description': 'By family'}],
+        }
+        self.llm.aget_response = AsyncMock(return_value='{}')
+        downstream_processor = DownstreamProcessor(prompt_builder, self.llm, prompt_parser=prompt_builder)
+
+        root = Node("Finance", processed=False)
+        end_user = Node("Borrower", parent=root, processed=False)
+        job = Node("Apply for a loan", parent=end_user, description="", processed=False)
+        steps = [
+            {'step': 'Related Jobs', 'method': 'process_related_jobs', 'n': 10},
+            {'step': 'Social Jobs', 'method': 'process_social_jobs', 'n': 5},
+        ]
+
+        new_children = asyncio.run(downstream_processor.process_sibling_batch(job, steps))
+
+        self.llm.aget_response.assert_awaited_once()
+        self.assertEqual(self.llm.aget_response.call_args.kwargs['response_format'], {"type": "json_object"})
+        prompt_builder.build_multi_step_prompt.assert_called_once_with(
+            end_user="Finance", job="Apply for a loan", context="",
+            steps=(('related_jobs', 10), ('social_jobs', 5))
+        )
+        self.assertEqual([node.name for node in new_children['Related Jobs']], ['Compare lenders'])
+        self.assertEqual([node.name for node in new_children['Social Jobs']], ['Be seen as prudent'])
+        self.assertEqual(len(job.children), 2)
+        self.assertTrue(job.processed)
+
+    def test_step_batch_runs_one_step_for_many_jobs_per_call(self):
+        """
+        One step for several sibling jobs goes out in batch_size-sized JSON-mode calls, and each
+        job gets its own row of the response.
+        """
+        prompt_builder = MagicMock()
+        prompt_builder.build_multi_job_prompt.return_value = "multi-job prompt"
+        prompt_builder.parse_multi_job.side_effect = lambda response, count: [
+            [{'name': f'Related {i}', 'description': ''}] for i in range(count)
+        ]
+        self.llm.aget_response = AsyncMock(return_value='{}')
+        downstream_processor = DownstreamProcessor(prompt_builder, self.llm, prompt_parser=prompt_builder)
+
+        end_user = Node("Borrower", parent=Node("Finance"), processed=False)
+        jobs = [Node(f"Job {i}", parent=end_user, description="", processed=False) for i in range(3)]
+        jobs[1].processed = True
+
+        new_children = asyncio.run(downstream_processor.process_step_batch(
+            jobs, 'Related Jobs', n=5, batch_size=1
+        ))
+
+        self.assertEqual(self.llm.aget_response.await_count, 2)
+        self.assertEqual([[child.name for child in children] for children in new_children],
+                         [['Related 0'], [], ['Related 0']])
+        self.assertEqual(prompt_builder.build_multi_job_prompt.call_args_list[0].args,
+                         ('related_jobs', [{'end_user': 'Finance', 'job': 'Job 0', 'context': ''}], 5))
+        self.assertTrue(jobs[2].processed)
+
+    def test_step_batch_rejects_steps_with_extra_inputs(self):
+        """
+        Steps whose prompts need more than the job row (e.g. fidelity) are reported, not batched.
+        """
+        error_sink = MagicMock()
+        downstream_processor = DownstreamProcessor(MagicMock(), self.llm, error_sink=error_sink)
+        job = Node("Job", parent=Node("Borrower", parent=Node("Finance")), description="", processed=False)
+
+        new_children = asyncio.run(downstream_processor.process_step_batch([job], 'Job Map', n=0))
+
+        self.assertEqual(new_children, [[]])
+        error_sink.assert_called_once()
+        self.assertNotIn('Job Map', downstream_processor.batchable_steps)
+        self.assertIn('Related Jobs', downstream_processor.batchable_steps)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,13 @@
 # tests/test_hierarchy_builder.py
 
+import asyncio
 import unittest
 import json
 import os
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from anytree import Node, PreOrderIter
 from hierarchy_builder import HierarchyBuilder
-from utils import save_hierarchy_to_file, save_hierarchy_to_markdown
+from utils import JobNode, save_hierarchy_to_file, save_hierarchy_to_markdown
 
 
 # Sample responses for testing
@@ -89,6 +90,13 @@ class TestHierarchyBuilder(unittest.TestCase):
         ]
         self.assertEqual(parsed, expected)
 
+    def test_parse_list_scans_each_line_separately(self):
+        response = "Here are the sectors:\n1. **Banking**\n2. **Investment**: Asset management.\r\n\nThanks"
+
+        # An item without a description does not borrow the next line's text
+        self.assertEqual(self.hierarchy_builder.parse_list(response),
+                         [{"name": "Investment", "description": "Asset management."}])
+
     def test_parse_roles(self):
         # Test parsing end users (providers)
         parsed = self.hierarchy_builder.parse_roles(END_USERS_PROVIDER_RESPONSE)
@@ -107,6 +115,73 @@ class TestHierarchyBuilder(unittest.TestCase):
         ]
         self.assertEqual(parsed, expected)
 
+    @patch("hierarchy_builder.save_hierarchy_to_file")
+    @patch("hierarchy_builder.save_hierarchy_to_markdown")
+    def test_save_current_hierarchy_coalesces_frequent_saves(self, mock_save_markdown, mock_save_file):
+        self.hierarchy_builder.root = Node("Finance", description="Root node for industry hierarchy", processed=False)
+        self.hierarchy_builder.industry = "Finance"
+
+        with patch("hierarchy_builder.time.monotonic", side_effect=[100.0, 101.0, 102.0, 200.0]), \
+                patch("hierarchy_builder.os.path.exists", return_value=True):
+            self.hierarchy_builder._save_current_hierarchy()
+            self.hierarchy_builder._save_current_hierarchy()
+            self.assertTrue(self.hierarchy_builder._dirty)
+            self.hierarchy_builder._save_current_hierarchy(force=True)
+            self.hierarchy_builder._save_current_hierarchy()
+
+        self.assertEqual(mock_save_file.call_count, 3)
+        self.assertFalse(self.hierarchy_builder._dirty)
+        # Markdown is only rendered for the forced save
+        self.assertEqual(mock_save_markdown.call_count, 1)
+
+    @patch("hierarchy_builder.save_hierarchy_to_file")
+    @patch("hierarchy_builder.save_hierarchy_to_markdown")
+    def test_save_current_hierarchy_writes_only_changed_mongo_nodes(self, mock_save_markdown, mock_save_file):
+        root = Node("Finance", description="Root node for industry hierarchy", processed=False)
+        banking = Node("Banking", parent=root, description="Deposits", processed=False)
+        self.hierarchy_builder.root = root
+        self.hierarchy_builder.mongo_manager = MagicMock()
+        bulk_write = self.hierarchy_builder.mongo_manager.bulk_write
+
+        with patch("hierarchy_builder.time.monotonic", side_effect=[100.0, 101.0, 200.0]):
+            self.hierarchy_builder._save_current_hierarchy()
+            # Coalesced saves skip Mongo as well as the file
+            self.hierarchy_builder._save_current_hierarchy()
+            Node("Retail Banking", parent=banking, description="Consumers", processed=False)
+            banking.processed = True
+            self.hierarchy_builder._save_current_hierarchy(force=True)
+
+        self.assertEqual(bulk_write.call_count, 2)
+        first, second = (call.args[0] for call in bulk_write.call_args_list)
+        self.assertEqual([op._filter["node_id"] for op in first], ["0", "0.0"])
+        self.assertTrue(all(op._upsert for op in first))
+        self.assertEqual(first[1]._doc["$set"], {"parent_id": "0", "name": "Banking",
+                                                 "description": "Deposits", "processed": False})
+        # Only the processed flip and the new node are sent the second time
+        self.assertEqual([(op._filter["node_id"], op._doc["$set"]) for op in second], [
+            ("0.0", {"processed": True}),
+            ("0.0.0", {"parent_id": "0.0", "name": "Retail Banking", "description": "Consumers", "processed": False}),
+        ])
+        self.assertIsNotNone(bulk_write.call_args_list[0].kwargs["write_concern"])
+        self.assertIsNone(bulk_write.call_args_list[1].kwargs["write_concern"])
+
+    def test_load_saved_hierarchy_links_mongo_node_documents(self):
+        self.hierarchy_builder.mongo_manager = MagicMock()
+        self.hierarchy_builder.mongo_manager.find_entries.return_value = [
+            {"node_id": "0.10", "parent_id": "0", "name": "Insurance", "description": "", "processed": False},
+            {"node_id": "0", "parent_id": None, "name": "Finance", "description": "Root", "processed": False},
+            {"node_id": "0.2", "parent_id": "0", "name": "Banking", "description": "", "processed": True},
+            {"node_id": "0.2.0", "parent_id": "0.2", "name": "Retail Banking", "description": "", "processed": False},
+        ]
+
+        with patch("hierarchy_builder.os.path.exists", return_value=False):
+            saved = self.hierarchy_builder._load_saved_hierarchy("Finance")
+
+        self.assertEqual(saved["name"], "Finance")
+        self.assertEqual([child["name"] for child in saved["children"]], ["Banking", "Insurance"])
+        self.assertEqual(saved["children"][0]["children"][0]["name"], "Retail Banking")
+        self.assertEqual(self.hierarchy_builder._mongo_written["0.2"], True)
+
     @patch("hierarchy_builder.save_hierarchy_to_file")
     @patch("os.path.exists", return_value=True)  # Mock os.path.exists to always return True
     @patch("hierarchy_builder.save_hierarchy_to_markdown")
@@ -127,9 +202,9 @@ class TestHierarchyBuilder(unittest.TestCase):
         print(f"Save file path: {save_file_path}")
         print("Calling _save_current_hierarchy...")
 
-        # Call the method
+        # Call the method; only a forced (final) save also writes the markdown output
         try:
-            self.hierarchy_builder._save_current_hierarchy()
+            self.hierarchy_builder._save_current_hierarchy(force=True)
         except Exception as e:
             print(f"Exception occurred: {e}")
 
@@ -144,7 +219,7 @@ class TestHierarchyBuilder(unittest.TestCase):
 
         # Verify if save_hierarchy_to_file was called correctly
         mock_save_file.assert_called_once_with(self.hierarchy_builder.root, save_file_path)
-        mock_save_markdown.assert_called_once_with(save_file_path, f"{self.industry}_hierarchy_output.md")
+        mock_save_markdown.assert_called_once_with(self.hierarchy_builder.root, f"{self.industry}_hierarchy_output.md")
 
 
 
@@ -188,6 +263,26 @@ class TestHierarchyBuilder(unittest.TestCase):
             self.assertEqual(retail_node.name, "Retail Banking")
             self.assertEqual(retail_node.description, "Provides services to individual consumers.")
 
+    def test_track_new_nodes_keeps_job_index_current(self):
+        root = Node("Finance", processed=False)
+        job_a = Node("Open an account", parent=root, processed=False)
+        job_b = Node("Apply for a loan", parent=root, processed=False)
+        self.hierarchy_builder.index_tree(root)
+        self.assertEqual(self.hierarchy_builder.job_nodes, [job_a, job_b])
+        self.assertEqual(len(self.hierarchy_builder.unprocessed_nodes), 3)
+
+        # Processing job_a attaches children and marks it processed, as the downstream processor does
+        contexts = [Node(f"Context {i}", parent=job_a, processed=False) for i in range(2)]
+        job_a.processed = True
+        self.hierarchy_builder.track_new_nodes(contexts)
+
+        self.assertEqual(self.hierarchy_builder.job_nodes, [job_b] + contexts)
+        self.assertNotIn(id(job_a), self.hierarchy_builder.unprocessed_nodes)
+
+        self.hierarchy_builder.mark_processed(contexts[0])
+        self.assertTrue(contexts[0].processed)
+        self.assertEqual(set(self.hierarchy_builder.unprocessed_nodes.values()), {root, job_b, contexts[1]})
+
     def test_build_hierarchy_from_scratch(self):
         # Mock LLM responses and prompts to simulate hierarchy building from scratch
         self.mock_prompt_builder.build_sectors_prompt.return_value = "Build sectors prompt"
@@ -208,7 +303,7 @@ class TestHierarchyBuilder(unittest.TestCase):
         }.get(prompt_name, "Invalid prompt")
 
         # Mock LLM responses to correspond to each of the prompts
-        self.mock_llm.get_response.side_effect = lambda prompt: {
+        self.mock_llm.aget_response = AsyncMock(side_effect=lambda prompt: {
             f"Prompt for sectors in industry Finance with fidelity comprehensive": SECTORS_RESPONSE,
             f"Prompt for subsectors in industry Finance, sector Banking with fidelity comprehensive": SUBSECTORS_RESPONSE_BANKING,
             f"Prompt for subsectors in industry Finance, sector Investment with fidelity comprehensive": SUBSECTORS_RESPONSE_INVESTMENT,
@@ -216,7 +311,7 @@ class TestHierarchyBuilder(unittest.TestCase):
             f"Prompt for customers in industry Finance, sector Banking, subsector Retail Banking with fidelity comprehensive": END_USERS_CUSTOMER_RESPONSE,
             f"Prompt for jobs-to-be-done in provider Service Providers in industry Finance, sector Banking, subsector Retail Banking": JOBS_RESPONSE,
             f"Prompt for jobs-to-be-done in customer Individual Consumers in industry Finance, sector Banking, subsector Retail Banking": JOBS_CUSTOMER_RESPONSE
-        }.get(prompt, "")
+        }.get(prompt, ""))
         # self.mock_llm.get_response.side_effect = lambda prompt: {
         #     "Build sectors prompt": SECTORS_RESPONSE,
         #     "Build subsectors prompt for Banking": SUBSECTORS_RESPONSE_BANKING,
@@ -262,6 +357,124 @@ class TestHierarchyBuilder(unittest.TestCase):
         else:
             print("Error: Sectors list is empty. Check LLM responses and parsing.")
 
+    @patch('hierarchy_builder.save_hierarchy_to_markdown')
+    @patch('hierarchy_builder.save_hierarchy_to_file')
+    def test_build_hierarchy_sends_each_level_concurrently(self, mock_save_file, mock_save_markdown):
+        self.mock_prompt_builder.get_prompt.side_effect = lambda prompt_name, **kwargs: prompt_name
+        responses = {
+            'sectors': SECTORS_RESPONSE,
+            'subsectors': SUBSECTORS_RESPONSE_BANKING,
+            'end_users_provider': END_USERS_PROVIDER_RESPONSE,
+            'end_users_customer': END_USERS_CUSTOMER_RESPONSE,
+            'jtbd_industry': JOBS_RESPONSE,
+            'jtbd_customers': JOBS_CUSTOMER_RESPONSE,
+        }
+        in_flight = []
+        peak = {}
+
+        async def fake_aget_response(prompt):
+            in_flight.append(prompt)
+            peak[prompt] = max(peak.get(prompt, 0), in_flight.count(prompt))
+            await asyncio.sleep(0.01)
+            in_flight.remove(prompt)
+            return responses[prompt]
+
+        self.mock_llm.aget_response = fake_aget_response
+        with patch.object(self.hierarchy_builder, '_load_saved_hierarchy', return_value=None):
+            root = self.hierarchy_builder.build_hierarchy("Finance", n_end_users=2, n_jobs=2)
+
+        # Both sectors' subsectors, and all eight end users' jobs, were requested together
+        self.assertEqual(peak['subsectors'], 2)
+        self.assertEqual(peak['jtbd_industry'] + peak['jtbd_customers'], 16)
+        provider = root.children[0].children[0].children[0].children[0]
+        self.assertEqual(provider.name, "Service Providers")
+        self.assertEqual([job.name for job in provider.children], ["Account Manager", "Financial Analyst"])
+        self.assertEqual(len(self.hierarchy_builder.job_nodes), 32)
+        # New builds use the slotted node class throughout
+        self.assertTrue(all(isinstance(node, JobNode) for node in PreOrderIter(root)))
+
+    @patch('hierarchy_builder.save_hierarchy_to_markdown')
+    @patch('hierarchy_builder.save_hierarchy_to_file')
+    def test_build_hierarchy_does_not_wait_for_slow_sibling_branches(self, mock_save_file, mock_save_markdown):
+        self.mock_prompt_builder.get_prompt.side_effect = (
+            lambda prompt_name, **kwargs: f"{prompt_name}:{kwargs.get('sector', '')}")
+        responses = {
+            'sectors': SECTORS_RESPONSE,
+            'subsectors': SUBSECTORS_RESPONSE_BANKING,
+            'end_users_provider': END_USERS_PROVIDER_RESPONSE,
+            'end_users_customer': END_USERS_CUSTOMER_RESPONSE,
+            'jtbd_industry': JOBS_RESPONSE,
+            'jtbd_customers': JOBS_CUSTOMER_RESPONSE,
+        }
+        requested = []
+
+        async def fake_aget_response(prompt):
+            requested.append(prompt)
+            # Investment's subsectors are slow; Banking's branch carries on meanwhile
+            await asyncio.sleep(0.05 if prompt == "subsectors:Investment" else 0.001)
+            return responses[prompt.split(":")[0]]
+
+        self.mock_llm.aget_response = fake_aget_response
+        with patch.object(self.hierarchy_builder, '_load_saved_hierarchy', return_value=None):
+            root = self.hierarchy_builder.build_hierarchy("Finance", n_end_users=2, n_jobs=2)
+
+        self.assertLess(requested.index("jtbd_industry:Banking"), requested.index("end_users_provider:Investment"))
+        # Jobs are still indexed in tree order
+        self.assertEqual(self.hierarchy_builder.job_nodes, [node for node in PreOrderIter(root) if node.is_leaf])
+
+    @patch('hierarchy_builder.save_hierarchy_to_markdown')
+    @patch('hierarchy_builder.save_hierarchy_to_file')
+    def test_failed_build_saves_coalesced_progress(self, mock_save_file, mock_save_markdown):
+        self.mock_prompt_builder.get_prompt.side_effect = lambda prompt_name, **kwargs: prompt_name
+        responses = {'sectors': SECTORS_RESPONSE, 'subsectors': SUBSECTORS_RESPONSE_BANKING}
+
+        async def fake_aget_response(prompt):
+            if prompt not in responses:
+                raise RuntimeError("connection lost")
+            return responses[prompt]
+
+        self.mock_llm.aget_response = fake_aget_response
+        with patch.object(self.hierarchy_builder, '_load_saved_hierarchy', return_value=None):
+            with self.assertRaises(RuntimeError):
+                self.hierarchy_builder.build_hierarchy("Finance", n_end_users=2, n_jobs=2)
+
+        # The subsectors were only marked dirty by the coalescing, but are written before the error propagates
+        self.assertEqual(mock_save_file.call_count, 2)
+        self.assertFalse(self.hierarchy_builder._dirty)
+        self.assertEqual(len(mock_save_file.call_args.args[0].descendants), 2 + 4)
+
+    @patch('hierarchy_builder.save_hierarchy_to_markdown')
+    @patch('hierarchy_builder.save_hierarchy_to_file')
+    def test_build_hierarchy_in_batch_mode_submits_one_batch_per_level(self, mock_save_file, mock_save_markdown):
+        # Every prompt is distinct, so none are merged as duplicates within a batch
+        self.mock_prompt_builder.get_prompt.side_effect = (
+            lambda prompt_name, **kwargs: f"{prompt_name}:{sorted(kwargs.items())}")
+        responses = {
+            'sectors': SECTORS_RESPONSE,
+            'subsectors': SUBSECTORS_RESPONSE_BANKING,
+            'end_users_provider': END_USERS_PROVIDER_RESPONSE,
+            'end_users_customer': END_USERS_CUSTOMER_RESPONSE,
+            'jtbd_industry': JOBS_RESPONSE,
+            'jtbd_customers': JOBS_CUSTOMER_RESPONSE,
+        }
+        self.mock_llm._build_request.side_effect = lambda prompt, *args: {"prompt": prompt}
+        self.mock_llm._cache_get.return_value = None
+        batch_sizes = []
+
+        async def fake_arun_batch(requests, progress_callback=None, poll_interval=None):
+            batch_sizes.append(len(requests))
+            return {custom_id: responses[body["prompt"].split(":")[0]] for custom_id, body in requests}
+
+        self.mock_llm.arun_batch = AsyncMock(side_effect=fake_arun_batch)
+        with patch.object(self.hierarchy_builder, '_load_saved_hierarchy', return_value=None):
+            self.hierarchy_builder.build_hierarchy("Finance", n_end_users=2, n_jobs=2, batch=True)
+
+        self.assertEqual(batch_sizes, [1, 2, 8, 16])
+        self.mock_llm.aget_response.assert_not_called()
+        self.assertEqual(len(self.hierarchy_builder.job_nodes), 32)
+        # Every node of the new tree is indexed as unprocessed without rescanning it
+        self.assertEqual(len(self.hierarchy_builder.unprocessed_nodes), 1 + 2 + 4 + 8 + 16 + 32)
+
     def mock_build_subsectors_prompt(self, industry, sector_info, fidelity):
         if "Banking" in sector_info:
             return "Build subsectors prompt for Banking"
@@ -0,0 +1,58 @@
+# tests/test_hierarchy_store.py
+
+import os
+import tempfile
+import unittest
+
+from anytree import Node, PreOrderIter
+
+from hierarchy_store import HierarchyStore
+
+
+class TestHierarchyStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "hierarchy.sqlite3")
+        self.store = HierarchyStore(path=self.path)
+
+        self.root = Node("Finance", description="Root", processed=False)
+        banking = Node("Banking", parent=self.root, description="Banks", processed=False)
+        self.job = Node("Open an account", parent=banking, description="", processed=False)
+
+    def tearDown(self):
+        if self.store._conn is not None:
+            self.store._conn.close()
+        self.tmpdir.cleanup()
+
+    def reload(self):
+        store = HierarchyStore(path=self.path)
+        root = store.load()
+        store._conn.close()
+        return root
+
+    def test_save_and_load_round_trip(self):
+        self.assertIsNone(self.store.load())
+        self.store.save_tree(self.root)
+
+        loaded = self.reload()
+        self.assertEqual([(node.name, node.description, node.processed) for node in PreOrderIter(loaded)],
+                         [(node.name, node.description, node.processed) for node in PreOrderIter(self.root)])
+
+    def test_new_nodes_and_processed_flags_are_persisted_incrementally(self):
+        self.store.save_tree(self.root)
+
+        context = Node("Online", parent=self.job, description="Via the app", processed=False)
+        Node("Verify identity", parent=context, description="", processed=False)
+        self.job.processed = True
+        self.store.add_nodes([context])
+        self.store.mark_processed(self.job)
+
+        loaded = self.reload()
+        loaded_job = loaded.children[0].children[0]
+        self.assertTrue(loaded_job.processed)
+        self.assertEqual(loaded_job.children[0].name, "Online")
+        self.assertEqual(loaded_job.children[0].children[0].name, "Verify identity")
+
+
+if __name__ == '__main__':
+    unittest.main()
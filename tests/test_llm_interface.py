@@ -0,0 +1,229 @@
+# tests/test_llm_interface.py
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from llm_interface import BatchCollector, LLMInterface, closing_async_client, gather_requests
+
+
+class TestLLMInterface(unittest.TestCase):
+    def setUp(self):
+        # Stand-in OpenAI clients, so the suite needs neither an API key nor the network
+        clients = patch.multiple('llm_interface', _shared_client=None, OpenAI=MagicMock(),
+                                 AsyncOpenAI=MagicMock(side_effect=lambda **kwargs: MagicMock(close=AsyncMock())))
+        clients.start()
+        self.addCleanup(clients.stop)
+        self.llm = LLMInterface()
+        self.llm.cache = None
+
+    @patch('llm_interface.RATE_LIMIT_RPM', 0)
+    @patch('llm_interface.MAX_CONCURRENCY', 2)
+    def test_aget_response_respects_max_concurrency(self):
+        in_flight = 0
+        peak = 0
+
+        async def fake_create(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            message = SimpleNamespace(content=" ok ")
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        async def run():
+            client = self.llm._get_async_client()
+            client.chat.completions.create = fake_create
+            return await asyncio.gather(*(self.llm.aget_response(f"prompt {i}") for i in range(6)))
+
+        responses = asyncio.run(run())
+
+        self.assertEqual(responses, ["ok"] * 6)
+        self.assertEqual(peak, 2)
+
+        # An explicit limit (console_app --workers) takes over on the next event loop
+        self.llm.max_concurrency = 3
+        peak = 0
+        asyncio.run(run())
+        self.assertEqual(peak, 3)
+
+    @patch('llm_interface.RATE_LIMIT_RPM', 0)
+    def test_concurrent_identical_requests_share_one_call(self):
+        calls = []
+
+        async def fake_create(**kwargs):
+            calls.append(kwargs["messages"][-1]["content"])
+            await asyncio.sleep(0.01)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="1. Job"))])
+
+        async def run():
+            client = self.llm._get_async_client()
+            client.chat.completions.create = fake_create
+            return await asyncio.gather(self.llm.aget_response("List jobs"), self.llm.aget_response("List jobs"),
+                                        self.llm.aget_response("List steps"))
+
+        self.assertEqual(asyncio.run(run()), ["1. Job"] * 3)
+        self.assertEqual(sorted(calls), ["List jobs", "List steps"])
+        self.assertEqual(self.llm._inflight, {})
+
+    @patch('llm_interface._shared_client', None)
+    @patch('llm_interface.MAX_RETRIES', 4)
+    @patch('llm_interface.USE_HTTP2', True)
+    @patch('llm_interface.DefaultHttpxClient')
+    @patch('llm_interface.OpenAI')
+    def test_client_uses_one_pooled_http_client(self, mock_openai, mock_http_client):
+        first = LLMInterface(use_cache=False)
+        second = LLMInterface(use_cache=False)
+
+        mock_http_client.assert_called_once_with(http2=True)
+        self.assertIs(mock_openai.call_args.kwargs["http_client"], mock_http_client.return_value)
+        # Rate-limited and transient failures are retried with backoff by the client itself
+        self.assertEqual(mock_openai.call_args.kwargs["max_retries"], 4)
+        # Later interfaces (e.g. after a Streamlit rerun) reuse the same pooled client
+        self.assertIs(first.client, second.client)
+
+    @patch('llm_interface.AsyncOpenAI')
+    def test_async_client_is_shared_per_loop_and_closed_by_closing_async_client(self, mock_async_openai):
+        mock_async_openai.side_effect = lambda **kwargs: MagicMock(close=AsyncMock())
+
+        async def run():
+            other = LLMInterface(use_cache=False)
+            client = self.llm._get_async_client()
+            self.assertIs(other._get_async_client(), client)
+            client.close.assert_not_awaited()
+            return client
+
+        first = asyncio.run(closing_async_client(run()))
+        second = asyncio.run(closing_async_client(run()))
+
+        # Each asyncio.run gets one client, closed before its loop shuts down
+        self.assertIsNot(first, second)
+        self.assertEqual(mock_async_openai.call_count, 2)
+        first.close.assert_awaited_once()
+        second.close.assert_awaited_once()
+
+    def test_message_list_is_sent_as_is_and_cached_tokens_are_tracked(self):
+        messages = [{"role": "system", "content": "Static instructions"}, {"role": "user", "content": "Job: Borrow"}]
+        usage = SimpleNamespace(prompt_tokens=1200, prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+        self.llm.client = MagicMock()
+        self.llm.client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="1. Job"))], usage=usage)
+
+        self.assertEqual(self.llm.get_response(messages), "1. Job")
+
+        self.assertEqual(self.llm.client.chat.completions.create.call_args.kwargs["messages"], messages)
+        self.assertEqual(self.llm.usage, {"prompt_tokens": 1200, "cached_tokens": 1024})
+
+    def test_stream_response_yields_chunks(self):
+        def chunk(text):
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+        self.llm.client = MagicMock()
+        self.llm.client.chat.completions.create.return_value = iter([chunk("1. Open"), chunk(None), chunk(" an account")])
+
+        self.assertEqual(list(self.llm.stream_response("List jobs")), ["1. Open", " an account"])
+        self.assertTrue(self.llm.client.chat.completions.create.call_args.kwargs["stream"])
+
+
+class TestBatchCollector(unittest.TestCase):
+    def make_llm(self):
+        llm = MagicMock()
+        llm._build_request.side_effect = lambda prompt, *args: {"prompt": prompt}
+        llm._cache_get.return_value = None
+        self.submitted = []
+
+        async def fake_arun_batch(requests, progress_callback=None, poll_interval=None):
+            self.submitted.append([body["prompt"] for _, body in requests])
+            return {custom_id: f"answer to {body['prompt']}" for custom_id, body in requests}
+
+        llm.arun_batch = AsyncMock(side_effect=fake_arun_batch)
+        return llm
+
+    def test_dependent_steps_are_submitted_in_separate_batches(self):
+        collector = BatchCollector(self.make_llm())
+
+        async def step(name, child=None):
+            response = await collector.aget_response(name)
+            if child:
+                await collector.aget_response(child)
+            return response
+
+        async def run():
+            return await gather_requests(step("a", child="a.1"), step("b", child="b.1"), step("c"))
+
+        responses = asyncio.run(collector.run(run()))
+
+        self.assertEqual(responses, ["answer to a", "answer to b", "answer to c"])
+        self.assertEqual(self.submitted, [["a", "b", "c"], ["a.1", "b.1"]])
+
+    def test_batch_waits_for_callers_that_are_still_awaiting_something_else(self):
+        collector = BatchCollector(self.make_llm())
+
+        async def slow_step(name):
+            # Stands in for e.g. a rate limiter wait before the prompt is queued
+            await asyncio.sleep(0.01)
+            return await collector.aget_response(name)
+
+        async def nested_step(name, child):
+            await collector.aget_response(name)
+            # Children fanned out after a response join the next batch with everyone else
+            return await gather_requests(slow_step(child), collector.aget_response(child + "'"))
+
+        async def run():
+            return await gather_requests(collector.aget_response("a"), slow_step("b"), nested_step("c", "c.1"))
+
+        asyncio.run(collector.run(run()))
+
+        self.assertEqual(self.submitted, [["a", "c", "b"], ["c.1'", "c.1"]])
+
+    def test_callers_are_resumed_when_the_batch_fails(self):
+        llm = self.make_llm()
+        llm.arun_batch.side_effect = ValueError("upload failed")
+        collector = BatchCollector(llm)
+
+        async def run():
+            return await gather_requests(collector.aget_response("a"), collector.aget_response("b"))
+
+        with self.assertLogs(level="ERROR"):
+            with self.assertRaisesRegex(ValueError, "upload failed"):
+                asyncio.run(collector.run(run()))
+
+    def test_requests_missing_from_the_batch_are_sent_directly(self):
+        llm = self.make_llm()
+        # The batch only produced a result for the first request
+        llm.arun_batch = AsyncMock(return_value={"request-1": "batched a"})
+        llm.aget_response = AsyncMock(return_value="live b")
+        collector = BatchCollector(llm)
+
+        async def run():
+            return await gather_requests(collector.aget_response("a"), collector.aget_response("b"))
+
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(asyncio.run(collector.run(run())), ["batched a", "live b"])
+        llm.aget_response.assert_awaited_once_with("b", None, None, None)
+
+    def test_cached_prompts_are_not_batched_and_results_are_cached(self):
+        llm = self.make_llm()
+        llm._cache_get.side_effect = lambda request, prompt: "cached a" if prompt == "a" else None
+        collector = BatchCollector(llm)
+
+        async def run():
+            return await gather_requests(collector.aget_response("a"), collector.aget_response("b"),
+                                         collector.aget_response("b"))
+
+        self.assertEqual(asyncio.run(collector.run(run())), ["cached a", "answer to b", "answer to b"])
+        # The duplicate "b" is sent once, and its result is stored for interactive use
+        self.assertEqual(self.submitted, [["b"]])
+        llm._cache_set.assert_called_once_with({"prompt": "b"}, "b", "answer to b")
+
+    def test_requests_outside_run_are_rejected(self):
+        collector = BatchCollector(self.make_llm())
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(collector.aget_response("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
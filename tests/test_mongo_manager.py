@@ -0,0 +1,37 @@
+# tests/test_mongo_manager.py
+
+import unittest
+from unittest.mock import patch
+
+from mongo_manager import MongoDBManager
+
+
+class TestMongoDBManager(unittest.TestCase):
+    @patch('mongo_manager._clients', {})
+    @patch('mongo_manager.MONGO_MAX_POOL_SIZE', 20)
+    @patch('mongo_manager.MongoClient')
+    def test_managers_share_one_pooled_client_per_uri(self, mock_client):
+        first = MongoDBManager("mongodb://localhost:27017", "jtbd")
+        second = MongoDBManager("mongodb://localhost:27017", "jtbd_archive")
+
+        mock_client.assert_called_once_with("mongodb://localhost:27017", maxPoolSize=20)
+        self.assertIs(first.client, second.client)
+
+        MongoDBManager("mongodb://replica:27017", "jtbd")
+        self.assertEqual(mock_client.call_count, 2)
+
+    @patch('mongo_manager._clients', {})
+    @patch('mongo_manager.MongoClient')
+    def test_create_index_requires_a_collection(self, mock_client):
+        manager = MongoDBManager("mongodb://localhost:27017", "jtbd")
+        with self.assertRaises(ValueError):
+            manager.create_index([("industry", 1)])
+
+        manager.set_collection("hierarchy_nodes")
+        manager.create_index([("industry", 1), ("node_id", 1)], unique=True)
+        manager.db["hierarchy_nodes"].create_index.assert_called_once_with(
+            [("industry", 1), ("node_id", 1)], unique=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
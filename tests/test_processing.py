@@ -1,7 +1,8 @@
 # tests/test_processing.py
 
+import asyncio
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 from anytree import Node, PreOrderIter
 
 from utils import node_to_dict, dict_to_tree
@@ -23,6 +24,7 @@ class TestProcessing(unittest.TestCase):
         # Initialize LLMInterface with mocked responses
         self.llm = LLMInterface()
         self.llm.get_response = MagicMock(side_effect=self.mock_llm_responses)
+        self.llm.aget_response = AsyncMock(side_effect=self.mock_llm_responses)
 
         # Initialize HierarchyBuilder
         self.hierarchy_builder = HierarchyBuilder(self.llm, self.prompt_builder)
@@ -253,7 +255,7 @@ class TestProcessing(unittest.TestCase):
         for job_node in selected_job_nodes:
             for step in steps:
                 processing_method = getattr(self.downstream_processor, step['method'])
-                processing_method(job_node, **step['args'])
+                asyncio.run(processing_method(job_node, **step['args']))
 
         # Verify that the jobs are marked as processed
         for job_node in selected_job_nodes:
@@ -1,5 +1,6 @@
 import unittest
 import os
+from unittest.mock import MagicMock
 from prompt_builder import PromptBuilder, PromptParser  # Import both PromptBuilder and PromptParser
 
 
@@ -78,6 +79,84 @@ class TestPromptBuilder(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.prompt_builder.get_prompt('job_contexts', end_user='DevOps Engineer')
 
+    def test_get_prompt_is_memoized(self):
+        """
+        Test that identical prompt requests are served from the cache and reloading prompts clears it.
+        """
+        kwargs = dict(end_user='DevOps Engineer', job='Building Systems', context='', n=10)
+        first = self.prompt_builder.get_prompt('job_contexts', **kwargs)
+        second = self.prompt_builder.get_prompt('job_contexts', **dict(reversed(list(kwargs.items()))))
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.prompt_builder._format_cached.cache_info().hits, 1)
+
+        self.prompt_builder.load_prompts(prompts_dir='prompts')
+        self.assertEqual(self.prompt_builder._format_cached.cache_info().currsize, 0)
+
+    def test_get_prompt_formats_unhashable_arguments_once(self):
+        """
+        Test that unhashable arguments bypass the cache, and that formatting errors are not retried.
+        """
+        prompt = self.prompt_builder.get_prompt('job_contexts', end_user='DevOps Engineer',
+                                                job='Building Systems', context=['On call'], n=10)
+        self.assertIn('DevOps Engineer', prompt)
+        self.assertEqual(self.prompt_builder._format_cached.cache_info().currsize, 0)
+
+        self.prompt_builder._format_cached = MagicMock(side_effect=TypeError("bad template"))
+        self.prompt_builder._format_prompt = MagicMock()
+        with self.assertRaises(TypeError):
+            self.prompt_builder.get_prompt('job_contexts', end_user='DevOps Engineer', job='Building Systems')
+        self.prompt_builder._format_prompt.assert_not_called()
+
+    def test_build_multi_step_prompt_lists_each_step(self):
+        """
+        Test that the multi-step prompt names each step's JSON key and item count.
+        """
+        prompt = self.prompt_builder.build_multi_step_prompt(
+            end_user='Borrower', job='Applying for a loan', context='',
+            steps=(('related_jobs', 10), ('social_jobs', 5))
+        )
+        self.assertIn('"related_jobs" (10 items)', prompt)
+        self.assertIn('"social_jobs" (5 items)', prompt)
+        self.assertIn('Applying for a loan', prompt)
+
+    def test_parse_multi_step(self):
+        """
+        Test parsing a multi-step JSON response into one list per expected key.
+        """
+        response = '{"related_jobs": [{"name": " Compare lenders ", "description": "Before applying"}, {"description": "no name"}]}'
+        parsed = self.prompt_parser.parse_multi_step(response, ['related_jobs', 'social_jobs'])
+        self.assertEqual(parsed, {
+            'related_jobs': [{'name': 'Compare lenders', 'description': 'Before applying'}],
+            'social_jobs': [],
+        })
+
+    def test_build_multi_job_prompt_numbers_each_job(self):
+        """
+        Test that the multi-job prompt lists each job under its number with the step's description.
+        """
+        prompt = self.prompt_builder.build_multi_job_prompt(
+            'related_jobs',
+            rows=[{'end_user': 'Borrower', 'job': 'Applying for a loan', 'context': ''},
+                  {'end_user': 'Lender', 'job': 'Assessing credit risk', 'context': 'for small businesses'}],
+            n=5
+        )
+        self.assertIn('1. End user: Borrower; Job: Applying for a loan', prompt)
+        self.assertIn('2. End user: Lender; Job: Assessing credit risk; Context: for small businesses', prompt)
+        self.assertIn('generate 5 items', prompt)
+
+    def test_parse_multi_job(self):
+        """
+        Test parsing a multi-job JSON response into one list per job, in job order.
+        """
+        response = '{"2": [{"name": "Review statements", "description": ""}], "1": [{"name": "Compare lenders"}]}'
+        parsed = self.prompt_parser.parse_multi_job(response, 3)
+        self.assertEqual(parsed, [
+            [{'name': 'Compare lenders', 'description': ''}],
+            [{'name': 'Review statements', 'description': ''}],
+            [],
+        ])
+
     def test_parse_job_contexts(self):
         """
         Test parsing for job contexts using the PromptParser class.
@@ -148,6 +227,16 @@ class TestPromptBuilder(unittest.TestCase):
         self.assertEqual(result, expected)
 
 
+    def test_parse_list_response_matches_line_parser(self):
+        """
+        Test that scanning the whole response gives the same items as parsing it line by line.
+        """
+        response = "Here you go:\n1. **Role A**\n  Description on its own line.\n2. Role B – Description B.\r\n\n3. **Role C**: Description C."
+
+        expected = [item for item in map(self.prompt_parser.parse_list_line, response.split('\n')) if item]
+        self.assertEqual(self.prompt_parser._parse_list_response(response), expected)
+        self.assertEqual([item["name"] for item in expected], ["Role B", "Role C"])
+
     def test_parsing_methods(self):
         """
         Test the specific parsing methods for various prompt types using the PromptParser.
@@ -180,6 +269,92 @@ class TestPromptBuilder(unittest.TestCase):
                 {"name": "Enhancing System Scalability", "description": "Increasing the system's capacity to handle growth."}
             ])
 
+    def test_parse_desired_outcomes_with_themes(self):
+        """
+        Test that the fused desired outcomes response is parsed into outcome and theme groups.
+        """
+        response = """```json
+        {"outcomes": [{"name": "Minimize the time it takes to verify account details", "description": "Avoids rework."},
+                      {"name": "Minimize the likelihood of missed deadlines"}],
+         "themes": [{"name": "**Confirm** account readiness", "description": "Groups verification statements."},
+                    {"description": "missing name"}]}
+        ```"""
+
+        result = self.prompt_parser.parse_desired_outcomes_with_themes(response)
+
+        self.assertEqual(result, {
+            "outcomes": [
+                {"name": "Minimize the time it takes to verify account details", "description": "Avoids rework."},
+                {"name": "Minimize the likelihood of missed deadlines", "description": ""},
+            ],
+            "themes": [
+                {"name": "**Confirm** account readiness", "description": "Groups verification statements."},
+            ],
+        })
+        self.assertEqual(self.prompt_parser.parse_desired_outcomes_with_themes("not json"),
+                         {"outcomes": [], "themes": []})
+
+    def test_parse_structured_items(self):
+        """
+        Test that structured-output items are validated, and that off-schema responses are parsed leniently.
+        """
+        response = '{"items": [{"name": " Open an account ", "description": "Start banking."}, {"name": "Close an account"}]}'
+        self.assertEqual(self.prompt_parser.parse_structured_items(response), [
+            {"name": "Open an account", "description": "Start banking."},
+            {"name": "Close an account", "description": ""},
+        ])
+
+        off_schema = '```json\n{"items": [{"name": "Open an account"}, {"description": "missing name"}]}\n```'
+        self.assertEqual(self.prompt_parser.parse_structured_items(off_schema),
+                         [{"name": "Open an account", "description": ""}])
+
+    def test_parse_structured_items_skips_non_string_names(self):
+        """
+        Test that items with a non-string name are dropped and non-string descriptions are coerced.
+        """
+        response = ('{"items": [{"name": 42}, {"name": null}, {"name": {"text": "x"}}, '
+                    '{"name": "Open an account", "description": 7}, {"name": "Close an account", "description": null}]}')
+        self.assertEqual(self.prompt_parser.parse_structured_items(response), [
+            {"name": "Open an account", "description": "7"},
+            {"name": "Close an account", "description": ""},
+        ])
+        self.assertEqual(self.prompt_parser.parse_structured_items('{"items": "Open an account"}'), [])
+
+    def test_json_item_scanner_yields_items_as_they_complete(self):
+        """
+        Test that streamed JSON items are returned as soon as each item object is closed.
+        """
+        scanner = self.prompt_parser.json_item_scanner()
+
+        self.assertEqual(scanner.feed('```json\n{"outcomes": [{"name": "Minimize the time'), [])
+        self.assertEqual(scanner.feed(' it takes to verify {details}", "description": "Say \\"hi\\""}, {"na'),
+                         [("outcomes", {"name": "Minimize the time it takes to verify {details}",
+                                        "description": 'Say "hi"'})])
+        self.assertEqual(scanner.feed('me": "Avoid delays"}], "themes": [{"description": "no name"}, '
+                                      '{"name": " Confirm "}]}\n```'),
+                         [("outcomes", {"name": "Avoid delays", "description": ""}),
+                          ("themes", {"name": "Confirm", "description": ""})])
+
+    def test_json_item_scanner_skips_non_string_names(self):
+        """
+        Test that streamed items with a non-string name are dropped and descriptions are coerced.
+        """
+        scanner = self.prompt_parser.json_item_scanner()
+
+        self.assertEqual(scanner.feed('{"outcomes": [{"name": 1, "description": "x"}, '
+                                      '{"name": "Avoid delays", "description": ["y"]}]}'),
+                         [("outcomes", {"name": "Avoid delays", "description": "['y']"})])
+
+    def test_build_desired_outcomes_with_themes_prompt(self):
+        """
+        Test that the fused desired outcomes prompt includes both counts and the JSON shape.
+        """
+        prompt = self.prompt_builder.build_desired_outcomes_with_themes_prompt(
+            end_user='Account Manager', job='Onboard clients', context='', step='Verify details', n=20, n_themed=10
+        )
+        self.assertIn('"outcomes" must contain 20 items and "themes" must contain 10 items.', prompt)
+        self.assertIn('{"outcomes": [', prompt)
+
 
 if __name__ == '__main__':
     unittest.main()
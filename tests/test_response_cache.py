@@ -0,0 +1,192 @@
+# tests/test_response_cache.py
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from llm_interface import LLMInterface
+from response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        # Stand-in OpenAI clients, so the suite needs neither an API key nor the network
+        clients = patch.multiple('llm_interface', _shared_client=None, OpenAI=MagicMock(),
+                                 AsyncOpenAI=MagicMock(side_effect=lambda **kwargs: MagicMock(close=AsyncMock())))
+        clients.start()
+        self.addCleanup(clients.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(path=os.path.join(self.tmpdir.name, "cache.sqlite3"))
+
+    def tearDown(self):
+        if self.cache._conn is not None:
+            self.cache._conn.close()
+        self.tmpdir.cleanup()
+
+    def test_exact_match_round_trip(self):
+        self.assertIsNone(self.cache.get("gpt-4o-mini", 0.6, 500, "List jobs"))
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job")
+
+        self.assertEqual(self.cache.get("gpt-4o-mini", 0.6, 500, "List jobs"), "1. Job")
+        # Any change to the request parameters is a different key
+        self.assertIsNone(self.cache.get("gpt-4o-mini", 0.1, 500, "List jobs"))
+        self.assertEqual(self.cache.stats, {"hits": 1, "misses": 2, "similar_hits": 0})
+
+    def test_expired_entries_are_ignored(self):
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job")
+        with patch('response_cache.time.time', return_value=10**12):
+            self.assertIsNone(self.cache.get("gpt-4o-mini", 0.6, 500, "List jobs"))
+
+    def test_get_similar_uses_cosine_threshold(self):
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job", embedding=[1.0, 0.0])
+
+        self.assertEqual(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [0.99, 0.01], 0.97), "1. Job")
+        self.assertIsNone(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [0.0, 1.0], 0.97))
+
+    def test_get_similar_is_scoped_by_request_parameters(self):
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job", embedding=[1.0, 0.0])
+        fmt = {"type": "json_object"}
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs (json)", '{"jobs": []}', embedding=[1.0, 0.0],
+                       response_format=fmt)
+
+        # A free-form reply is never served to a structured request, or across temperatures
+        self.assertEqual(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [1.0, 0.0], 0.97, fmt), '{"jobs": []}')
+        self.assertEqual(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [1.0, 0.0], 0.97), "1. Job")
+        self.assertIsNone(self.cache.get_similar("gpt-4o-mini", 0.1, 500, [1.0, 0.0], 0.97))
+        self.assertIsNone(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [1.0, 0.0], 0.97,
+                                                 {"type": "json_schema"}))
+
+    def test_embeddings_are_stored_as_bytes_and_legacy_json_still_loads(self):
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job", embedding=[1.0, 0.0])
+        self.cache._connect().execute(
+            "INSERT INTO responses (key, model, prompt, response, embedding, created_at, scope) "
+            "VALUES ('legacy', 'gpt-4o-mini', 'List steps', '1. Step', '[0.0, 1.0]', ?, ?)",
+            (self.cache._min_created_at() + 60, ResponseCache.make_scope("gpt-4o-mini", 0.6, 500)))
+
+        stored = self.cache._connect().execute("SELECT embedding FROM responses WHERE key != 'legacy'").fetchone()[0]
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [1.0, 0.01], 0.97), "1. Job")
+        self.assertEqual(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [0.01, 1.0], 0.97), "1. Step")
+
+    def test_tables_without_scope_column_are_migrated(self):
+        path = os.path.join(self.tmpdir.name, "old.sqlite3")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, model TEXT, prompt TEXT, response TEXT, "
+                     "embedding TEXT, created_at REAL)")
+        conn.execute("INSERT INTO responses VALUES ('old', 'gpt-4o-mini', 'List jobs', '1. Job', '[1.0, 0.0]', ?)",
+                     (10**12,))
+        conn.commit()
+        conn.close()
+
+        cache = ResponseCache(path=path)
+        try:
+            # Unscoped legacy rows are never served by similarity, but new rows are
+            self.assertIsNone(cache.get_similar("gpt-4o-mini", 0.6, 500, [1.0, 0.0], 0.97))
+            cache.set("gpt-4o-mini", 0.6, 500, "List steps", "1. Step", embedding=[1.0, 0.0])
+            self.assertEqual(cache.get_similar("gpt-4o-mini", 0.6, 500, [1.0, 0.0], 0.97), "1. Step")
+        finally:
+            cache._conn.close()
+
+    def test_similarity_index_tracks_new_and_expired_entries(self):
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job", embedding=[1.0, 0.0])
+        self.assertIsNone(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [0.0, 1.0], 0.97))
+
+        # Entries stored after the index was loaded are searchable without reloading it
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List steps", "1. Step", embedding=[0.0, 2.0])
+        self.assertEqual(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [0.01, 0.99], 0.97), "1. Step")
+
+        with patch('response_cache.time.time', return_value=10**12):
+            self.assertIsNone(self.cache.get_similar("gpt-4o-mini", 0.6, 500, [0.01, 0.99], 0.97))
+
+    def test_get_response_serves_repeated_prompts_from_cache(self):
+        llm = LLMInterface()
+        llm.cache = self.cache
+        # Only near-deterministic responses are cached (RESPONSE_CACHE_MAX_TEMPERATURE)
+        llm.temperature = 0.1
+        message = SimpleNamespace(content="1. Job")
+        llm.client = MagicMock()
+        llm.client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=message)])
+
+        self.assertEqual(llm.get_response("List jobs"), "1. Job")
+        self.assertEqual(llm.get_response("List jobs"), "1. Job")
+        llm.client.chat.completions.create.assert_called_once()
+
+    def test_delete_and_clear(self):
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List jobs", "1. Job")
+        self.cache.set("gpt-4o-mini", 0.6, 500, "List steps", "1. Step")
+
+        self.cache.delete("gpt-4o-mini", 0.6, 500, "List jobs")
+        self.assertIsNone(self.cache.get("gpt-4o-mini", 0.6, 500, "List jobs"))
+        self.assertEqual(self.cache.get("gpt-4o-mini", 0.6, 500, "List steps"), "1. Step")
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("gpt-4o-mini", 0.6, 500, "List steps"))
+
+    @patch('llm_interface.RESPONSE_CACHE_MAX_TEMPERATURE', 0.3)
+    def test_high_temperature_responses_are_not_cached(self):
+        llm = LLMInterface()
+        llm.cache = self.cache
+        message = SimpleNamespace(content="1. Job")
+        llm.client = MagicMock()
+        llm.client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=message)])
+
+        llm.get_response("List jobs", temperature=0.9)
+        llm.get_response("List jobs", temperature=0.9)
+        self.assertEqual(llm.client.chat.completions.create.call_count, 2)
+
+        llm.get_response("List jobs", temperature=0.1)
+        llm.get_response("List jobs", temperature=0.1)
+        self.assertEqual(llm.client.chat.completions.create.call_count, 3)
+
+    def test_sampled_responses_bypass_the_cache_by_default(self):
+        llm = LLMInterface()
+        llm.cache = self.cache
+        llm.client = MagicMock()
+        llm.client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="1. Job"))])
+
+        llm.get_response("List jobs", temperature=0.6)
+        llm.get_response("List jobs", temperature=0.6)
+        self.assertEqual(llm.client.chat.completions.create.call_count, 2)
+        self.assertIsNone(self.cache.get(llm.model, 0.6, llm.max_tokens, "List jobs"))
+
+        llm.get_response("List jobs", temperature=0.1)
+        llm.get_response("List jobs", temperature=0.1)
+        self.assertEqual(llm.client.chat.completions.create.call_count, 3)
+
+    def test_clear_cache_forgets_one_prompt(self):
+        llm = LLMInterface()
+        llm.cache = self.cache
+        self.cache.set(llm.model, llm.temperature, llm.max_tokens, "List jobs", "1. Job")
+
+        llm.clear_cache("List jobs")
+
+        self.assertIsNone(self.cache.get(llm.model, llm.temperature, llm.max_tokens, "List jobs"))
+
+    def test_response_format_is_part_of_the_cache_key(self):
+        llm = LLMInterface()
+        llm.cache = self.cache
+        llm.temperature = 0.1
+        llm.client = MagicMock()
+        llm.client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="1. Job"))])
+
+        llm.get_response("List jobs")
+        llm.get_response("List jobs", response_format={"type": "json_object"})
+        self.assertEqual(llm.client.chat.completions.create.call_count, 2)
+
+        llm.clear_cache("List jobs", response_format={"type": "json_object"})
+        self.assertEqual(llm.get_response("List jobs"), "1. Job")
+        self.assertEqual(llm.client.chat.completions.create.call_count, 2)
+
+    def test_use_cache_false_disables_cache(self):
+        self.assertIsNone(LLMInterface(use_cache=False).cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
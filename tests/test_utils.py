@@ -7,9 +7,15 @@ from anytree import Node, PreOrderIter
 from utils import (
     node_to_dict,
     save_hierarchy_to_file,
+    save_hierarchy_columns,
     save_hierarchy_to_markdown,
     dict_to_tree,
-    render_hierarchy_markdown
+    get_path_str,
+    render_hierarchy_markdown,
+    attach_children,
+    iter_unprocessed,
+    HierarchyArray,
+    JobNode
 )
 
 
@@ -219,23 +225,21 @@ class TestUtils(unittest.TestCase):
         Test that save_hierarchy_to_file correctly writes the hierarchy to a JSON file.
         """
         with patch('builtins.open', mock_open()) as mocked_file:
-            save_hierarchy_to_file(self.root, 'test_hierarchy.json')
+            json_bytes = save_hierarchy_to_file(self.root, 'test_hierarchy.json')
 
             # Ensure open was called correctly
-            mocked_file.assert_called_once_with('test_hierarchy.json', 'w')
+            mocked_file.assert_called_once_with('test_hierarchy.json', 'wb')
 
             # Retrieve the handle to the mock file
             handle = mocked_file()
 
-            # Expected JSON string
-            expected_dict = node_to_dict(self.root)
-            expected_json = json.dumps(expected_dict, indent=4)
-
             # Retrieve all write calls and concatenate them
-            written_data = ''.join(call.args[0] for call in handle.write.call_args_list)
+            written_data = b''.join(call.args[0] for call in handle.write.call_args_list)
 
-            # Assert that the concatenated write calls match the expected JSON
-            self.assertEqual(written_data, expected_json)
+            # Assert that the written bytes decode to the expected hierarchy
+            self.assertEqual(json.loads(written_data), node_to_dict(self.root))
+            # The returned bytes are exactly what was written, for reuse without a re-read
+            self.assertEqual(json_bytes, written_data)
 
 
     def test_save_hierarchy_to_markdown(self):
@@ -247,7 +251,7 @@ class TestUtils(unittest.TestCase):
         mock_json_str = json.dumps(mock_json_data)
 
         # Create two separate mock_open instances
-        m_open_read = mock_open(read_data=mock_json_str)
+        m_open_read = mock_open(read_data=mock_json_str.encode("utf-8"))
         m_open_write = mock_open()
 
         # Use side_effect to return different mocks based on the order of open calls
@@ -255,7 +259,7 @@ class TestUtils(unittest.TestCase):
             save_hierarchy_to_markdown('test_hierarchy.json', 'test_hierarchy.md')
 
             # Check that open was called correctly for reading
-            mocked_file.assert_any_call('test_hierarchy.json', 'r')
+            mocked_file.assert_any_call('test_hierarchy.json', 'rb')
 
             # Check that open was called correctly for writing
             mocked_file.assert_any_call('test_hierarchy.md', 'w')
@@ -276,6 +280,8 @@ class TestUtils(unittest.TestCase):
         hierarchy_dict = node_to_dict(self.root)
         reconstructed_root = dict_to_tree(hierarchy_dict)
 
+        self.assertIsInstance(reconstructed_root, JobNode)
+
         # Compare the original and reconstructed trees
         original_names = [node.name for node in PreOrderIter(self.root)]
         reconstructed_names = [node.name for node in PreOrderIter(reconstructed_root)]
@@ -313,6 +319,136 @@ class TestUtils(unittest.TestCase):
         result_text = render_hierarchy_markdown(root)
         self.assertEqual(result_text, expected_text)
 
+    def test_attach_children_appends_all_items_at_once(self):
+        """
+        Test that attach_children links new nodes of the parent's class exactly like setting .parent.
+        """
+        items = [{'name': 'Open an account', 'description': 'First'}, {'name': 'Close an account'}]
+        for parent in (Node("Account Manager", parent=Node("Finance")),
+                       JobNode("Account Manager", parent=JobNode("Finance"))):
+            existing = type(parent)("Existing", parent=parent)
+
+            children = attach_children(parent, items)
+
+            self.assertEqual(parent.children, (existing, *children))
+            self.assertTrue(all(type(child) is type(parent) for child in children))
+            self.assertEqual([child.name for child in children], ['Open an account', 'Close an account'])
+            self.assertEqual(children[1].description, '')
+            self.assertFalse(children[0].processed)
+            self.assertEqual(children[0].path[0].name, "Finance")
+            # Links stay consistent for later detaches
+            children[0].parent = None
+            self.assertEqual(parent.children, (existing, children[1]))
+
+    def test_iter_unprocessed_skips_processed_subtrees(self):
+        """
+        Test that iter_unprocessed yields pending leaves in pre-order and prunes processed subtrees.
+        """
+        root = JobNode("Finance")
+        banking = JobNode("Banking", parent=root)
+        done = JobNode("Open an account", parent=banking, processed=True)
+        JobNode("Job Contexts", parent=done)
+        JobNode("Apply for a loan", parent=banking)
+        JobNode("Close an account", parent=banking, processed=True)
+        JobNode("File a claim", parent=JobNode("Insurance", parent=root))
+
+        self.assertEqual([node.name for node in iter_unprocessed(root)], ["Apply for a loan", "File a claim"])
+
+    def test_hierarchy_array_finds_leaves_and_round_trips(self):
+        """
+        Test that HierarchyArray lists leaves and paths in pre-order and rebuilds an identical tree.
+        """
+        array = HierarchyArray.from_tree(self.root)
+
+        self.assertEqual(len(array), len(list(PreOrderIter(self.root))))
+        self.assertEqual([array.names[i] for i in array.leaf_ids()],
+                         [node.name for node in PreOrderIter(self.root) if node.is_leaf])
+
+        self.assertEqual(array.paths(sep=" -> "),
+                         [" -> ".join(n.name for n in node.path) for node in PreOrderIter(self.root)])
+
+        rebuilt = array.to_tree()
+        self.assertEqual(node_to_dict(rebuilt), node_to_dict(self.root))
+
+    def test_columnar_save_round_trips_through_dict_to_tree(self):
+        """
+        Test that a hierarchy saved as parallel columns loads back into the same tree.
+        """
+        with patch("builtins.open", mock_open()) as mocked_file:
+            json_bytes = save_hierarchy_columns(self.root, "hierarchy.json")
+        mocked_file().write.assert_called_once_with(json_bytes)
+
+        columns = json.loads(json_bytes)
+        self.assertEqual(set(columns), {"parents", "names", "descriptions", "processed"})
+        self.assertEqual(columns["parents"][0], -1)
+        self.assertEqual(node_to_dict(dict_to_tree(columns)), node_to_dict(self.root))
+
+    def test_save_hierarchy_to_markdown_from_root_node(self):
+        """
+        Test that save_hierarchy_to_markdown renders an in-memory tree without reading any JSON file.
+        """
+        with patch('builtins.open', mock_open()) as mocked_file:
+            save_hierarchy_to_markdown(self.root, 'test_hierarchy.md')
+
+            mocked_file.assert_called_once_with('test_hierarchy.md', 'w')
+            mocked_file().write.assert_called_once_with(render_hierarchy_markdown(self.root))
+
+    def test_dict_to_tree_handles_deep_hierarchies(self):
+        """
+        Test that dict_to_tree and node_to_dict handle hierarchies deeper than the recursion limit.
+        """
+        depth = 2000
+        node_dict = {"name": "Level 0", "children": []}
+        current = node_dict
+        for level in range(1, depth):
+            child = {"name": f"Level {level}", "children": []}
+            current["children"].append(child)
+            current = child
+
+        root = dict_to_tree(node_dict)
+
+        deepest = root
+        while deepest.children:
+            deepest = deepest.children[0]
+        self.assertEqual(deepest.name, f"Level {depth - 1}")
+        self.assertEqual(deepest.depth, depth - 1)
+
+        # The symmetric serializer walks the same depth without recursing
+        current = node_to_dict(root)
+        for _ in range(1, depth):
+            current = current["children"][0]
+        self.assertEqual(current["name"], f"Level {depth - 1}")
+
+    def test_get_path_str_caches_on_ancestors(self):
+        """
+        Test that get_path_str joins names from the root and caches the result on each node.
+        """
+        personal_banker = next(node for node in PreOrderIter(self.root) if node.name == "Personal Banker")
+
+        path_str = get_path_str(personal_banker)
+
+        self.assertEqual(path_str, "/".join(ancestor.name for ancestor in personal_banker.path))
+        self.assertEqual(personal_banker.path_str, path_str)
+        self.assertEqual(personal_banker.parent.path_str, path_str.rsplit("/", 1)[0])
+
+    def test_get_path_str_handles_deep_hierarchies(self):
+        """
+        Test that get_path_str works below the recursion limit's depth and reuses cached ancestors.
+        """
+        depth = 2000
+        node = JobNode("Level 0")
+        middle = None
+        for level in range(1, depth):
+            node = JobNode(f"Level {level}", parent=node)
+            if level == depth // 2:
+                middle = node
+        middle.path_str = "cached"
+
+        path_str = get_path_str(node)
+
+        self.assertEqual(path_str, "cached/" + "/".join(f"Level {level}" for level in range(depth // 2 + 1, depth)))
+        self.assertEqual(node.parent.path_str, path_str.rsplit("/", 1)[0])
+
 
 if __name__ == '__main__':
     unittest.main()
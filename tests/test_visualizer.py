@@ -2,7 +2,8 @@
 
 import unittest
 from anytree import Node
-from visualizer import Visualizer
+from utils import JobNode
+from visualizer import Visualizer, mark_hierarchy_changed
 import pandas as pd
 
 class TestVisualizer(unittest.TestCase):
@@ -35,6 +36,31 @@ class TestVisualizer(unittest.TestCase):
         # Reset index to ensure alignment
         pd.testing.assert_frame_equal(df.reset_index(drop=True), expected_df)
 
+    def test_get_dataframe_is_cached_until_marked_changed(self):
+        """
+        Test that get_dataframe reuses the prepared DataFrame until the hierarchy is marked as changed.
+        """
+        self.visualizer.get_dataframe(self.root)
+        self.retail_banking.processed = True
+        cached = self.visualizer.get_dataframe(self.root)
+        self.assertFalse(cached.loc[cached["Name"] == "Retail Banking", "Processed"].item())
+
+        mark_hierarchy_changed(self.root)
+        refreshed = self.visualizer.get_dataframe(self.root)
+        self.assertTrue(refreshed.loc[refreshed["Name"] == "Retail Banking", "Processed"].item())
+
+    def test_get_dataframe_does_not_serve_another_tree_with_the_same_shape(self):
+        """
+        Test that a different tree with the same root name and child count gets its own DataFrame.
+        """
+        self.visualizer.get_dataframe(self.root)
+        other = JobNode("Finance", description="Uploaded hierarchy")
+        JobNode("Insurance", parent=other)
+        JobNode("Lending", parent=other)
+
+        df = self.visualizer.get_dataframe(other)
+        self.assertEqual(list(df["Name"]), ["Finance", "Insurance", "Lending"])
+
     def test_find_node_by_name_exists(self):
         """
         Test that find_node_by_name returns the correct node when it exists.
@@ -1,27 +1,240 @@
 # utils.py
 import json
-from anytree import Node, RenderTree
+import os
+
+from anytree import LightNodeMixin
+
+try:
+    import orjson  # Optional: several times faster than the stdlib json on large hierarchies
+except ImportError:
+    orjson = None
+
+
+class JobNode(LightNodeMixin):
+    """
+    Slotted tree node used for built and loaded hierarchies. It keeps the anytree API
+    (.children, .path, PreOrderIter, RenderTree) but has no per-node __dict__, so large
+    hierarchies build faster and use less memory than with anytree.Node.
+    """
+    __slots__ = ["name", "description", "processed", "path_str", "cache_token"]
+
+    def __init__(self, name, parent=None, children=None, description="", processed=False):
+        self.name = name
+        self.description = description
+        self.processed = processed
+        self.parent = parent
+        if children:
+            self.children = children
+
+    def __repr__(self):
+        return f"JobNode({self.name!r}, processed={self.processed})"
+
+
+def attach_children(parent, items, processed=False):
+    """
+    Creates a child of parent's node class (Node or JobNode, which anytree cannot mix in one
+    tree) for each parsed item ({'name': ..., 'description': ...}) and attaches them through
+    one assignment to parent.children, rather than setting .parent once per child.
+    Returns the new children.
+    """
+    node_class = type(parent)
+    children = [node_class(item['name'], description=item.get('description', ''), processed=processed)
+                for item in items]
+    if children:
+        parent.children = (*parent.children, *children)
+    return children
+
+
+def iter_unprocessed(root):
+    """
+    Yields the unprocessed leaves (job nodes still needing work) under root in pre-order. A
+    processed node with children already holds its results, so its subtree is not descended.
+    """
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        children = node.children
+        if not children:
+            if not getattr(node, 'processed', False):
+                yield node
+        elif not getattr(node, 'processed', False):
+            stack.extend(reversed(children))
+
+
+def get_path_str(node):
+    """
+    Returns the "/"-joined names from the root to node, cached on each node along the path
+    so repeated lookups (e.g. on every Streamlit rerun) do not rebuild the string. Walks up to
+    the nearest cached ancestor and fills in the paths on the way back down, so deep
+    hierarchies cannot hit the recursion limit.
+    """
+    uncached = []
+    path_str = None
+    while node is not None:
+        path_str = getattr(node, 'path_str', None)
+        if path_str is not None:
+            break
+        uncached.append(node)
+        node = node.parent
+    for node in reversed(uncached):
+        path_str = node.name if path_str is None else f"{path_str}/{node.name}"
+        node.path_str = path_str
+    return path_str
+
+
+class HierarchyArray:
+    """
+    Structure-of-arrays copy of a tree for bulk, read-mostly work on large hierarchies: node i
+    has parents[i] (-1 for the root), names[i], descriptions[i] and processed[i], in pre-order.
+    Queries such as leaf_ids() and paths() are vectorized instead of walking node objects. When
+    built with from_tree, nodes[i] is the node object for id i.
+    """
+    def __init__(self, parents, names, descriptions, processed, nodes=None):
+        self.parents = parents
+        self.names = names
+        self.descriptions = descriptions
+        self.processed = processed
+        self.nodes = nodes
+
+    @classmethod
+    def from_tree(cls, root):
+        import numpy as np
+
+        parents, names, descriptions, processed, nodes = [], [], [], [], []
+        stack = [(root, -1)]
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = len(names)
+            nodes.append(node)
+            parents.append(parent_id)
+            names.append(node.name)
+            descriptions.append(getattr(node, 'description', ''))
+            processed.append(getattr(node, 'processed', False))
+            stack.extend((child, node_id) for child in reversed(node.children))
+        return cls(np.array(parents, dtype=np.int64), names, descriptions, np.array(processed, dtype=bool), nodes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def leaf_ids(self):
+        """
+        Ids of the nodes without children, i.e. the job nodes, in pre-order.
+        """
+        import numpy as np
+
+        # A node is a leaf exactly when no node names it as parent
+        return np.setdiff1d(np.arange(len(self)), self.parents)
+
+    def paths(self, ids=None, sep="/"):
+        """
+        Root-to-node paths for ids (all nodes by default). Ancestors are gathered one tree level
+        at a time for all ids together, via fancy indexing on the parent array.
+        """
+        import numpy as np
+
+        ids = np.arange(len(self)) if ids is None else np.asarray(ids, dtype=np.int64)
+        names = np.array(self.names, dtype=object)
+        levels = []
+        current = ids
+        while len(current) and (current >= 0).any():
+            valid = current >= 0
+            safe = np.where(valid, current, 0)
+            levels.append(np.where(valid, names[safe], None))
+            current = np.where(valid, self.parents[safe], -1)
+        return [sep.join(name for name in reversed(column) if name is not None)
+                for column in zip(*levels)] if levels else []
+
+    def to_tree(self, node_class=JobNode):
+        nodes = []
+        for parent_id, name, description, processed in zip(self.parents.tolist(), self.names,
+                                                           self.descriptions, self.processed.tolist()):
+            nodes.append(node_class(name, parent=nodes[parent_id] if parent_id >= 0 else None,
+                                    description=description, processed=processed))
+        return nodes[0] if nodes else None
+
+    def to_columns(self):
+        """
+        Returns the arrays as a dict of JSON-serializable columns, one list per field.
+        """
+        return {
+            "parents": self.parents.tolist(),
+            "names": self.names,
+            "descriptions": self.descriptions,
+            "processed": self.processed.tolist(),
+        }
+
+    @classmethod
+    def from_columns(cls, columns):
+        import numpy as np
+
+        return cls(np.asarray(columns["parents"], dtype=np.int64), list(columns["names"]),
+                   list(columns["descriptions"]), np.asarray(columns["processed"], dtype=bool))
+
+
+def dumps_json(obj):
+    """
+    Serializes obj to indented UTF-8 JSON bytes, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def loads_json(data):
+    """
+    Parses JSON from str or bytes, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 def node_to_dict(node):
     """
-    Recursively converts AnyTree nodes to dictionaries, including all relevant attributes.
+    Converts AnyTree nodes to dictionaries, including all relevant attributes. Walks the tree
+    with an explicit stack, mirroring dict_to_tree, so deep hierarchies cannot hit the recursion limit.
     """
-    return {
-        "name": node.name,
-        "description": getattr(node, 'description', "No description provided"),
-        "processed": getattr(node, 'processed', False),
-        "children": [node_to_dict(child) for child in node.children]
-    }
+    def as_dict(current):
+        return {
+            "name": current.name,
+            "description": getattr(current, 'description', "No description provided"),
+            "processed": getattr(current, 'processed', False),
+            "children": []
+        }
+
+    root_dict = as_dict(node)
+    stack = [(node, root_dict)]
+    while stack:
+        current, current_dict = stack.pop()
+        for child in current.children:
+            child_dict = as_dict(child)
+            current_dict["children"].append(child_dict)
+            stack.append((child, child_dict))
+    return root_dict
 
 
 def save_hierarchy_to_file(root, filename):
     """
-    Saves the hierarchy to a JSON file.
+    Saves the hierarchy to a JSON file and returns the serialized bytes that were written,
+    so callers can reuse them (e.g. for a download) without reading the file back.
     """
     hierarchy_dict = node_to_dict(root)
-    with open(filename, 'w') as f:
-        json.dump(hierarchy_dict, f, indent=4)
+    json_bytes = dumps_json(hierarchy_dict)
+    with open(filename, 'wb') as f:
+        f.write(json_bytes)
+    return json_bytes
+
+
+def save_hierarchy_columns(root, filename):
+    """
+    Saves the hierarchy as a dict of parallel columns (see HierarchyArray.to_columns) and returns
+    the bytes written. The columns repeat no keys per node, so the file is smaller and faster to
+    write and parse than the nested format; dict_to_tree reads both.
+    """
+    json_bytes = dumps_json(HierarchyArray.from_tree(root).to_columns())
+    with open(filename, 'wb') as f:
+        f.write(json_bytes)
+    return json_bytes
 
 
 def update_hierarchy_in_file(root, filename):
@@ -29,21 +242,36 @@ def update_hierarchy_in_file(root, filename):
     Updates the hierarchy JSON file incrementally based on the root node's current state.
     """
     hierarchy_dict = node_to_dict(root)
-    with open(filename, 'w') as f:
-        json.dump(hierarchy_dict, f, indent=4)
+    with open(filename, 'wb') as f:
+        f.write(dumps_json(hierarchy_dict))
 
 
 def dict_to_tree(node_dict, parent=None):
     """
-    Recursively converts a dictionary to an AnyTree Node.
+    Converts a dictionary to a tree of slotted JobNodes (or of parent's node class, when attaching
+    under an existing node). Uses an explicit stack rather than recursion, so deep hierarchies
+    cannot hit the recursion limit. Columnar dicts written by save_hierarchy_columns are accepted too.
     """
-    node = Node(node_dict['name'],
-                parent=parent,
-                description=node_dict.get('description', ''),
-                processed=node_dict.get('processed', False))
-    for child in node_dict.get('children', []):
-        dict_to_tree(child, parent=node)
-    return node
+    node_class = JobNode if parent is None else type(parent)
+    if 'parents' in node_dict:
+        root = HierarchyArray.from_columns(node_dict).to_tree(node_class)
+        if root is not None:
+            root.parent = parent
+        return root
+    root = node_class(node_dict['name'],
+                      parent=parent,
+                      description=node_dict.get('description', ''),
+                      processed=node_dict.get('processed', False))
+    stack = [(root, node_dict.get('children', []))]
+    while stack:
+        parent_node, children = stack.pop()
+        for child in children:
+            node = node_class(child['name'],
+                              parent=parent_node,
+                              description=child.get('description', ''),
+                              processed=child.get('processed', False))
+            stack.append((node, child.get('children', [])))
+    return root
 
 
 def render_hierarchy_markdown(root):
@@ -62,15 +290,21 @@ def render_hierarchy_markdown(root):
     return "\n".join(lines) + "\n"  # Add trailing newline
 
 
-def save_hierarchy_to_markdown(json_filename, markdown_filename):
+def save_hierarchy_to_markdown(source, markdown_filename):
     """
-    Loads the hierarchy from a JSON file, converts it to Markdown, and saves it to a Markdown file.
+    Converts a hierarchy to Markdown and saves it to a Markdown file. `source` is either the
+    root node of an in-memory tree or the path to a saved hierarchy JSON file; passing the
+    root avoids re-reading and re-parsing a JSON file that was just written. Returns the
+    Markdown text that was written.
     """
-    with open(json_filename, 'r') as f:
-        hierarchy_dict = json.load(f)
-
-    root = dict_to_tree(hierarchy_dict)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            hierarchy_dict = loads_json(f.read())
+        root = dict_to_tree(hierarchy_dict)
+    else:
+        root = source
 
     with open(markdown_filename, 'w') as f:
         markdown_text = render_hierarchy_markdown(root)
         f.write(markdown_text)
+    return markdown_text
@@ -1,9 +1,23 @@
 # visualizer.py
+import uuid
+
 import streamlit as st
 from anytree import PreOrderIter
 from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
 import pandas as pd
 
+# Session state entry holding (cache token, DataFrame) for the hierarchy last shown in this session
+DATAFRAME_STATE_KEY = "hierarchy_dataframe"
+
+
+def mark_hierarchy_changed(root):
+    """
+    Invalidates the cached grid data for root by giving it a fresh cache token. Call after a tree
+    is loaded or built, and after nodes are added or marked processed.
+    """
+    root.cache_token = uuid.uuid4().hex
+
+
 class Visualizer:
     def prepare_dataframe(self, root):
         """
@@ -21,11 +35,28 @@ class Visualizer:
         df = pd.DataFrame(data)
         return df
 
+    def get_dataframe(self, root):
+        """
+        Returns prepare_dataframe(root), kept in the session's state across Streamlit reruns
+        until the tree is marked as changed via mark_hierarchy_changed.
+        """
+        # The token lives on the root itself, so a different tree can never match it
+        token = getattr(root, 'cache_token', None)
+        if token is None:
+            mark_hierarchy_changed(root)
+            token = root.cache_token
+        cached = st.session_state.get(DATAFRAME_STATE_KEY)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        df = self.prepare_dataframe(root)
+        st.session_state[DATAFRAME_STATE_KEY] = (token, df)
+        return df
+
     def display_hierarchy(self, root):
         """
         Displays the hierarchy using AgGrid with tree data.
         """
-        df = self.prepare_dataframe(root)
+        df = self.get_dataframe(root)
 
         gb = GridOptionsBuilder.from_dataframe(df)
         # Remove or comment out the pagination configuration